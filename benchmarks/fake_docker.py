@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# stand-in for the docker CLI which simulates the commands used by the deployment.
+# latencies (in seconds) are read from FAKE_DOCKER_<COMMAND>_LATENCY, e.g. FAKE_DOCKER_BUILD_LATENCY=2
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+DEFAULT_LATENCY_BY_COMMAND = {
+    "login": 0.5,
+    "create": 1.0,
+    "inspect": 0.1,
+    "ls": 0.1,
+    "rm": 0.5,
+    "prune": 0.5,
+    "build": 5.0,
+    "bake": 5.0,
+    "imagetools": 1.0,
+}
+
+
+def sleep_for(command: str) -> None:
+    latency = os.getenv(f"FAKE_DOCKER_{command.upper()}_LATENCY")
+    time.sleep(
+        float(latency)
+        if latency is not None
+        else DEFAULT_LATENCY_BY_COMMAND.get(command, 0)
+    )
+
+
+# builders outlive a single fake docker call, like the builder containers of a real docker daemon
+BUILDER_STATE_DIR = Path(
+    os.getenv(
+        "FAKE_DOCKER_STATE_DIR", Path(tempfile.gettempdir()) / "fake-docker-builders"
+    )
+)
+
+
+def print_build_steps(target: str | None = None) -> None:
+    # "--progress plain" output as parsed by parse_buildx_cache_stats
+    prefix = f"{target} " if target is not None else ""
+    print("#1 [internal] load build definition from Dockerfile", file=sys.stderr)
+    print(f"#2 [{prefix}1/2] FROM docker.io/library/alpine", file=sys.stderr)
+    print("#2 CACHED", file=sys.stderr)
+    print(f"#3 [{prefix}2/2] RUN echo", file=sys.stderr)
+    print("#3 DONE 0.1s", file=sys.stderr)
+
+
+def main(args: list[str]) -> None:
+    if args[:1] == ["login"]:
+        sys.stdin.read()
+        sleep_for("login")
+        print("Login Succeeded")
+    elif args[:2] == ["buildx", "build"]:
+        sleep_for("build")
+        print_build_steps()
+        if "--metadata-file" in args:
+            with open(args[args.index("--metadata-file") + 1], "w") as fd:
+                digest = hashlib.sha256(" ".join(args).encode()).hexdigest()
+                json.dump({"containerimage.digest": f"sha256:{digest}"}, fd)
+    elif args[:2] == ["buildx", "bake"]:
+        bake_file = args[args.index("--file") + 1]
+        with open(bake_file, "r") as fd:
+            target_names = json.load(fd)["target"].keys()
+        sleep_for("bake")
+        for target_name in target_names:
+            print_build_steps(target_name)
+    elif args[:2] == ["buildx", "imagetools"]:
+        sleep_for("imagetools")
+    elif args[:2] == ["buildx", "create"]:
+        sleep_for("create")
+        BUILDER_STATE_DIR.mkdir(parents=True, exist_ok=True)
+        (BUILDER_STATE_DIR / args[args.index("--name") + 1]).touch()
+    elif args[:2] == ["buildx", "inspect"]:
+        sleep_for("inspect")
+        if not (BUILDER_STATE_DIR / args[-1]).is_file():
+            print(f"ERROR: no builder {args[-1]} found", file=sys.stderr)
+            sys.exit(1)
+        print(
+            f"Name:   {args[-1]}\nDriver: docker-container\n\nNodes:\nName:   {args[-1]}0\nStatus: running"
+        )
+    elif args[:2] == ["buildx", "ls"]:
+        sleep_for("ls")
+        print("NAME/NODE  DRIVER/ENDPOINT  STATUS")
+        for path in sorted(BUILDER_STATE_DIR.glob("*")):
+            print(
+                f"{path.name}  docker-container\n  {path.name}0  unix:///var/run/docker.sock  running"
+            )
+    elif args[:2] == ["buildx", "rm"]:
+        sleep_for("rm")
+        (BUILDER_STATE_DIR / args[-1]).unlink(missing_ok=True)
+    elif args[:2] == ["buildx", "prune"]:
+        sleep_for("prune")
+    else:
+        sleep_for(args[0] if args else "")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
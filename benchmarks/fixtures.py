@@ -0,0 +1,71 @@
+import copy
+from pathlib import Path
+import yaml
+
+
+EXAMPLE_DIR = Path(__file__).parent.parent / "examples" / "service-networking"
+SERVER_SERVICE_NAME = "web-server"
+CLIENT_SERVICE_NAME = "web-client"
+
+
+def _rename_service_ports(x_network: dict, service_name: str) -> dict:
+    # cloudmap names must be unique per namespace
+    x_network = copy.deepcopy(x_network)
+    service_ports = x_network["x-ecs_connect"]["MacroParameters"]["service_ports"]
+    for port_params in service_ports.values():
+        port_params["DnsName"] = service_name
+        port_params["CloudMapServiceName"] = service_name
+    return x_network
+
+
+def generate_fixture(
+    target_dir: Path, service_count: int, build_ratio: float = 0.5
+) -> tuple[Path, Path]:
+    # scales the service-networking example to service_count services by replicating its
+    # server/client pair. build_ratio of the services are built locally from a generated context.
+    # returns the paths of the docker compose and ecs compose-x files
+    with (EXAMPLE_DIR / "docker-compose.yaml").open("r") as fd:
+        example_compose = yaml.safe_load(fd)
+    with (EXAMPLE_DIR / "aws.yaml").open("r") as fd:
+        example_ecs_compose = yaml.safe_load(fd)
+
+    docker_compose = {k: v for k, v in example_compose.items() if k != "services"}
+    docker_compose["services"] = {}
+    ecs_compose = {k: v for k, v in example_ecs_compose.items() if k != "services"}
+    ecs_compose["services"] = {}
+
+    build_count = round(service_count * build_ratio)
+    for i in range(service_count):
+        pair_index = i // 2
+        template_name = SERVER_SERVICE_NAME if i % 2 == 0 else CLIENT_SERVICE_NAME
+        service_name = f"{template_name}-{pair_index}"
+        server_name = f"{SERVER_SERVICE_NAME}-{pair_index}"
+        client_name = f"{CLIENT_SERVICE_NAME}-{pair_index}"
+
+        service = copy.deepcopy(example_compose["services"][template_name])
+        if "depends_on" in service:
+            service["depends_on"] = [server_name]
+        if i < build_count:
+            context_dir = target_dir / "services" / service_name
+            context_dir.mkdir(parents=True, exist_ok=True)
+            (context_dir / "Dockerfile").write_text(
+                f"FROM {service.pop('image')}\nRUN echo {service_name} > /service-name\n"
+            )
+            service["build"] = {"context": f"./services/{service_name}"}
+        docker_compose["services"][service_name] = service
+
+        ecs_service = copy.deepcopy(example_ecs_compose["services"][template_name])
+        ecs_service["x-network"] = _rename_service_ports(
+            ecs_service["x-network"], service_name
+        )
+        if "Ingress" in ecs_service["x-network"]:
+            ecs_service["x-network"]["Ingress"]["Services"] = [{"Name": client_name}]
+        ecs_compose["services"][service_name] = ecs_service
+
+    docker_compose_path = target_dir / "docker-compose.yaml"
+    ecs_compose_path = target_dir / "aws.yaml"
+    with docker_compose_path.open("w") as fd:
+        yaml.dump(docker_compose, fd, sort_keys=False)
+    with ecs_compose_path.open("w") as fd:
+        yaml.dump(ecs_compose, fd, sort_keys=False)
+    return docker_compose_path, ecs_compose_path
@@ -0,0 +1,134 @@
+# runs a single benchmark scenario: one end to end deployment against a local AWS stand-in.
+# every scenario runs in its own process, so that its peak memory is measured in isolation
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+from collections import Counter
+from pathlib import Path
+from time import perf_counter
+
+REPO_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+from benchmarks.fixtures import generate_fixture
+
+
+FAKE_DOCKER_PATH = Path(__file__).parent / "fake_docker.py"
+BENCHMARK_REGION = "us-east-1"
+
+
+def install_fake_docker(bin_dir: Path) -> None:
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    (bin_dir / "docker").symlink_to(FAKE_DOCKER_PATH)
+    # every scenario starts without buildx builders
+    os.environ["FAKE_DOCKER_STATE_DIR"] = str(bin_dir / "docker-state")
+    os.environ["PATH"] = f"{bin_dir}{os.pathsep}{os.environ['PATH']}"
+
+
+def set_aws_environment(endpoint_url: str) -> None:
+    # all boto3 clients (including the ones of ecs_composex) are pointed to the stand-in
+    os.environ["AWS_ENDPOINT_URL"] = endpoint_url
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_REGION"] = BENCHMARK_REGION
+    os.environ["AWS_DEFAULT_REGION"] = BENCHMARK_REGION
+
+
+def run_scenario(
+    service_count: int,
+    endpoint_url: str,
+    work_dir: Path,
+    build_ratio: float = 0.5,
+    deployment_kwargs: dict | None = None,
+) -> dict:
+    set_aws_environment(endpoint_url)
+    install_fake_docker(work_dir / "bin")
+    os.environ["GITHUB_OUTPUT"] = str(work_dir / "github_output")
+    docker_compose_path, ecs_compose_path = generate_fixture(
+        work_dir, service_count, build_ratio=build_ratio
+    )
+    os.chdir(work_dir)
+
+    start_time = perf_counter()
+    from src.deploy import Deployment
+
+    import_time = perf_counter() - start_time
+
+    deployment = None
+    error = None
+    try:
+        deployment = Deployment(
+            cf_stack_prefix="bench",
+            env_name=f"s{service_count}",
+            aws_region=BENCHMARK_REGION,
+            git_branch="bench",
+            git_commit="0" * 8,
+            docker_compose_file=docker_compose_path.name,
+            ecs_composex_file=ecs_compose_path.name,
+            # every scenario starts cold
+            build_cache_mode="none",
+            render_cache_mode="none",
+            deployment_manifest=False,
+            **(deployment_kwargs or {}),
+        )
+        asyncio.run(deployment.run())
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    wall_time = perf_counter() - start_time
+
+    result = {
+        "service_count": service_count,
+        "build_ratio": build_ratio,
+        "wall_time": wall_time,
+        "import_time": import_time,
+        # kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "phases": {},
+        "counters": {},
+        "api_calls_by_operation": {},
+        "error": error,
+    }
+    if deployment is not None and deployment.cf_main_timings_path.is_file():
+        with deployment.cf_main_timings_path.open("r") as fd:
+            timings = json.load(fd)
+        result["phases"] = {
+            s["name"]: s["duration"] for s in timings["spans"] if s["kind"] == "phase"
+        }
+        result["counters"] = timings["counters"]
+        result["api_calls_by_operation"] = dict(
+            Counter(s["name"] for s in timings["spans"] if s["kind"] == "aws")
+        )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a single benchmark scenario")
+    parser.add_argument("--services", type=int, required=True)
+    parser.add_argument("--build-ratio", type=float, default=0.5)
+    parser.add_argument("--endpoint-url", required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument(
+        "--deployment-kwargs",
+        default="{}",
+        help="JSON object of additional Deployment arguments",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="deploy-benchmark-") as work_dir:
+        result = run_scenario(
+            service_count=args.services,
+            endpoint_url=args.endpoint_url,
+            work_dir=Path(work_dir),
+            build_ratio=args.build_ratio,
+            deployment_kwargs=json.loads(args.deployment_kwargs),
+        )
+    with open(args.output, "w") as fd:
+        json.dump(result, fd, indent=2)
+
+
+if __name__ == "__main__":
+    main()
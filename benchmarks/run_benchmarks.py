@@ -0,0 +1,198 @@
+# end to end deployment benchmarks against a local AWS stand-in (moto server) and a fake docker CLI.
+#
+#   python -m benchmarks.run_benchmarks --services 2 10 50 100 --save-baseline main
+#   python -m benchmarks.run_benchmarks --services 2 10 50 100 --compare main
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from time import monotonic, sleep
+
+
+BASELINE_DIR = Path(__file__).parent / "baselines"
+DEFAULT_SERVICE_COUNTS = [2, 10, 50, 100]
+# relative increase of the wall time which counts as a regression
+DEFAULT_MAX_REGRESSION = 0.2
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_moto_server(port: int, timeout: float = 30) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "moto.server", "-p", str(port)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            sleep(0.1)
+    process.kill()
+    raise TimeoutError(f"moto server did not start within {timeout}s")
+
+
+def run_scenario(
+    service_count: int, build_ratio: float, deployment_kwargs: dict
+) -> dict:
+    # a fresh moto server per scenario, so that no scenario sees the state of another one
+    port = get_free_port()
+    moto_process = start_moto_server(port)
+    try:
+        with tempfile.NamedTemporaryFile(suffix=".json") as output_file:
+            subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.harness",
+                    "--services",
+                    str(service_count),
+                    "--build-ratio",
+                    str(build_ratio),
+                    "--endpoint-url",
+                    f"http://127.0.0.1:{port}",
+                    "--output",
+                    output_file.name,
+                    "--deployment-kwargs",
+                    json.dumps(deployment_kwargs),
+                ],
+                check=True,
+                cwd=Path(__file__).parent.parent,
+            )
+            with open(output_file.name, "r") as fd:
+                return json.load(fd)
+    finally:
+        moto_process.terminate()
+        moto_process.wait()
+
+
+def format_results(
+    result_by_scenario: dict[str, dict], baseline_by_scenario: dict[str, dict] | None
+) -> str:
+    def delta(value: float, baseline_value: float | None) -> str:
+        if baseline_value is None or baseline_value == 0:
+            return ""
+        return f" ({(value - baseline_value) / baseline_value:+.0%})"
+
+    lines = [
+        "| Scenario | Wall time | Import time | AWS API calls | Peak memory | Slowest phase | Error |",
+        "| --- | ---: | ---: | ---: | ---: | --- | --- |",
+    ]
+    for scenario, result in result_by_scenario.items():
+        baseline = (baseline_by_scenario or {}).get(scenario, {})
+        api_calls = result["counters"].get("api_calls", 0)
+        slowest_phase = max(
+            result["phases"].items(), key=lambda item: item[1], default=("-", 0)
+        )
+        lines.append(
+            f"| {scenario} "
+            f"| {result['wall_time']:.1f}s{delta(result['wall_time'], baseline.get('wall_time'))} "
+            f"| {result['import_time']:.2f}s "
+            f"| {api_calls}{delta(api_calls, baseline.get('counters', {}).get('api_calls'))} "
+            f"| {result['peak_rss_mb']:.0f} MB{delta(result['peak_rss_mb'], baseline.get('peak_rss_mb'))} "
+            f"| {slowest_phase[0]} ({slowest_phase[1]:.1f}s) "
+            f"| {result['error'] or ''} |"
+        )
+    return "\n".join(lines)
+
+
+def get_regressions(
+    result_by_scenario: dict[str, dict],
+    baseline_by_scenario: dict[str, dict],
+    max_regression: float,
+) -> list[str]:
+    regressions = []
+    for scenario, result in result_by_scenario.items():
+        baseline = baseline_by_scenario.get(scenario)
+        if baseline is None:
+            continue
+        if result["wall_time"] > baseline["wall_time"] * (1 + max_regression):
+            regressions.append(
+                f"{scenario}: wall time {baseline['wall_time']:.1f}s -> {result['wall_time']:.1f}s"
+            )
+        if result["counters"].get("api_calls", 0) > baseline["counters"].get(
+            "api_calls", 0
+        ):
+            regressions.append(
+                f"{scenario}: AWS API calls {baseline['counters'].get('api_calls', 0)} -> {result['counters'].get('api_calls', 0)}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run end to end deployment benchmarks")
+    parser.add_argument(
+        "--services", type=int, nargs="+", default=DEFAULT_SERVICE_COUNTS
+    )
+    parser.add_argument(
+        "--build-ratio",
+        type=float,
+        default=0.5,
+        help="Share of services built locally",
+    )
+    parser.add_argument(
+        "--docker-latency",
+        action="append",
+        default=[],
+        metavar="COMMAND=SECONDS",
+        help="Latency of a fake docker command, e.g. build=2 (repeatable)",
+    )
+    parser.add_argument(
+        "--deployment-kwargs",
+        default="{}",
+        help='JSON object of additional Deployment arguments, e.g. {"build_engine": "bake"}',
+    )
+    parser.add_argument("--output", help="Write all results to this JSON file")
+    parser.add_argument("--save-baseline", metavar="NAME")
+    parser.add_argument("--compare", metavar="NAME")
+    parser.add_argument("--max-regression", type=float, default=DEFAULT_MAX_REGRESSION)
+    args = parser.parse_args()
+
+    for latency in args.docker_latency:
+        command, seconds = latency.split("=")
+        os.environ[f"FAKE_DOCKER_{command.upper()}_LATENCY"] = seconds
+
+    result_by_scenario = {}
+    for service_count in args.services:
+        scenario = f"services-{service_count}"
+        print(f"Running scenario {scenario} ...", file=sys.stderr)
+        result_by_scenario[scenario] = run_scenario(
+            service_count, args.build_ratio, json.loads(args.deployment_kwargs)
+        )
+
+    baseline_by_scenario = None
+    if args.compare is not None:
+        with (BASELINE_DIR / f"{args.compare}.json").open("r") as fd:
+            baseline_by_scenario = json.load(fd)
+
+    print(format_results(result_by_scenario, baseline_by_scenario))
+
+    if args.output is not None:
+        with open(args.output, "w") as fd:
+            json.dump(result_by_scenario, fd, indent=2)
+    if args.save_baseline is not None:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        with (BASELINE_DIR / f"{args.save_baseline}.json").open("w") as fd:
+            json.dump(result_by_scenario, fd, indent=2)
+
+    if baseline_by_scenario is not None:
+        regressions = get_regressions(
+            result_by_scenario, baseline_by_scenario, args.max_regression
+        )
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
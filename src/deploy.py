@@ -1,23 +1,81 @@
 import asyncio
+import hashlib
 import json
 import shutil
 import os
 import string
+import threading
 import base64
+from functools import cached_property, partial
 from typing import Callable
 from pathlib import Path
 from datetime import datetime
-import yaml
-import boto3
+from importlib.metadata import PackageNotFoundError, version
 from slugify import slugify
-from ecs_composex.ecs_composex import generate_full_template
-from ecs_composex.common.settings import ComposeXSettings
-from ecs_composex.common.stacks import process_stacks
+from src.utils.aws_session import AwsSession
 from src.utils.cloudformation_deployer import CloudFormationDeployer
 from src.utils.logger import get_logger
 from src.utils.to_pascal_case import to_pascal_case
 from src.utils.generate_random_id import generate_random_id
 from src.utils.run_cmd import run_cmd_async
+from src.utils.build_planner import (
+    BuildGroup,
+    get_platform_slug,
+    parse_build_spec,
+    plan_builds,
+)
+from src.utils.build_cache import (
+    BUILD_CACHE_REPO_SUFFIX,
+    BUILD_CACHE_TAG,
+    BuildxCache,
+    is_buildx_step_line,
+    parse_buildx_cache_stats,
+)
+from src.utils.build_scheduler import BuildScheduler
+from src.utils.buildx_builder import DEFAULT_BUILDER_MAX_IDLE_DAYS, BuildxBuilder
+from src.utils.buildx_bake import (
+    BUILD_ENGINES,
+    get_bake_definition,
+    get_bake_target,
+    get_bake_target_name,
+)
+from src.utils.ecr_helper import (
+    ecr_find_image_tags,
+    ecr_get_image_digest,
+    ecr_get_image_layer_stats,
+    ecr_image_tag_exists,
+    ecr_list_repository_names,
+    ecr_retag_image,
+    split_image_uri,
+)
+from src.utils.ecs_account_settings import EcsAccountSettings
+from src.utils.ecs_fast_deployer import EcsFastDeployer
+from src.utils.deployment_manifest import DeploymentManifest, get_fingerprint
+from src.utils.handoff_manifest import PIPELINE_PHASES, HandoffManifest
+from src.utils.image_output import (
+    IMAGE_COMPRESSIONS,
+    get_image_output,
+    get_image_output_options,
+)
+from src.utils.pull_through_cache import (
+    get_cached_image_uri,
+    get_pull_through_cache_rule,
+    get_upstream_registry,
+    pull_cached_image_manifest,
+)
+from src.utils.render_cache import RenderCache, replace_all
+from src.utils.template_compactor import compact_templates
+from src.utils.yaml_io import TEMPLATE_FORMATS, dump_template, yaml_dump, yaml_load
+from src.utils.s3_uploader import S3Uploader
+from src.utils.soci_index import SociIndexer
+from src.utils.task_graph import TaskGraph, run_if
+from src.utils.tracing import (
+    Span,
+    get_summary_markdown,
+    tracer,
+    write_otlp_json,
+    write_timings_json,
+)
 from src.utils.github_helper import git_get_branch_and_hash
 
 
@@ -28,6 +86,32 @@ DEFAULT_IMAGE_URI_FORMAT = "{aws_account_id}.dkr.ecr.{aws_region}.amazonaws.com/
 DEFAULT_ENVIRONMENT = "dev"
 DEFAULT_TEMP_DIR = "_deployment_tmp"
 DEFAULT_ECS_COMPOSEX_OUTPUT_DIR = f"{DEFAULT_TEMP_DIR}/cf_output"
+# max size of a template passed inline with TemplateBody, larger templates must be uploaded to S3
+CF_TEMPLATE_BODY_MAX_SIZE = 51200
+DEFAULT_BUILD_CACHE_DIR = "/tmp/.buildx-cache"
+DEFAULT_BUILD_CACHE_MAX_SIZE_MB = 5 * 1024
+DEFAULT_RENDER_CACHE_DIR = "/tmp/.render-cache"
+DEFAULT_RENDER_CACHE_MAX_SIZE_MB = 256
+# https://github.com/compose-x/ecs_composex/blob/ff97d079113de5b1660c1beeafb24c8610971d10/ecs_composex/utils/init_ecs.py#L11
+ECS_ACCOUNT_SETTINGS = {
+    "awsvpcTrunking": "enabled",
+    "serviceLongArnFormat": "enabled",
+    "taskLongArnFormat": "enabled",
+    "containerInstanceLongArnFormat": "enabled",
+    "containerInsights": "enabled",
+}
+
+
+def get_ecs_composex_version() -> str | None:
+    try:
+        return version("ecs_composex")
+    except PackageNotFoundError:
+        return None
+
+
+# ecs_composex reads the region from the environment and is not known to be thread safe,
+# so concurrent deployments (of several targets) render one at a time
+CF_RENDER_LOCK = threading.Lock()
 
 
 class Deployment:
@@ -42,8 +126,42 @@ class Deployment:
         ecs_composex_file: str | None = None,
         ecr_keep_last_n_images: int | None = 10,
         image_uri_format: str = DEFAULT_IMAGE_URI_FORMAT,
+        ecr_pull_through_cache: bool = False,
+        ecr_pull_through_credentials: dict[str, str] | None = None,
         temp_dir: str = DEFAULT_TEMP_DIR,
         keep_temp_files: bool = True,
+        build_cache_mode: str = "local",
+        build_cache_dir: str = DEFAULT_BUILD_CACHE_DIR,
+        build_cache_max_size_mb: int | None = DEFAULT_BUILD_CACHE_MAX_SIZE_MB,
+        build_engine: str = "build",
+        image_compression: str = "gzip",
+        soci_index: bool = False,
+        buildx_driver: str = "docker-container",
+        buildx_endpoint: str | None = None,
+        buildx_driver_opts: list[str] | None = None,
+        buildx_max_cache_size_mb: int | None = None,
+        buildx_max_idle_days: int | None = DEFAULT_BUILDER_MAX_IDLE_DAYS,
+        buildx_platform_endpoints: dict[str, str] | None = None,
+        max_parallel_builds: int | None = None,
+        build_fail_fast: bool = True,
+        cf_fail_fast: bool = False,
+        cache_stack_outputs: bool = False,
+        s3_upload_manifest: bool = False,
+        deployment_manifest: bool = True,
+        render_cache_mode: str = "local",
+        render_cache_dir: str = DEFAULT_RENDER_CACHE_DIR,
+        render_cache_max_size_mb: int | None = DEFAULT_RENDER_CACHE_MAX_SIZE_MB,
+        cf_template_format: str = "yaml",
+        cf_compact_templates: bool = False,
+        cf_hoist_literals: bool = False,
+        ecs_fast_deploy: bool = False,
+        phases: list[str] | None = None,
+        build_services: list[str] | None = None,
+        handoff_path: str | None = None,
+        handoff_inputs: list[str] | None = None,
+        trace_export_path: str | None = None,
+        image_source: "Deployment | None" = None,
+        ci_bucket_region_suffix: bool = False,
     ):
         self.cf_stack_prefix = slugify(cf_stack_prefix)
         self.env_name = slugify(env_name or DEFAULT_ENVIRONMENT)
@@ -56,11 +174,61 @@ class Deployment:
         )
         self.ecr_keep_last_n_images = ecr_keep_last_n_images
         self.image_uri_format = image_uri_format
+        # external images are pulled through ECR in the stack's region.
+        # credentials (Secrets Manager secret ARNs) are needed for some registries, e.g. docker.io
+        self.ecr_pull_through_cache = ecr_pull_through_cache
+        self.ecr_pull_through_credentials = ecr_pull_through_credentials or {}
+        self.build_cache = BuildxCache(
+            mode=build_cache_mode,
+            cache_dir=build_cache_dir,
+            max_size_mb=build_cache_max_size_mb,
+        )
+        if build_engine not in BUILD_ENGINES:
+            raise ValueError(
+                f"Invalid build engine '{build_engine}'. Must be one of: {', '.join(BUILD_ENGINES)}"
+            )
+        self.build_engine = build_engine
+        if image_compression not in IMAGE_COMPRESSIONS:
+            raise ValueError(
+                f"Invalid image compression '{image_compression}'. Must be one of: {', '.join(IMAGE_COMPRESSIONS)}"
+            )
+        self.image_compression = image_compression
+        self.soci_index = soci_index
+        self.buildx_builder = BuildxBuilder(
+            self.cf_stack_prefix,
+            driver=buildx_driver,
+            endpoint=buildx_endpoint,
+            driver_opts=buildx_driver_opts,
+            max_cache_size_mb=buildx_max_cache_size_mb,
+            max_idle_days=buildx_max_idle_days,
+            platform_endpoints=buildx_platform_endpoints,
+        )
+        self.build_scheduler = BuildScheduler(
+            max_parallel=max_parallel_builds, fail_fast=build_fail_fast
+        )
+        self.docker_cache_stats_by_service_name = {}
+        # all phases run in this job by default
+        if phases is not None and any(p not in PIPELINE_PHASES for p in phases):
+            raise ValueError(
+                f"Invalid phases '{', '.join(phases)}'. Must be any of: {', '.join(PIPELINE_PHASES)}"
+            )
+        self.phases = phases or PIPELINE_PHASES
+        # subset of services built by this job, e.g. one shard of a build matrix
+        self.build_services = build_services
 
         # compose internal params
         self.stack_name = f"{self.cf_stack_prefix}-{self.env_name}"
         self.ci_stack_name = f"{self.cf_stack_prefix}-{self.env_name}-ci"
         self.ci_s3_bucket_name = f"{self.cf_stack_prefix}-{self.env_name}-ci"
+        if ci_bucket_region_suffix:
+            # bucket names are global, the same environment in another region needs its own
+            self.ci_s3_bucket_name = f"{self.ci_s3_bucket_name}-{aws_region}"
+        # deployment of another target (e.g. region) which builds the images.
+        # they are copied from its registry instead of being built again
+        self.image_source = image_source
+        # set once the images of this deployment are pushed (or the deployment failed)
+        self.images_pushed = asyncio.Event()
+        self.pushed_image_uri_by_service_name: dict[str, str] | None = None
 
         if git_branch is not None and git_commit is not None:
             self.git_branch = git_branch
@@ -71,11 +239,33 @@ class Deployment:
         ts_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S_") + generate_random_id(6)
 
         self.ci_s3_key_prefix = f"{self.stack_name}/{ts_str}"
+        self.ci_s3_templates_prefix = f"{self.stack_name}/templates"
+        self.cf_template_key_by_filename = {}
+        self.cf_template_body_by_filename = {}
+        if cf_template_format not in TEMPLATE_FORMATS:
+            raise ValueError(
+                f"Invalid template format '{cf_template_format}'. Must be one of: {', '.join(TEMPLATE_FORMATS)}"
+            )
+        # compaction implies minified JSON templates
+        self.cf_template_format = "json" if cf_compact_templates else cf_template_format
+        self.cf_compact_templates = cf_compact_templates
+        self.cf_hoist_literals = cf_hoist_literals
         self.keep_temp_files = keep_temp_files
         self.temp_dir = Path(temp_dir) / ts_str
+        # persistent across runs (unlike temp_dir, which is unique per run)
+        self.cache_dir = Path(temp_dir) / "cache"
+        self.cache_dir.mkdir(exist_ok=True, parents=True)
+        self.cache_stack_outputs = cache_stack_outputs
         self.cf_main_dir = Path(self.temp_dir) / "cf_main"
         self.cf_main_dir.mkdir(exist_ok=True, parents=True)
         self.cf_main_output_path = self.cf_main_dir / "outputs.json"
+        self.cf_main_timings_path = self.cf_main_dir / "timings.json"
+        self.handoff = HandoffManifest(self.stack_name, self.git_commit)
+        self.handoff_path = Path(handoff_path) if handoff_path is not None else None
+        self.handoff_inputs = handoff_inputs or []
+        self.trace_export_path = (
+            Path(trace_export_path) if trace_export_path is not None else None
+        )
         self.cf_disable_rollback = False
 
         self.ecs_compose_path = (
@@ -87,64 +277,568 @@ class Deployment:
         self.docker_compose_override_path = (
             Path(self.temp_dir) / f"docker-compose.override.yaml"
         )
+        self.docker_bake_path = Path(self.temp_dir) / "docker-bake.json"
+
+        # environment of this deployment, with redundant region vars since some libraries use
+        # AWS_DEFAULT_REGION while others use AWS_REGION. the process environment is shared by
+        # concurrent deployments (of several regions), so it is only changed while rendering
+        self.env = {
+            **os.environ,
+            "AWS_REGION": aws_region,
+            "AWS_DEFAULT_REGION": aws_region,
+        }
 
-        # set redundant env vars since some libraries use AWS_DEFAULT_REGION while others use AWS_REGION
-        os.environ["AWS_REGION"] = aws_region
-        os.environ["AWS_DEFAULT_REGION"] = aws_region
-
-        self.ecs_client = boto3.client("ecs", region_name=self.aws_region)
-        self.s3_client = boto3.client("s3", region_name=self.aws_region)
-        self.ecr_client = boto3.client("ecr", region_name=self.aws_region)
-        self.cfd = CloudFormationDeployer(region_name=self.aws_region)
-        self.aws_account_id = self.cfd.get_account_id()
+        # AWS clients, helpers which use them and the account ID are created on first use
+        self.aws = AwsSession(region_name=self.aws_region)
+        self.s3_upload_manifest = s3_upload_manifest
+        self.use_deployment_manifest = deployment_manifest
+        self.cf_fail_fast = cf_fail_fast
+        self.ecs_fast_deploy = ecs_fast_deploy
+        self.render_cache = RenderCache(
+            mode=render_cache_mode,
+            cache_dir=render_cache_dir,
+            max_size_mb=render_cache_max_size_mb,
+            # only the shared cache needs S3
+            s3_client=self.s3_client if render_cache_mode == "s3" else None,
+            bucket_name=self.ci_s3_bucket_name,
+            s3_prefix=f"{self.stack_name}/render-cache",
+        )
 
         print('REGION', self.aws_region)
 
+    @property
+    def ecs_client(self):
+        return self.aws.client("ecs")
+
+    @property
+    def s3_client(self):
+        return self.aws.client("s3")
+
+    @property
+    def ecr_client(self):
+        return self.aws.client("ecr")
+
+    @cached_property
+    def aws_account_id(self) -> str:
+        return self.aws.get_account_id()
+
+    @cached_property
+    def cfd(self) -> CloudFormationDeployer:
+        return CloudFormationDeployer(
+            region_name=self.aws_region,
+            fail_fast=self.cf_fail_fast,
+            aws_session=self.aws,
+        )
+
+    @cached_property
+    def s3_uploader(self) -> S3Uploader:
+        return S3Uploader(
+            self.s3_client,
+            bucket_name=self.ci_s3_bucket_name,
+            manifest_path=(
+                self.cache_dir / f"{self.ci_s3_bucket_name}-uploads.json"
+                if self.s3_upload_manifest
+                else None
+            ),
+        )
+
+    @cached_property
+    def deployment_manifest(self) -> DeploymentManifest:
+        return DeploymentManifest(
+            self.s3_client,
+            bucket_name=self.ci_s3_bucket_name,
+            s3_key=f"{self.stack_name}/deployment-manifest.json",
+        )
+
+    @cached_property
+    def ecs_fast_deployer(self) -> EcsFastDeployer:
+        return EcsFastDeployer(self.ecs_client)
+
+    @cached_property
+    def ecs_account_settings(self) -> EcsAccountSettings:
+        return EcsAccountSettings(
+            self.ecs_client,
+            account_id=self.aws_account_id,
+            region_name=self.aws_region,
+            cache_path=self.cache_dir
+            / f"ecs-account-settings-{self.aws_account_id}-{self.aws_region}.json",
+            s3_client=self.s3_client,
+            bucket_name=self.ci_s3_bucket_name,
+        )
+
     async def run(self):
+        try:
+            with tracer.span(
+                "deployment", kind="run", stack_name=self.stack_name
+            ) as root_span:
+                await self._run_task_graph()
+        finally:
+            # wake up deployments which copy the images of this one, also if it failed
+            self.images_pushed.set()
+            # timings are written for failed deployments, too
+            self._write_timings(root_span)
+
+        # delete temp dir
+        if self.keep_temp_files is not True:
+            shutil.rmtree(self.temp_dir)
+
+        # todo: keep only the last 10 versions of the ci stack on S3
+
+    async def _run_task_graph(self):
+        # the deployment runs as a task graph: every step starts as soon as its inputs are ready,
+        # so that e.g. image builds and template rendering overlap with the ci stack deployment
+        graph = TaskGraph()
+        results = graph.results
+
+        # the docker compose file is parsed once and shared by all steps
+        graph.add_task(
+            "compose", lambda: asyncio.to_thread(self._docker_load_compose)
+        )
         # compile future docker image URIs for locally built docker images
-        docker_image_uri_by_service_name = self._docker_get_image_uris_by_service_name()
+        graph.add_task(
+            "image_uris",
+            lambda: asyncio.to_thread(
+                self._docker_get_image_uris_by_service_name, results["compose"]
+            ),
+            depends_on=["compose"],
+        )
+        # external images which are pulled through the ECR pull through cache
+        graph.add_task(
+            "pull_through_images",
+            lambda: asyncio.to_thread(
+                self._ecr_get_pull_through_images, results["compose"]
+            ),
+            depends_on=["compose"],
+        )
+        graph.add_task("manifest_load", lambda: asyncio.to_thread(self._manifest_load))
+        graph.add_task(
+            "handoff_load",
+            lambda: asyncio.to_thread(self._handoff_load),
+            depends_on=["manifest_load"],
+        )
 
         # CloudFormation: ci stack (ECR repos for locally built docker images and ci bucket)
-        # note: ci cf template can't be uploaded to S3 because the ci bucket will be created in the ci stack
-        cf_ci_template = self._cf_ci_generate(docker_image_uri_by_service_name)
-        self._cf_ci_deploy(cf_ci_template)
+        graph.add_task(
+            "cf_ci_generate",
+            lambda: asyncio.to_thread(
+                self._cf_ci_generate,
+                results["image_uris"],
+                results["pull_through_images"],
+            ),
+            depends_on=["image_uris", "pull_through_images"],
+        )
 
         # Docker:
         # generate docker-compose.override.yaml which will add docker image URIs to services with local docker builds,
         # so that docker knows where to push the locally built images to
-        self._docker_generate_override_file(docker_image_uri_by_service_name)
-        await self._docker_login_ecr()
-        await self._docker_build_tag_push(docker_image_uri_by_service_name)
+        graph.add_task(
+            "docker_override_file",
+            lambda: asyncio.to_thread(
+                self._docker_generate_override_file,
+                results["image_uris"],
+                results["pull_through_images"],
+            ),
+            depends_on=["image_uris", "pull_through_images"],
+        )
+        graph.add_task(
+            "docker_plan",
+            lambda: asyncio.to_thread(
+                self._docker_plan_builds, results["compose"], results["image_uris"]
+            ),
+            depends_on=["image_uris"],
+        )
+        graph.add_task(
+            "cf_substitution", lambda: asyncio.to_thread(self._cf_handle_substitution)
+        )
+
+        # compare all inputs against the last successful deployment.
+        # if nothing changed, the remaining tasks are skipped and the previous outputs are returned
+        graph.add_task(
+            "manifest_check",
+            lambda: asyncio.to_thread(
+                self._manifest_check_inputs,
+                results["cf_ci_generate"],
+                results["docker_plan"],
+            ),
+            depends_on=[
+                "handoff_load",
+                "cf_ci_generate",
+                "docker_override_file",
+                "docker_plan",
+                "cf_substitution",
+            ],
+        )
+        is_changed_run = lambda: not results["manifest_check"]
+        # with phases running in separate jobs, each job only runs the tasks of its own phases
+        is_phase = lambda *phases: any(phase in self.phases for phase in phases)
+
+        # note: ci cf template can't be uploaded to S3 because the ci bucket will be created in the ci stack
+        graph.add_task(
+            "cf_ci_deploy",
+            run_if(
+                lambda: is_phase("build", "render")
+                and not self.deployment_manifest.is_unchanged("ci_template"),
+                lambda: asyncio.to_thread(self._cf_ci_deploy, results["cf_ci_generate"]),
+            ),
+            depends_on=["manifest_check"],
+        )
+
+        graph.add_task(
+            "docker_changed",
+            lambda: asyncio.to_thread(
+                self._docker_get_changed_build_groups, results["docker_plan"]
+            ),
+            depends_on=["manifest_check"],
+        )
+        has_builds = lambda: len(results["docker_changed"]) > 0
+        graph.add_task(
+            "docker_login",
+            run_if(has_builds, self._docker_login_ecr),
+            depends_on=["docker_changed"],
+        )
+        # images which already exist in ECR (by fingerprint) are reused instead of built.
+        # the lookup only reads existing repositories, so it does not wait for the ci stack
+        graph.add_task(
+            "docker_existing",
+            run_if(
+                has_builds,
+                lambda: self._docker_find_existing_images(results["docker_changed"]),
+            ),
+            depends_on=["docker_changed"],
+        )
+        get_new_build_groups = lambda: [
+            build_group
+            for build_group in results["docker_changed"]
+            if build_group.fingerprint not in (results["docker_existing"] or {})
+        ]
+        # with an image source, images are copied instead of built
+        has_local_builds = lambda: has_builds() and self.image_source is None
+        graph.add_task(
+            "docker_setup",
+            run_if(
+                has_local_builds,
+                lambda: self._docker_setup_buildx(results["docker_changed"]),
+            ),
+            depends_on=["docker_changed"],
+        )
+        # build while the ECR repositories are being created, push once they exist
+        graph.add_task(
+            "docker_prebuild",
+            run_if(
+                has_local_builds,
+                lambda: self._docker_prebuild(get_new_build_groups()),
+            ),
+            depends_on=["docker_setup", "docker_login", "docker_existing"],
+        )
+        graph.add_task(
+            "docker_push",
+            run_if(
+                has_builds,
+                lambda: self._docker_build_tag_push(
+                    results["docker_changed"], results["docker_existing"]
+                ),
+            ),
+            depends_on=["docker_prebuild", "cf_ci_deploy"],
+        )
+        graph.add_task(
+            "docker_pushed",
+            lambda: self._docker_set_images_pushed(results["image_uris"]),
+            depends_on=["docker_push"],
+        )
+        graph.add_task(
+            "handoff_images",
+            run_if(
+                lambda: is_phase("build") and self.handoff_path is not None,
+                lambda: asyncio.to_thread(
+                    self._handoff_set_images, results["docker_plan"]
+                ),
+            ),
+            depends_on=["docker_push"],
+        )
 
         # CloudFormation: main stack
-        self._cf_handle_substitution()
-        self._cf_generate()
-        self._cf_update(template_modifier=self._cf_update_template_urls)
-        self._cf_upload_to_s3()
-        self._cf_deploy()
-        self._cf_store_outputs()
+        # rendering only needs the image URIs, not the pushed images
+        is_changed_render = lambda: is_changed_run() and is_phase("render")
+        graph.add_task(
+            "cf_generate",
+            run_if(
+                is_changed_render,
+                lambda: asyncio.to_thread(self._cf_generate, results["image_uris"]),
+            ),
+            depends_on=["manifest_check"],
+        )
+        # share freshly rendered templates once the ci bucket exists
+        graph.add_task(
+            "cf_render_cache_upload",
+            run_if(
+                lambda: results["cf_generate"] is not None,
+                lambda: asyncio.to_thread(
+                    self.render_cache.upload, results["cf_generate"]
+                ),
+            ),
+            depends_on=["cf_generate", "cf_ci_deploy"],
+        )
+        graph.add_task(
+            "cf_update",
+            run_if(
+                is_changed_render,
+                lambda: asyncio.to_thread(
+                    self._cf_update,
+                    template_modifier=partial(
+                        self._cf_modify_templates,
+                        image_uri_by_service_name=results["image_uris"],
+                    ),
+                ),
+            ),
+            depends_on=["cf_generate"],
+        )
+        graph.add_task(
+            "cf_upload",
+            run_if(
+                lambda: is_changed_render()
+                and not self.deployment_manifest.is_unchanged("templates"),
+                lambda: asyncio.to_thread(self._cf_upload_to_s3),
+            ),
+            depends_on=["cf_update", "cf_ci_deploy"],
+        )
+        graph.add_task(
+            "ecr_pull_through_warm",
+            run_if(
+                lambda: is_changed_run()
+                and is_phase("deploy")
+                and len(results["pull_through_images"]) > 0,
+                lambda: self._ecr_warm_pull_through_cache(
+                    results["pull_through_images"]
+                ),
+            ),
+            depends_on=["cf_ci_deploy"],
+        )
+        graph.add_task(
+            "cf_deploy",
+            run_if(
+                lambda: is_changed_run() and is_phase("deploy"),
+                lambda: asyncio.to_thread(self._cf_deploy, results["image_uris"]),
+            ),
+            depends_on=["cf_upload", "docker_push", "ecr_pull_through_warm"],
+        )
+        graph.add_task(
+            "cf_outputs",
+            run_if(
+                lambda: is_phase("outputs"),
+                lambda: asyncio.to_thread(
+                    self._cf_store_outputs,
+                    use_previous_outputs=not self._is_stack_updated(
+                        results["cf_deploy"]
+                    ),
+                ),
+            ),
+            depends_on=["cf_deploy"],
+        )
+        graph.add_task(
+            "manifest_save",
+            run_if(
+                lambda: is_changed_run()
+                and is_phase("outputs")
+                and self.use_deployment_manifest,
+                lambda: asyncio.to_thread(
+                    self.deployment_manifest.save, results["cf_outputs"]
+                ),
+            ),
+            depends_on=["cf_outputs"],
+        )
+        graph.add_task(
+            "handoff_save",
+            run_if(
+                lambda: self.handoff_path is not None,
+                lambda: asyncio.to_thread(self._handoff_save, results["cf_deploy"]),
+            ),
+            depends_on=["manifest_save", "handoff_images", "cf_render_cache_upload"],
+        )
 
-        # delete temp dir
-        if self.keep_temp_files is not True:
-            shutil.rmtree(self.temp_dir)
+        await graph.run()
+
+    def _write_timings(self, root_span: Span) -> None:
+        write_timings_json(root_span, self.cf_main_timings_path)
+        if self.trace_export_path is not None:
+            write_otlp_json(root_span, self.trace_export_path)
+        if os.getenv("GITHUB_STEP_SUMMARY"):
+            with open(os.environ["GITHUB_STEP_SUMMARY"], "a") as fd:
+                fd.write(get_summary_markdown(root_span))
+        if os.getenv("GITHUB_OUTPUT"):
+            with open(os.environ["GITHUB_OUTPUT"], "a") as gh_output:
+                gh_output.write(
+                    f"timings-path={self.cf_main_timings_path.resolve()}\n"
+                )
 
-        # todo: keep only the last 10 versions of the ci stack on S3
+    def _manifest_load(self) -> None:
+        if self.use_deployment_manifest:
+            self.deployment_manifest.load()
+
+    def _handoff_load(self) -> None:
+        if len(self.handoff_inputs) == 0:
+            return
+        self.handoff.load(self.handoff_inputs)
+        # results of phases which ran in other jobs
+        self.deployment_manifest.inputs.update(self.handoff.inputs)
+        if self.handoff.template_key_by_filename is not None:
+            self.cf_template_key_by_filename = self.handoff.template_key_by_filename
+        if self.handoff.deploy_result is not None:
+            self.deployment_manifest.drifted_services = self.handoff.deploy_result[
+                "drifted_services"
+            ]
+
+    def _handoff_set_images(self, build_groups: list[BuildGroup]) -> None:
+        # records the pushed images of this job, including images reused from earlier deployments
+        for build_group in self._docker_get_own_build_groups(build_groups):
+            for service_name, image_uri in build_group.image_uri_by_service_name.items():
+                _, image_tag = split_image_uri(image_uri)
+                self.handoff.images[service_name] = {
+                    "uri": image_uri,
+                    "digest": ecr_get_image_digest(
+                        self.ecr_client,
+                        self._docker_get_repo_name_from_uri(image_uri),
+                        image_tag,
+                    ),
+                }
 
-    async def _docker_login_ecr(self) -> None:
-        # Get the ECR authorization token
+    def _handoff_check_deploy_inputs(
+        self, image_uri_by_service_name: dict[str, str]
+    ) -> None:
+        # the templates and images of a deployment may come from other jobs
+        if len(self.cf_template_key_by_filename) == 0:
+            raise ValueError(
+                "No rendered templates to deploy. Run the render phase first and pass its hand-off manifest"
+            )
+        if "build" in self.phases or len(self.handoff_inputs) == 0:
+            return
+        missing_service_names = [
+            service_name
+            for service_name, image_uri in image_uri_by_service_name.items()
+            if self.handoff.images.get(service_name, {}).get("uri") != image_uri
+        ]
+        if missing_service_names:
+            raise ValueError(
+                f"No pushed image for service(s) {', '.join(sorted(missing_service_names))} in the hand-off manifests"
+            )
+
+    def _handoff_save(self, cf_deploy_result: bool | None) -> None:
+        self.handoff.phases = [
+            phase
+            for phase in PIPELINE_PHASES
+            if phase in self.handoff.phases or phase in self.phases
+        ]
+        self.handoff.inputs.update(self.deployment_manifest.inputs)
+        if "render" in self.phases and len(self.cf_template_key_by_filename) > 0:
+            self.handoff.template_key_by_filename = self.cf_template_key_by_filename
+        if cf_deploy_result is not None:
+            self.handoff.deploy_result = {
+                "stack_updated": cf_deploy_result,
+                "drifted_services": self.deployment_manifest.drifted_services,
+            }
+        self.handoff.save(self.handoff_path)
+        if os.getenv("GITHUB_OUTPUT"):
+            with open(os.environ["GITHUB_OUTPUT"], "a") as gh_output:
+                gh_output.write(
+                    f"handoff-manifest-path={self.handoff_path.resolve()}\n"
+                )
+
+    def _is_stack_updated(self, cf_deploy_result: bool | None) -> bool:
+        # the deploy phase may have run in another job
+        if cf_deploy_result is not None:
+            return cf_deploy_result
+        return (
+            self.handoff.deploy_result is not None
+            and self.handoff.deploy_result["stack_updated"]
+        )
+
+    def _cf_get_render_inputs(self, image_uri_by_service_name: dict[str, str]) -> dict:
+        # everything the rendered templates depend on.
+        # image URIs of built services change with every commit, so they are replaced by placeholders
+        # and substituted into the templates after rendering (see _cf_get_image_placeholders)
+        compose_paths = [self.docker_compose_path, self.docker_compose_override_path]
+        if self.ecs_compose_path is not None:
+            compose_paths.append(self.ecs_compose_path)
+        image_placeholders = self._cf_get_image_placeholders(image_uri_by_service_name)
+        return {
+            "files": {
+                path.name: replace_all(path.read_text(), image_placeholders)
+                for path in compose_paths
+            },
+            "settings": {
+                "region": self.aws_region,
+                "bucket_name": self.ci_s3_bucket_name,
+                "stack_name": self.stack_name,
+                "disable_rollback": self.cf_disable_rollback,
+                "template_format": "yaml",
+            },
+            "ecs_composex_version": get_ecs_composex_version(),
+        }
+
+    def _manifest_check_inputs(
+        self, cf_ci_template: dict[str, dict], build_groups: list[BuildGroup]
+    ) -> bool:
+        # fingerprints all inputs of the deployment and returns True if none of them changed
+        # since the last successful deployment
+        manifest = self.deployment_manifest
+        manifest.set_input("ci_template", cf_ci_template)
+        # the image URIs are fingerprinted per service below
+        image_uri_by_service_name = {}
+        for build_group in build_groups:
+            image_uri_by_service_name.update(build_group.image_uri_by_service_name)
+        manifest.set_input(
+            "compose", self._cf_get_render_inputs(image_uri_by_service_name)
+        )
+        manifest.set_input(
+            "ecs_settings", [self.aws_account_id, self.aws_region, ECS_ACCOUNT_SETTINGS]
+        )
+        for build_group in build_groups:
+            for service_name, image_uri in build_group.image_uri_by_service_name.items():
+                # the content of remote (git) contexts is unknown, so they are always built
+                manifest.set_input(
+                    f"image:{service_name}",
+                    (
+                        [image_uri, build_group.fingerprint]
+                        if build_group.is_cacheable
+                        else None
+                    ),
+                )
+
+        if not manifest.is_unchanged(*manifest.inputs.keys()):
+            return False
+        # guard against changes made outside of this action, e.g. a deleted or rolled back stack
+        if not self.cfd.is_stack_deployed(self.stack_name):
+            logger.info(
+                f"Stack {self.stack_name} is not deployed. Ignoring deployment manifest."
+            )
+            manifest.previous = None
+            return False
+        logger.info(
+            f"Nothing changed since the last deployment at {manifest.previous['updated_at']}. Skipping deployment."
+        )
+        return True
+
+    def _ecr_get_credentials(self) -> tuple[str, str, str]:
+        # (username, password, registry url) from the ECR authorization token
         response = self.ecr_client.get_authorization_token()
         auth_data = response["authorizationData"][0]
         auth_token = auth_data["authorizationToken"]
         registry_url = auth_data["proxyEndpoint"]
         username, password = base64.b64decode(auth_token).decode("utf-8").split(":")
+        return username, password, registry_url
+
+    async def _docker_login_ecr(self) -> None:
+        username, password, registry_url = self._ecr_get_credentials()
         # Login to the ECR registry
         cmd = f"docker login --username {username} --password-stdin {registry_url}"
         await run_cmd_async(cmd, input=password.encode())
 
-    def _docker_get_image_uris_by_service_name(self) -> dict[str, str]:
+    def _docker_load_compose(self) -> dict:
         with self.docker_compose_path.open("r") as fd:
-            docker_compose = yaml.safe_load(fd.read())
+            return yaml_load(fd)
 
+    def _docker_get_image_uris_by_service_name(
+        self, docker_compose: dict
+    ) -> dict[str, str]:
         # Compose docker image URIs for private builds
         all_services = docker_compose.get("services", {})
         services_with_build = {
@@ -173,115 +867,703 @@ class Deployment:
     def _docker_get_repo_name_from_uri(image_uri: str) -> str:
         return image_uri.split(".amazonaws.com/")[-1].split(":")[0]
 
+    @property
+    def _ecr_registry(self) -> str:
+        return f"{self.aws_account_id}.dkr.ecr.{self.aws_region}.amazonaws.com"
+
+    def _ecr_get_pull_through_images(self, docker_compose: dict) -> dict[str, str]:
+        # external images (of services without a local build) from registries supported by
+        # ECR pull through cache rules, by service name
+        if not self.ecr_pull_through_cache:
+            return {}
+        image_by_service_name = {}
+        for service_name, service_params in docker_compose.get("services", {}).items():
+            image = service_params.get("image")
+            # unresolved variables are left to compose
+            if "build" in service_params or image is None or "$" in image:
+                continue
+            upstream = get_upstream_registry(image)
+            if upstream is None or (
+                upstream.requires_credentials
+                and upstream.name not in self.ecr_pull_through_credentials
+            ):
+                logger.debug(
+                    f"Image {image} of service {service_name} is not pulled through the ECR pull through cache"
+                )
+                continue
+            image_by_service_name[service_name] = image
+        return image_by_service_name
+
+    async def _ecr_warm_pull_through_cache(
+        self, pull_through_image_by_service_name: dict[str, str]
+    ) -> None:
+        username, password, _ = self._ecr_get_credentials()
+        cached_image_uris = {
+            get_cached_image_uri(image, self._ecr_registry, self.ci_stack_name)
+            for image in pull_through_image_by_service_name.values()
+        }
+        await asyncio.gather(
+            *[
+                asyncio.to_thread(
+                    pull_cached_image_manifest, image_uri, username, password
+                )
+                for image_uri in cached_image_uris
+            ]
+        )
+        logger.info(
+            f"Pulled {len(cached_image_uris)} external image(s) through the ECR pull through cache"
+        )
+
     def _docker_generate_override_file(
-        self, image_uri_by_service_name: dict[str, str]
+        self,
+        image_uri_by_service_name: dict[str, str],
+        pull_through_image_by_service_name: dict[str, str],
     ) -> None:
+        # ECS tasks pull external images from the pull through cache in the stack's region
+        cached_image_uri_by_service_name = {
+            service_name: get_cached_image_uri(
+                image, self._ecr_registry, self.ci_stack_name
+            )
+            for service_name, image in pull_through_image_by_service_name.items()
+        }
         override_config = {
             "services": {
                 service_name: {"image": image_uri}
-                for service_name, image_uri in image_uri_by_service_name.items()
+                for service_name, image_uri in {
+                    **image_uri_by_service_name,
+                    **cached_image_uri_by_service_name,
+                }.items()
             }
         }
         with self.docker_compose_override_path.open("w") as fd:
-            yaml.dump(override_config, fd)
+            yaml_dump(override_config, fd)
 
-    async def _docker_build_tag_push(
-        self, docker_image_uri_by_service_name: dict[str, str]
-    ) -> None:
-        # Create a new Buildx builder instance and use it
-        logger.debug(f"Setting up Docker Buildx ...")
-        buildx_create_cmd = "docker buildx create --use"
-        await run_cmd_async(buildx_create_cmd)
-
-        # Load Docker Compose configuration
-        with open(self.docker_compose_path, "r") as file:
-            docker_compose = yaml.safe_load(file)
-
-        services_with_build = {
-            service_name: service_params
+    def _docker_plan_builds(
+        self, docker_compose: dict, docker_image_uri_by_service_name: dict[str, str]
+    ) -> list[BuildGroup]:
+        build_spec_by_service_name = {
+            service_name: parse_build_spec(service_name, service_params)
             for service_name, service_params in docker_compose.get(
                 "services", {}
             ).items()
             if "build" in service_params
         }
 
-        # todo: deduplicate builds if a docker is used by multiple services (e.g. with various command line args)
+        # build each unique build spec only once, even if it is used by multiple services
+        # images pushed with other output options (e.g. zstd compression) are not reused
+        build_groups = plan_builds(
+            build_spec_by_service_name,
+            docker_image_uri_by_service_name,
+            output_options=get_image_output_options(self.image_compression),
+        )
+        logger.debug(
+            f"Planned {len(build_groups)} unique build(s) for {len(build_spec_by_service_name)} service(s)"
+        )
+        return build_groups
+
+    def _docker_get_changed_build_groups(
+        self, build_groups: list[BuildGroup]
+    ) -> list[BuildGroup]:
+        # images which were built from the same inputs for the last successful deployment already exist
+        if "build" not in self.phases:
+            return []
+        changed_build_groups = []
+        for build_group in self._docker_get_own_build_groups(build_groups):
+            if self.deployment_manifest.is_unchanged(
+                *[f"image:{service_name}" for service_name in build_group.service_names]
+            ):
+                logger.info(
+                    f"Image of service(s) {', '.join(build_group.service_names)} unchanged since the last deployment. Skipping build."
+                )
+            else:
+                changed_build_groups.append(build_group)
+        return changed_build_groups
+
+    def _docker_get_own_build_groups(
+        self, build_groups: list[BuildGroup]
+    ) -> list[BuildGroup]:
+        # the build groups of this job's services (all by default)
+        if self.build_services is None:
+            return build_groups
+        return [
+            build_group
+            for build_group in build_groups
+            if any(s in self.build_services for s in build_group.service_names)
+        ]
 
-        # ensure local cache dir exists. build will fail otherwise when trying to write to the cache
-        local_cache_dir = '/tmp/.buildx-cache'
-        Path(local_cache_dir).mkdir(exist_ok=True, parents=True)
+    async def _docker_setup_buildx(self, build_groups: list[BuildGroup]) -> None:
+        # reuse the builder of earlier deployments (and its layer cache) if it still exists
+        logger.debug(f"Setting up Docker Buildx ...")
+        await self.buildx_builder.setup()
+        self.buildx_builder.warn_emulated_platforms(
+            [p for build_group in build_groups for p in build_group.spec.platforms]
+        )
+        self.build_cache.prepare()
 
-        # translate docker-compose build commands to docker buildx commands
-        build_cmds = []
-        for service_name, service_params in services_with_build.items():
-            service_image_uri = docker_image_uri_by_service_name[service_name]
+    async def _docker_prebuild(self, build_groups: list[BuildGroup]) -> None:
+        # build without pushing, e.g. while the ECR repositories do not exist yet.
+        # the results stay in the builder's cache, so the final build only has to push
+        if len(build_groups) == 0:
+            return
+        await self._docker_build(build_groups, push=False)
 
-            # service params
+    async def _docker_build_tag_push(
+        self,
+        build_groups: list[BuildGroup],
+        existing_repo_name_by_fingerprint: dict[str, str],
+    ) -> None:
+        # skip builds whose image already exists in ECR
+        await asyncio.gather(
+            *[
+                self._docker_reuse_existing_image(
+                    build_group,
+                    existing_repo_name_by_fingerprint[build_group.fingerprint],
+                )
+                for build_group in build_groups
+                if build_group.fingerprint in existing_repo_name_by_fingerprint
+            ]
+        )
+        new_build_groups = [
+            build_group
+            for build_group in build_groups
+            if build_group.fingerprint not in existing_repo_name_by_fingerprint
+        ]
+        if len(new_build_groups) == 0:
+            logger.debug("All images already exist in ECR. Skipping build.")
+        elif self.image_source is not None:
+            await self._docker_copy_from_image_source(new_build_groups)
+        else:
+            await self._docker_build_push(new_build_groups)
+        # reused and copied images need an index in their new repository, too
+        if self.soci_index:
+            await self._docker_push_soci_indexes(build_groups)
+        if len(new_build_groups) > 0:
+            await asyncio.to_thread(
+                self._docker_report_image_sizes, new_build_groups
+            )
 
-            # Handle platform if present
-            platform = service_params.get("platform", "linux/amd64")
-            platform_str = f"--platform {platform}"
+    async def _docker_build_push(self, build_groups: list[BuildGroup]) -> None:
+        await self._docker_build(build_groups, push=True)
+        self.build_cache.evict()
+        await self.buildx_builder.prune()
+        self._docker_report_cache_stats(self.docker_cache_stats_by_service_name)
 
-            # build params
+    async def _docker_set_images_pushed(
+        self, image_uri_by_service_name: dict[str, str]
+    ) -> None:
+        # deployments of other targets can copy the images from now on
+        self.pushed_image_uri_by_service_name = image_uri_by_service_name
+        self.images_pushed.set()
 
-            build_props = service_params["build"]
+    async def _docker_copy_from_image_source(
+        self, build_groups: list[BuildGroup]
+    ) -> None:
+        # copies the images of the source deployment (e.g. in another region) into this registry,
+        # registry to registry and for all platforms, instead of building them again
+        await self.image_source.images_pushed.wait()
+        source_image_uri_by_service_name = (
+            self.image_source.pushed_image_uri_by_service_name
+        )
+        if source_image_uri_by_service_name is None:
+            # e.g. the source deployment failed or was unchanged
+            logger.warning(
+                f"Images of {self.image_source.stack_name} ({self.image_source.aws_region}) were not pushed, building them"
+            )
+            await self._docker_setup_buildx(build_groups)
+            await self._docker_build_push(build_groups)
+            return
+        await self.image_source._docker_login_ecr()
+
+        async def copy_image(build_group: BuildGroup) -> None:
+            source_image_uri = source_image_uri_by_service_name[
+                build_group.service_names[0]
+            ]
+            tags_str = " ".join(
+                [f"--tag {tag}" for tag in self._docker_get_build_tags(build_group)]
+            )
+            await run_cmd_async(
+                f"docker buildx imagetools create {tags_str} {source_image_uri}"
+            )
+            logger.info(
+                f"Copied image {source_image_uri} for service(s) {', '.join(build_group.service_names)}"
+            )
 
-            # ensure build_props is a valid dict
-            if isinstance(build_props, str):
-                build_props = {"context": build_props}
-            elif "context" not in build_props:
-                # build_props["context"] = '.'
-                raise ValueError(f"Invalid build params for service '{service_name}': missing 'context' field.")
+        await self.build_scheduler.run(
+            jobs=[partial(copy_image, build_group) for build_group in build_groups]
+        )
 
-            context = build_props["context"]
+    async def _docker_push_soci_indexes(self, build_groups: list[BuildGroup]) -> None:
+        # Fargate only finds the index in the repository of the image, so every repository needs its own
+        username, password, _ = self._ecr_get_credentials()
+        soci_indexer = SociIndexer(password, registry_username=username)
+        await self.build_scheduler.run(
+            jobs=[
+                partial(
+                    soci_indexer.create_and_push,
+                    image_uri,
+                    all_platforms=len(build_group.spec.platforms) > 1,
+                )
+                for build_group in build_groups
+                for image_uri in build_group.image_uri_by_service_name.values()
+            ]
+        )
 
-            # handle local files and git repos
-            is_git_context = context.startswith('https://') or context.startswith('http://')
-            dockerfile_str = '--file ' + (
-                build_props.get('dockerfile', 'Dockerfile') if is_git_context
-                # in local context, the dockerfile path is relative to the context
-                else str(Path(context) / build_props.get('dockerfile', 'Dockerfile'))
+    def _docker_report_image_sizes(self, build_groups: list[BuildGroup]) -> None:
+        # the compressed size is what ECS tasks pull before they can start
+        for build_group in build_groups:
+            image_uri = next(iter(build_group.image_uri_by_service_name.values()))
+            _, image_tag = split_image_uri(image_uri)
+            repo_name = self._docker_get_repo_name_from_uri(image_uri)
+            try:
+                layer_stats_by_platform = ecr_get_image_layer_stats(
+                    self.ecr_client, repo_name, image_tag
+                )
+            except FileNotFoundError as e:
+                logger.warning(f"Could not report the image size: {e}")
+                continue
+            for platform, (size, layer_count) in layer_stats_by_platform.items():
+                platform_str = f" ({platform})" if platform is not None else ""
+                logger.info(
+                    f"Image of service(s) {', '.join(build_group.service_names)}{platform_str}: "
+                    f"{size / 1024 / 1024:.1f} MB {self.image_compression} compressed, {layer_count} layers"
+                )
+
+    async def _docker_build(self, build_groups: list[BuildGroup], push: bool) -> None:
+        if self.build_engine == "bake":
+            cache_stats_by_service_name = await self._docker_build_bake(
+                build_groups, push=push
+            )
+        else:
+            cache_stats_by_service_name = await self._docker_build_each(
+                build_groups, push=push
             )
+        # only the first build of an image shows the real cache usage,
+        # a second build (after a prebuild) is always served from the builder's cache
+        for service_name, cache_stats in cache_stats_by_service_name.items():
+            self.docker_cache_stats_by_service_name.setdefault(service_name, cache_stats)
+
+    async def _docker_build_each(
+        self, build_groups: list[BuildGroup], push: bool = True
+    ) -> dict[str, tuple[int, int]]:
+        # translate docker-compose build commands to docker buildx commands, one process per build.
+        # the largest build contexts are started first since they are likely to take longest
+        cache_stats_by_service_name = {}
+        all_cache_stats = await self.build_scheduler.run(
+            jobs=[
+                partial(self._docker_build_group, build_group, push=push)
+                for build_group in build_groups
+            ],
+            priorities=[build_group.context_size for build_group in build_groups],
+        )
+        for build_group, cache_stats in zip(build_groups, all_cache_stats):
+            for service_name in build_group.service_names:
+                cache_stats_by_service_name[service_name] = cache_stats
+        return cache_stats_by_service_name
+
+    async def _docker_build_group(
+        self, build_group: BuildGroup, push: bool = True
+    ) -> tuple[int, int]:
+        if push and len(build_group.spec.platforms) > 1:
+            return await self._docker_build_group_multi_platform(build_group)
+        return await self._docker_build_group_platform(build_group, push=push)
+
+    async def _docker_build_group_multi_platform(
+        self, build_group: BuildGroup
+    ) -> tuple[int, int]:
+        # each platform is built by its own build (on the builder node of its architecture, if any)
+        # and pushed by digest only. the digests are then joined into one multi-platform manifest list
+        platforms = build_group.spec.platforms
+        metadata_dir = self.temp_dir / "build-metadata"
+        metadata_dir.mkdir(exist_ok=True, parents=True)
+        metadata_paths = [
+            metadata_dir / f"{build_group.fingerprint[:16]}-{get_platform_slug(p)}.json"
+            for p in platforms
+        ]
+        all_cache_stats = await asyncio.gather(
+            *[
+                self._docker_build_group_platform(
+                    build_group, platform=platform, metadata_path=metadata_path
+                )
+                for platform, metadata_path in zip(platforms, metadata_paths)
+            ]
+        )
+
+        repo_uri, _ = split_image_uri(
+            next(iter(build_group.image_uri_by_service_name.values()))
+        )
+        source_image_uris = []
+        for metadata_path in metadata_paths:
+            with metadata_path.open("r") as fd:
+                digest = json.load(fd)["containerimage.digest"]
+            source_image_uris.append(f"{repo_uri}@{digest}")
+        tags_str = " ".join(
+            [f"--tag {tag}" for tag in self._docker_get_build_tags(build_group)]
+        )
+        logger.debug(
+            f"Creating manifest list of {', '.join(platforms)} for service(s) {', '.join(build_group.service_names)} ..."
+        )
+        await run_cmd_async(
+            f"docker buildx imagetools create --builder {self.buildx_builder.name} {tags_str} {' '.join(source_image_uris)}"
+        )
+        return (
+            sum(cached_steps for cached_steps, _ in all_cache_stats),
+            sum(total_steps for _, total_steps in all_cache_stats),
+        )
 
-            # Handle build args if present
-            build_args = build_props.get("args", {})
-            build_args_str = " ".join(
-                [f"--build-arg {k}={v}" for k, v in build_args.items()]
+    async def _docker_build_group_platform(
+        self,
+        build_group: BuildGroup,
+        push: bool = True,
+        platform: str | None = None,
+        metadata_path: Path | None = None,
+    ) -> tuple[int, int]:
+        # platform: builds a single platform of a multi-platform image and pushes it by digest
+        build_cmd = self._docker_get_build_cmd(
+            build_group, push=push, platform=platform, metadata_path=metadata_path
+        )
+        platform_str = f" ({platform})" if platform is not None else ""
+        logger.debug(
+            f"Building and tagging docker images for service(s) {', '.join(build_group.service_names)}{platform_str} with Buildx ...\n  {build_cmd}"
+        )
+        # stream the build log with a service prefix, but keep only the build step lines
+        # needed for the cache report in memory
+        step_lines = []
+        await run_cmd_async(
+            build_cmd,
+            merge_stderr=True,
+            log_prefix=f"[{', '.join(build_group.service_names)}{platform_str}] ",
+            line_callback=lambda line: (
+                step_lines.append(line) if is_buildx_step_line(line) else None
+            ),
+        )
+        if push:
+            self.build_cache.finalize(
+                self._docker_get_cache_key(build_group, platform)
             )
+        return parse_buildx_cache_stats("\n".join(step_lines))
+
+    async def _docker_build_bake(
+        self, build_groups: list[BuildGroup], push: bool = True
+    ) -> dict[str, tuple[int, int]]:
+        # translate all docker-compose builds into a single bake file, so that BuildKit solves
+        # them in one session and computes shared stages only once
+        target_by_name = {}
+        build_group_by_target_name = {}
+        for build_group in build_groups:
+            target_name = get_bake_target_name(self._docker_get_cache_key(build_group))
+            cache_from, cache_to = self._docker_get_cache_args(build_group)
+            target_by_name[target_name] = get_bake_target(
+                spec=build_group.spec,
+                tags=self._docker_get_build_tags(build_group),
+                cache_from=cache_from,
+                cache_to=cache_to if push else None,
+                output=(
+                    get_image_output(self.image_compression)
+                    if push
+                    else "type=cacheonly"
+                ),
+            )
+            build_group_by_target_name[target_name] = build_group
+
+        with self.docker_bake_path.open("w") as fd:
+            json.dump(get_bake_definition(target_by_name), fd, indent=2)
+
+        bake_cmd = f"docker buildx bake --builder {self.buildx_builder.name} --file {self.docker_bake_path} --progress plain"
+        logger.debug(
+            f"Building and tagging docker images for {len(target_by_name)} target(s) with Buildx Bake ...\n  {bake_cmd}"
+        )
+        step_lines = []
+        await run_cmd_async(
+            bake_cmd,
+            merge_stderr=True,
+            log_prefix="[bake] ",
+            line_callback=lambda line: (
+                step_lines.append(line) if is_buildx_step_line(line) else None
+            ),
+        )
+        bake_output = "\n".join(step_lines)
 
-            # Handle target if present
-            build_target = build_props.get("target", None)
-            build_target_str = f"--target {build_target}" if build_target else ""
+        cache_stats_by_service_name = {}
+        for target_name, build_group in build_group_by_target_name.items():
+            if push:
+                self.build_cache.finalize(self._docker_get_cache_key(build_group))
+            cache_stats = parse_buildx_cache_stats(bake_output, target=target_name)
+            for service_name in build_group.service_names:
+                cache_stats_by_service_name[service_name] = cache_stats
+        return cache_stats_by_service_name
 
-            # Handle cache_from if present
-            cache_from = build_props.get("cache_from", f'type=local,src={local_cache_dir}')
-            cache_from_str = f"--cache-from {cache_from}" if cache_from else ""
+    @staticmethod
+    def _docker_report_cache_stats(
+        cache_stats_by_service_name: dict[str, tuple[int, int]]
+    ) -> None:
+        for service_name, (cached_steps, total_steps) in sorted(
+            cache_stats_by_service_name.items()
+        ):
+            if total_steps > 0 and cached_steps == total_steps:
+                cache_result = "hit"
+            elif cached_steps > 0:
+                cache_result = "partial hit"
+            else:
+                cache_result = "miss"
+            logger.info(
+                f"Build cache {cache_result} for service {service_name}: {cached_steps}/{total_steps} steps cached"
+            )
 
-            # todo: add support for build.dockerfile_inline
-            # todo add support for more params: https://docs.docker.com/compose/compose-file/build/
+    @staticmethod
+    def _docker_get_cache_key(
+        build_group: BuildGroup, platform: str | None = None
+    ) -> str:
+        # keyed by service (not by fingerprint) so that the next build of a changed
+        # context still finds the layers of its predecessor.
+        # the platforms of a multi-platform image are built separately, each with its own cache
+        if platform is None:
+            return build_group.service_names[0]
+        return f"{build_group.service_names[0]}-{get_platform_slug(platform)}"
 
-            # Build, tag and push images with Buildx, using the cache from the local storage
-            build_cmd = f"""docker buildx build \
+    @staticmethod
+    def _docker_get_cache_image_uri(
+        image_uri: str, platform: str | None = None
+    ) -> str:
+        repo_uri, _ = split_image_uri(image_uri)
+        if platform is None:
+            return f"{repo_uri}{BUILD_CACHE_REPO_SUFFIX}:{BUILD_CACHE_TAG}"
+        return f"{repo_uri}{BUILD_CACHE_REPO_SUFFIX}:{BUILD_CACHE_TAG}-{get_platform_slug(platform)}"
+
+    def _docker_get_build_tags(self, build_group: BuildGroup) -> list[str]:
+        tags = []
+        for image_uri in build_group.image_uri_by_service_name.values():
+            tags.append(image_uri)
+            if build_group.is_cacheable:
+                # content addressed tag, used to detect identical builds in later runs
+                repo_uri, _ = split_image_uri(image_uri)
+                tags.append(f"{repo_uri}:{build_group.fingerprint_tag}")
+        return tags
+
+    def _docker_get_cache_args(
+        self, build_group: BuildGroup, platform: str | None = None
+    ) -> tuple[list[str], str | None]:
+        # returns (cache sources, cache destination) for a build
+        cache_key = self._docker_get_cache_key(build_group, platform)
+        cache_image_uri = self._docker_get_cache_image_uri(
+            next(iter(build_group.image_uri_by_service_name.values())), platform
+        )
+        cache_from = list(build_group.spec.cache_from)
+        build_cache_from = self.build_cache.get_cache_from(cache_key, cache_image_uri)
+        if build_cache_from is not None:
+            cache_from.append(build_cache_from)
+        cache_to = self.build_cache.get_cache_to(cache_key, cache_image_uri)
+        return cache_from, cache_to
+
+    def _docker_get_build_cmd(
+        self,
+        build_group: BuildGroup,
+        push: bool = True,
+        platform: str | None = None,
+        metadata_path: Path | None = None,
+    ) -> str:
+        spec = build_group.spec
+        cache_from, cache_to = self._docker_get_cache_args(build_group, platform)
+        # without push, the result is only kept in the builder's cache
+        output_str = (
+            f"--output {get_image_output(self.image_compression)}"
+            if push
+            else "--output type=cacheonly"
+        )
+        if not push:
+            cache_to = None
+        tags = self._docker_get_build_tags(build_group)
+        if platform is not None:
+            # a single platform of a multi-platform image: pushed untagged, the tags are set
+            # on the manifest list which references the digests of all platforms
+            repo_uri, _ = split_image_uri(tags[0])
+            image_output = get_image_output(
+                self.image_compression, name=repo_uri, push_by_digest=True
+            )
+            output_str = f"--output {image_output}"
+            tags = []
+        metadata_file_str = f"--metadata-file {metadata_path}" if metadata_path else ""
+
+        platform_str = f"--platform {platform or ','.join(spec.platforms)}"
+        dockerfile_str = f"--file {spec.dockerfile_path}"
+        build_args_str = " ".join(
+            [f"--build-arg {k}={v}" for k, v in spec.args.items()]
+        )
+        build_target_str = f"--target {spec.target}" if spec.target else ""
+        cache_from_str = " ".join([f"--cache-from {c}" for c in cache_from])
+        cache_to_str = f"--cache-to {cache_to}" if cache_to else ""
+        tags_str = " ".join([f"--tag {tag}" for tag in tags])
+
+        # Build, tag and push images with Buildx, reading from and writing to the build cache.
+        # plain progress output is needed to report cache hits
+        return f"""docker buildx build \
+--builder {self.buildx_builder.name} \
 {platform_str} \
 {cache_from_str} \
+{cache_to_str} \
 {dockerfile_str} \
 {build_args_str} \
 {build_target_str} \
---tag {service_image_uri} \
---quiet \
---push \
-{context}"""
-            logger.debug(
-                f"Building and tagging docker images for service {service_name} with Buildx ...\n  {build_cmd}"
+{tags_str} \
+--progress plain \
+{metadata_file_str} \
+{output_str} \
+{spec.context}"""
+
+    async def _docker_find_existing_images(
+        self, build_groups: list[BuildGroup]
+    ) -> dict[str, str]:
+        # returns the repository which already holds the image, by fingerprint of the build group.
+        # all fingerprint tags are looked up at once, with one call per repository
+        build_groups = [
+            build_group for build_group in build_groups if build_group.is_cacheable
+        ]
+        if len(build_groups) == 0:
+            return {}
+        repo_names_by_fingerprint = {
+            build_group.fingerprint: [
+                self._docker_get_repo_name_from_uri(image_uri)
+                for image_uri in build_group.image_uri_by_service_name.values()
+            ]
+            for build_group in build_groups
+        }
+        stack_repo_names = await asyncio.to_thread(
+            lambda: self._ecr_stack_repository_names
+        )
+        # the repositories of the build groups may not exist yet, or not below the prefix
+        repo_names = list(
+            dict.fromkeys(
+                [
+                    repo_name
+                    for names in repo_names_by_fingerprint.values()
+                    for repo_name in names
+                ]
+                + stack_repo_names
             )
-            build_cmds.append(build_cmd)
+        )
+        fingerprint_tags = [build_group.fingerprint_tag for build_group in build_groups]
+        found_tags_by_repo_name = dict(
+            zip(
+                repo_names,
+                await asyncio.gather(
+                    *[
+                        asyncio.to_thread(
+                            ecr_find_image_tags,
+                            self.ecr_client,
+                            repo_name,
+                            fingerprint_tags,
+                        )
+                        for repo_name in repo_names
+                    ]
+                ),
+            )
+        )
 
-        await asyncio.gather(
-            *[run_cmd_async(build_cmd) for build_cmd in build_cmds]
+        repo_name_by_fingerprint = {}
+        for build_group in build_groups:
+            fingerprint_tag = build_group.fingerprint_tag
+            own_repo_names = repo_names_by_fingerprint[build_group.fingerprint]
+            # identical image already pushed to the target repositories (e.g. redeploy of the same commit)
+            if all(
+                fingerprint_tag in found_tags_by_repo_name[repo_name]
+                for repo_name in own_repo_names
+            ):
+                repo_name_by_fingerprint[build_group.fingerprint] = own_repo_names[0]
+                continue
+            # identical image exists in another repository of this stack (e.g. another environment)
+            source_repo_name = next(
+                (
+                    repo_name
+                    for repo_name, found_tags in found_tags_by_repo_name.items()
+                    if fingerprint_tag in found_tags
+                ),
+                None,
+            )
+            if source_repo_name is not None:
+                repo_name_by_fingerprint[build_group.fingerprint] = source_repo_name
+        return repo_name_by_fingerprint
+
+    @cached_property
+    def _ecr_stack_repository_names(self) -> list[str]:
+        # image repositories of all environments of this stack (without build cache repositories),
+        # listed once per run
+        return [
+            repo_name
+            for repo_name in ecr_list_repository_names(
+                self.ecr_client, self._ecr_get_stack_repository_prefix()
+            )
+            if not repo_name.endswith(BUILD_CACHE_REPO_SUFFIX)
+        ]
+
+    def _ecr_get_stack_repository_prefix(self) -> str:
+        # the part of the repository name (in image_uri_format) which is shared by all environments
+        # and services of this stack, e.g. "<cf_stack_prefix>/" with the default format
+        stack_fields = {
+            "aws_account_id": self.aws_account_id,
+            "aws_region": self.aws_region,
+            "cf_stack_prefix": self.cf_stack_prefix,
+        }
+        prefix = ""
+        for literal, field_name, _, _ in string.Formatter().parse(
+            self.image_uri_format
+        ):
+            prefix += literal
+            if field_name not in stack_fields:
+                break
+            prefix += str(stack_fields[field_name])
+        # without the registry and the tag
+        _, sep, repo_name_prefix = prefix.partition("/")
+        return repo_name_prefix.split(":")[0] if sep else ""
+
+    async def _docker_reuse_existing_image(
+        self, build_group: BuildGroup, source_repo_name: str
+    ) -> None:
+        # tags the existing image of the build group for all of its services, so that the build can be skipped
+        fingerprint_tag = build_group.fingerprint_tag
+        repo_name_by_image_uri = {
+            image_uri: self._docker_get_repo_name_from_uri(image_uri)
+            for image_uri in build_group.image_uri_by_service_name.values()
+        }
+
+        tag_exists = await asyncio.gather(
+            *[
+                asyncio.to_thread(
+                    ecr_image_tag_exists, self.ecr_client, repo_name, fingerprint_tag
+                )
+                for repo_name in repo_name_by_image_uri.values()
+            ]
+        )
+        if all(tag_exists):
+            for image_uri, repo_name in repo_name_by_image_uri.items():
+                _, image_tag = split_image_uri(image_uri)
+                await asyncio.to_thread(
+                    ecr_retag_image,
+                    self.ecr_client,
+                    repo_name,
+                    fingerprint_tag,
+                    image_tag,
+                )
+            logger.info(
+                f"Reusing existing image {fingerprint_tag} for service(s) {', '.join(build_group.service_names)}"
+            )
+            return
+
+        # copy it within the registry instead of rebuilding it
+        registry = next(iter(repo_name_by_image_uri)).split("/")[0]
+        source_image_uri = f"{registry}/{source_repo_name}:{fingerprint_tag}"
+        tags_str = " ".join(
+            [f"--tag {tag}" for tag in self._docker_get_build_tags(build_group)]
+        )
+        await run_cmd_async(
+            f"docker buildx imagetools create {tags_str} {source_image_uri}"
+        )
+        logger.info(
+            f"Copied existing image {source_image_uri} for service(s) {', '.join(build_group.service_names)}"
         )
 
     def _cf_ci_generate(
-        self, docker_image_uri_by_service_name: dict[str, str]
+        self,
+        docker_image_uri_by_service_name: dict[str, str],
+        pull_through_image_by_service_name: dict[str, str],
     ) -> dict[str, dict]:
         unique_repo_names = list(
             set(
@@ -344,25 +1626,124 @@ class Deployment:
                     )
                 }
 
+            if self.build_cache.mode == "registry":
+                # separate repository for the buildx registry cache, so that the cache manifest
+                # neither counts towards nor gets expired by the image lifecycle policy above
+                cache_resource_name = to_pascal_case(f"{repo_name}-build-cache-repository")
+                cf_template["Resources"][cache_resource_name] = {
+                    "Type": "AWS::ECR::Repository",
+                    "Properties": {
+                        "RepositoryName": f"{repo_name}{BUILD_CACHE_REPO_SUFFIX}",
+                        "ImageTagMutability": "MUTABLE",
+                        "LifecyclePolicy": {
+                            "LifecyclePolicyText": json.dumps(
+                                {
+                                    "rules": [
+                                        {
+                                            "rulePriority": 1,
+                                            "description": "Expire superseded cache manifests",
+                                            "selection": {
+                                                "tagStatus": "untagged",
+                                                "countType": "sinceImagePushed",
+                                                "countUnit": "days",
+                                                "countNumber": 1,
+                                            },
+                                            "action": {"type": "expire"},
+                                        }
+                                    ]
+                                }
+                            )
+                        },
+                    },
+                }
+
+        # pull through cache rules for the registries of external images
+        upstream_by_name = {
+            upstream.name: upstream
+            for upstream in map(
+                get_upstream_registry, pull_through_image_by_service_name.values()
+            )
+        }
+        for upstream_name, upstream in sorted(upstream_by_name.items()):
+            resource_name = to_pascal_case(f"{upstream_name}-pull-through-cache-rule")
+            cf_template["Resources"][resource_name] = get_pull_through_cache_rule(
+                upstream,
+                self.ci_stack_name,
+                credential_arn=self.ecr_pull_through_credentials.get(upstream_name),
+            )
+
         return cf_template
 
     def _cf_ci_deploy(self, cf_template: dict[str, dict]) -> None:
+        template_body = dump_template(cf_template, self.cf_template_format)
+        if len(template_body.encode()) <= CF_TEMPLATE_BODY_MAX_SIZE:
+            self.cfd.create_or_update_stack(
+                stack_name=self.ci_stack_name,
+                template_body=template_body,
+                wait_if_in_progress=True,
+            )
+            return
+
+        # template is too large to be passed inline and has to go through the ci bucket.
+        # on the first deployment, the bucket has to be created first
+        if not self.cfd.stack_exists(self.ci_stack_name):
+            logger.debug(
+                "ci template exceeds the inline size limit. Creating ci bucket first ..."
+            )
+            self.cfd.create_or_update_stack(
+                stack_name=self.ci_stack_name,
+                template_body=dump_template(
+                    {
+                        "AWSTemplateFormatVersion": cf_template[
+                            "AWSTemplateFormatVersion"
+                        ],
+                        "Resources": {
+                            "DeploymentBucket": cf_template["Resources"][
+                                "DeploymentBucket"
+                            ]
+                        },
+                    }
+                ),
+                wait_if_in_progress=True,
+            )
+        cf_ci_template_path = self.temp_dir / f"{self.ci_stack_name}.yaml"
+        with cf_ci_template_path.open("w") as fd:
+            fd.write(template_body)
+        content_hash = hashlib.sha256(template_body.encode()).hexdigest()
+        s3_key = f"{self.ci_s3_templates_prefix}/{content_hash}/{cf_ci_template_path.name}"
+        self.s3_uploader.upload_file(s3_key, cf_ci_template_path)
         self.cfd.create_or_update_stack(
             stack_name=self.ci_stack_name,
-            template_body=yaml.dump(cf_template),
+            template_url=f"https://{self.ci_s3_bucket_name}.s3.{self.aws_region}.amazonaws.com/{s3_key}",
+            wait_if_in_progress=True,
         )
-        self.cfd.wait_for_stack_completion(stack_name=self.ci_stack_name)
 
     def _cf_handle_substitution(self):
         if self.ecs_compose_orig_path is not None:
             with self.ecs_compose_orig_path.open("r") as f:
                 text = f.read()
-            env_subs = { k: v for k, v in os.environ.items() }
-            text = string.Template(text).safe_substitute(env_subs)
+            text = string.Template(text).safe_substitute(self.env)
             with self.ecs_compose_path.open("w") as f:
                 f.write(text)
 
-    def _cf_generate(self) -> None:
+    def _cf_generate(self, image_uri_by_service_name: dict[str, str]) -> str | None:
+        # returns the render cache key if the templates were rendered, None if they were restored.
+        # cached templates contain image placeholders instead of image URIs, so that a commit which only
+        # changes images reuses the templates rendered for an earlier commit
+        image_placeholders = self._cf_get_image_placeholders(image_uri_by_service_name)
+        cache_key = get_fingerprint(
+            self._cf_get_render_inputs(image_uri_by_service_name)
+        )
+        if self.render_cache.restore(
+            cache_key,
+            self.cf_main_dir,
+            replacements={
+                placeholder: image_uri
+                for image_uri, placeholder in image_placeholders.items()
+            },
+        ):
+            return None
+
         logger.debug(f"Generating CloudFormation template from Docker Compose ...")
         docker_compose_files = [
             self.docker_compose_path,
@@ -371,99 +1752,272 @@ class Deployment:
         if self.ecs_compose_path is not None:
             docker_compose_files.append(self.ecs_compose_path)
 
-        ecx_settings = ComposeXSettings(
-            command="render",
-            TemplateFormat="yaml",
-            RegionName=self.aws_region,
-            BucketName=self.ci_s3_bucket_name,
-            Name=self.stack_name,
-            disable_rollback=self.cf_disable_rollback,
-            DockerComposeXFile=docker_compose_files,
-            OutputDirectory=str(self.cf_main_dir),
+        # ecs_composex (and troposphere) take seconds to import, only pay for it when rendering
+        from ecs_composex.common.settings import ComposeXSettings
+        from ecs_composex.common.stacks import process_stacks
+        from ecs_composex.ecs_composex import generate_full_template
+
+        with CF_RENDER_LOCK:
+            os.environ["AWS_REGION"] = self.env["AWS_REGION"]
+            os.environ["AWS_DEFAULT_REGION"] = self.env["AWS_DEFAULT_REGION"]
+            ecx_settings = ComposeXSettings(
+                command="render",
+                TemplateFormat="yaml",
+                RegionName=self.aws_region,
+                BucketName=self.ci_s3_bucket_name,
+                Name=self.stack_name,
+                disable_rollback=self.cf_disable_rollback,
+                DockerComposeXFile=docker_compose_files,
+                OutputDirectory=str(self.cf_main_dir),
+            )
+            ecx_root_stack = generate_full_template(ecx_settings)
+            process_stacks(ecx_root_stack, ecx_settings)
+
+        self.render_cache.store(
+            cache_key, self.cf_main_dir, replacements=image_placeholders
         )
-        ecx_root_stack = generate_full_template(ecx_settings)
-        process_stacks(ecx_root_stack, ecx_settings)
+        return cache_key
+
+    @staticmethod
+    def _cf_get_image_placeholders(
+        image_uri_by_service_name: dict[str, str]
+    ) -> dict[str, str]:
+        # longest URIs first, so that no URI is replaced inside a longer one
+        return {
+            image_uri: f"<image:{service_name}>"
+            for service_name, image_uri in sorted(
+                image_uri_by_service_name.items(),
+                key=lambda item: len(item[1]),
+                reverse=True,
+            )
+        }
 
     def _cf_update(self, template_modifier: Callable[[dict[str, dict]], dict]) -> None:
+        # templates are parsed once, modified in memory and written once in their final format
         cf_template_by_filename = {}
+        size_before_by_filename = {}
         for cf_template_path in self.cf_main_dir.glob("*.yaml"):
+            size_before_by_filename[cf_template_path.name] = cf_template_path.stat().st_size
             with cf_template_path.open("r") as fd:
-                cf_template_by_filename[cf_template_path.name] = yaml.safe_load(
-                    fd.read()
-                )
+                cf_template_by_filename[cf_template_path.name] = yaml_load(fd)
 
         # apply template modifier
+        self.cf_template_body_by_filename = {}
         cf_template_by_filename = template_modifier(cf_template_by_filename)
 
+        size_after_by_filename = {}
         for filename, cf_template in cf_template_by_filename.items():
+            # reuse the body serialized for content addressing, if any
+            template_body = self.cf_template_body_by_filename.get(filename)
+            if template_body is None:
+                template_body = dump_template(cf_template, self.cf_template_format)
             cf_template_path = self.cf_main_dir / filename
             with cf_template_path.open("w") as fd:
-                fd.write(yaml.dump(cf_template))
+                fd.write(template_body)
+            size_after_by_filename[filename] = len(template_body.encode())
+
+        self._cf_report_template_sizes(size_before_by_filename, size_after_by_filename)
+
+    @staticmethod
+    def _cf_report_template_sizes(
+        size_before_by_filename: dict[str, int], size_after_by_filename: dict[str, int]
+    ) -> None:
+        for filename, size_after in sorted(size_after_by_filename.items()):
+            size_before = size_before_by_filename.get(filename, size_after)
+            logger.debug(
+                f"Template {filename}: {size_before / 1024:.1f} KB -> {size_after / 1024:.1f} KB"
+            )
+        total_before = sum(size_before_by_filename.values())
+        total_after = sum(size_after_by_filename.values())
+        logger.info(
+            f"{len(size_after_by_filename)} template(s): {total_before / 1024:.1f} KB -> {total_after / 1024:.1f} KB"
+        )
+
+    def _cf_modify_templates(
+        self,
+        cf_template_by_filename: dict[str, dict],
+        image_uri_by_service_name: dict[str, str],
+    ) -> dict[str, dict]:
+        self._cf_set_templates_without_images_input(
+            cf_template_by_filename, image_uri_by_service_name
+        )
+        if self.cf_compact_templates:
+            cf_template_by_filename = compact_templates(
+                cf_template_by_filename, hoist_literals=self.cf_hoist_literals
+            )
+        # must run last, since content addressing hashes the final templates
+        return self._cf_update_template_urls(cf_template_by_filename)
+
+    def _cf_set_templates_without_images_input(
+        self,
+        cf_template_by_filename: dict[str, dict],
+        image_uri_by_service_name: dict[str, str],
+    ) -> None:
+        # fingerprint of the templates with the image URIs of built services replaced by placeholders.
+        # it stays the same if a deployment changes nothing but image tags.
+        # nested stack TemplateURLs are still the rendered file names at this point
+        text = replace_all(
+            json.dumps(cf_template_by_filename, sort_keys=True),
+            self._cf_get_image_placeholders(image_uri_by_service_name),
+        )
+        self.deployment_manifest.set_input("templates_without_images", text)
+
+    @staticmethod
+    def _cf_get_nested_stack_resources(cf_template: dict) -> list[dict]:
+        return [
+            r_params
+            for r_params in cf_template.get("Resources", {}).values()
+            if r_params.get("Type") == "AWS::CloudFormation::Stack"
+            and "TemplateURL" in r_params.get("Properties", {})
+        ]
 
     def _cf_update_template_urls(
         self, cf_template_by_filename: dict[str, dict]
     ) -> dict[str, dict]:
-        for cf_template in cf_template_by_filename.values():
-            # for all resources
-            if "Resources" in cf_template:
-                for r_params in cf_template["Resources"].values():
-                    # update TemplateURLs in nested stacks
-                    if (
-                        r_params.get("Type") == "AWS::CloudFormation::Stack"
-                        and "TemplateURL" in r_params["Properties"]
-                    ):
-                        # get filename of current TemplateURL
-                        filename = r_params["Properties"]["TemplateURL"].split("/")[-1]
-                        # set TemplateURL to S3 target
-                        r_params["Properties"]["TemplateURL"] = (
-                            self._cf_get_template_url(
-                                dir_path=self.cf_main_dir,
-                                filename=filename,
-                            )
-                        )
+        # point all TemplateURLs of nested stacks to content addressed S3 keys.
+        # an unchanged nested template keeps its URL, so CloudFormation can skip the nested stack.
+        # templates are processed bottom up, since a template's hash depends on the URLs of its children
+        self.cf_template_key_by_filename = {}
+
+        def resolve(filename: str, visiting: set[str]) -> str:
+            if filename in self.cf_template_key_by_filename:
+                return self.cf_template_key_by_filename[filename]
+            if filename in visiting:
+                raise ValueError(f"Circular nested stack reference in {filename}")
+            cf_template = cf_template_by_filename[filename]
+            for r_params in self._cf_get_nested_stack_resources(cf_template):
+                # get filename of current TemplateURL
+                child_filename = r_params["Properties"]["TemplateURL"].split("/")[-1]
+                if child_filename in cf_template_by_filename:
+                    resolve(child_filename, visiting | {filename})
+                # set TemplateURL to S3 target
+                r_params["Properties"]["TemplateURL"] = self._cf_get_template_url(
+                    child_filename
+                )
+            # hash exactly what will be written to disk and uploaded
+            template_body = dump_template(cf_template, self.cf_template_format)
+            self.cf_template_body_by_filename[filename] = template_body
+            content_hash = hashlib.sha256(template_body.encode()).hexdigest()
+            s3_key = f"{self.ci_s3_templates_prefix}/{content_hash}/{filename}"
+            self.cf_template_key_by_filename[filename] = s3_key
+            return s3_key
+
+        for filename in cf_template_by_filename.keys():
+            resolve(filename, set())
+        # the keys are content addressed, so they fingerprint all rendered templates
+        self.deployment_manifest.set_input("templates", self.cf_template_key_by_filename)
         return cf_template_by_filename
 
+    def _cf_get_s3_key(self, filename: str) -> str:
+        # content addressed key for templates, timestamped key for all other files
+        if filename in self.cf_template_key_by_filename:
+            return self.cf_template_key_by_filename[filename]
+        return f"{self.ci_s3_key_prefix}/{self.cf_main_dir.name}/{filename}"
+
     def _cf_upload_to_s3(self) -> None:
-        # upload generated cf templates to S3
-        for file_path in self.cf_main_dir.glob("*"):
-            if file_path.suffix in [".yaml", ".yml", ".json"]:
-                with open(file_path, "rb") as file:
-                    s3_key = f"{self.ci_s3_key_prefix}/{self.cf_main_dir.name}/{file_path.name}"
-                    self.s3_client.upload_fileobj(file, self.ci_s3_bucket_name, s3_key)
-                    logger.debug(
-                        f'Uploaded "{s3_key}" to S3 bucket "{self.ci_s3_bucket_name}'
-                    )
+        # upload generated cf templates to S3. unchanged files (e.g. content addressed
+        # templates of unchanged nested stacks) are skipped
+        self.s3_uploader.upload_files(
+            {
+                self._cf_get_s3_key(file_path.name): file_path
+                for file_path in self.cf_main_dir.glob("*")
+                if file_path.suffix in [".yaml", ".yml", ".json"]
+            }
+        )
 
-    def _cf_get_template_url(self, dir_path: Path, filename: str):
-        return f"https://{self.ci_s3_bucket_name}.s3.{self.aws_region}.amazonaws.com/{self.ci_s3_key_prefix}/{dir_path.name}/{filename}"
-
-    def _cf_deploy(self) -> None:
-        # if stack doesn't exist, set ECS defaults
-        # if not self.cfd.stack_exists(self.stack_name):
-        #     # https://github.com/compose-x/ecs_composex/blob/ff97d079113de5b1660c1beeafb24c8610971d10/ecs_composex/utils/init_ecs.py#L11
-        for setting in [
-            "awsvpcTrunking",
-            "serviceLongArnFormat",
-            "taskLongArnFormat",
-            "containerInstanceLongArnFormat",
-            "containerInsights",
-        ]:
-            self.ecs_client.put_account_setting_default(
-                name=setting, value="enabled"
-            )
-            logger.info(f"ECS Setting {setting} set to 'enabled'")
+    def _cf_get_template_url(self, filename: str):
+        return f"https://{self.ci_s3_bucket_name}.s3.{self.aws_region}.amazonaws.com/{self._cf_get_s3_key(filename)}"
+
+    def _cf_deploy(self, image_uri_by_service_name: dict[str, str]) -> bool:
+        # returns False if the stack was not updated, i.e. its outputs didn't change.
+        # a failed image-only deployment needs no reconciliation: the stack update which follows
+        # changes the task definitions of all affected services anyway
+        self._handoff_check_deploy_inputs(image_uri_by_service_name)
+        self.ecs_account_settings.reconcile(ECS_ACCOUNT_SETTINGS)
+
+        if self.deployment_manifest.is_unchanged(
+            "templates"
+        ) and self.cfd.is_stack_deployed(self.stack_name):
+            logger.info(
+                "Templates unchanged since the last deployment. Skipping stack update."
+            )
+            return False
+
+        if self._ecs_is_image_only_change():
+            try:
+                self._ecs_fast_deploy(image_uri_by_service_name)
+                return False
+            except Exception as e:
+                # the stack update below also moves all services to the new images
+                logger.warning(
+                    f"Image-only deployment failed, falling back to a stack update: {e}"
+                )
 
         # todo: check if stack exists and is in ROLLBACK_COMPLETE state --> delete the stack and re-create
         self.cfd.create_or_update_stack(
             stack_name=self.stack_name,
-            template_url=self._cf_get_template_url(
-                dir_path=self.cf_main_dir, filename=f"{self.stack_name}.yaml"
-            ),
+            template_url=self._cf_get_template_url(f"{self.stack_name}.yaml"),
+        )
+        self._ecs_reconcile_drifted_services()
+        return True
+
+    def _ecs_is_image_only_change(self) -> bool:
+        # True if the templates differ from the last deployment in nothing but image URIs
+        return (
+            self.ecs_fast_deploy
+            and self.deployment_manifest.is_unchanged(
+                "templates_without_images", "ci_template", "ecs_settings"
+            )
+            and self.cfd.is_stack_deployed(self.stack_name)
+        )
+
+    def _ecs_fast_deploy(self, image_uri_by_service_name: dict[str, str]) -> None:
+        logger.info("Only image URIs changed. Updating ECS services directly ...")
+        service_arns = self.cfd.get_resource_ids(self.stack_name, "AWS::ECS::Service")
+        image_uri_by_repository = {
+            split_image_uri(image_uri)[0]: image_uri
+            for image_uri in image_uri_by_service_name.values()
+        }
+        updated_service_arns = self.ecs_fast_deployer.deploy_images(
+            service_arns, image_uri_by_repository
+        )
+        self.deployment_manifest.drifted_services = sorted(
+            set(self.deployment_manifest.drifted_services) | set(updated_service_arns)
+        )
+        logger.info(f"Updated {len(updated_service_arns)} ECS service(s)")
+
+    def _ecs_reconcile_drifted_services(self) -> None:
+        # after a stack update, services updated by image-only deployments are moved back
+        # to the task definitions of the stack
+        drifted_service_arns = self.deployment_manifest.drifted_services
+        if len(drifted_service_arns) == 0:
+            return
+        task_definition_arns = self.cfd.get_resource_ids(
+            self.stack_name, "AWS::ECS::TaskDefinition"
+        )
+        reconciled_service_arns = self.ecs_fast_deployer.reconcile(
+            drifted_service_arns, task_definition_arns
+        )
+        self.deployment_manifest.drifted_services = []
+        logger.info(
+            f"Reconciled {len(reconciled_service_arns)} ECS service(s) with the stack"
         )
-        self.cfd.wait_for_stack_completion(self.stack_name)
 
-    def _cf_store_outputs(self) -> None:
-        cf_main_output = self.cfd.get_nested_stack_outputs(self.stack_name)
+    def _cf_store_outputs(self, use_previous_outputs: bool = False) -> list[dict]:
+        # outputs of a skipped deployment are taken from the deployment manifest
+        if use_previous_outputs and self.deployment_manifest.previous_outputs is not None:
+            cf_main_output = self.deployment_manifest.previous_outputs
+        else:
+            cf_main_output = self.cfd.get_nested_stack_outputs(
+                self.stack_name,
+                cache_path=(
+                    # the same stack name can exist in several regions (and accounts)
+                    self.cache_dir
+                    / f"{self.stack_name}-{self.aws_account_id}-{self.aws_region}-outputs.json"
+                    if self.cache_stack_outputs
+                    else None
+                ),
+            )
 
         outputs_by_output_key = {
             o["OutputKey"]: o["OutputValue"] for o in cf_main_output if "OutputKey" in o
@@ -489,5 +2043,10 @@ class Deployment:
             )
 
         # Set an output to indicate the file path
-        with open(os.environ["GITHUB_OUTPUT"], "a") as gh_output:
-            gh_output.write(f"cf-output-path={self.cf_main_output_path.resolve()}\n")
+        if os.getenv("GITHUB_OUTPUT"):
+            with open(os.environ["GITHUB_OUTPUT"], "a") as gh_output:
+                gh_output.write(
+                    f"cf-output-path={self.cf_main_output_path.resolve()}\n"
+                )
+
+        return cf_main_output
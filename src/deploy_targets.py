@@ -0,0 +1,130 @@
+import json
+import os
+from functools import partial
+from pathlib import Path
+from src.deploy import Deployment, DEFAULT_TEMP_DIR
+from src.utils.build_scheduler import BuildScheduler
+from src.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+DEFAULT_MAX_PARALLEL_TARGETS = 4
+
+
+def parse_targets(items: list[str]) -> list[tuple[str, str]]:
+    # "<env name>:<region>" items, e.g. ["prod:eu-west-1", "prod:us-east-1"]
+    targets = []
+    for item in items:
+        env_name, _, aws_region = item.partition(":")
+        if env_name == "" or aws_region == "":
+            raise ValueError(
+                f"Invalid target '{item}'. Must be of the form <env name>:<region>"
+            )
+        targets.append((env_name, aws_region))
+    return targets
+
+
+def get_target_name(env_name: str, aws_region: str) -> str:
+    return f"{env_name}:{aws_region}"
+
+
+class MultiTargetDeployment:
+    # deploys the same compose files to several environments and/or regions from one invocation.
+    # the images are built once by the first target, the other targets copy them into their own registry.
+    # the targets are deployed concurrently, at most max_parallel_targets at a time
+    def __init__(
+        self,
+        targets: list[tuple[str, str]],
+        max_parallel_targets: int | None = DEFAULT_MAX_PARALLEL_TARGETS,
+        output_path: str | None = None,
+        temp_dir: str = DEFAULT_TEMP_DIR,
+        trace_export_path: str | None = None,
+        **deployment_kwargs,
+    ):
+        if len(targets) == 0:
+            raise ValueError("No targets given")
+        target_names = [get_target_name(*target) for target in targets]
+        if len(set(target_names)) != len(target_names):
+            raise ValueError(f"Duplicate targets in '{', '.join(target_names)}'")
+        # splitting the pipeline across jobs is done per target
+        for kwarg in ["phases", "build_services", "handoff_path", "handoff_inputs"]:
+            if deployment_kwargs.get(kwarg):
+                raise ValueError(f"'{kwarg}' is not supported with several targets")
+
+        self.target_names = target_names
+        self.scheduler = BuildScheduler(
+            max_parallel=max_parallel_targets or len(targets), fail_fast=False
+        )
+        self.output_path = (
+            Path(output_path)
+            if output_path is not None
+            else Path(temp_dir) / "outputs_by_target.json"
+        )
+
+        self.deployments: list[Deployment] = []
+        regions_by_env_name: dict[str, list[str]] = {}
+        for env_name, aws_region in targets:
+            regions = regions_by_env_name.setdefault(env_name, [])
+            self.deployments.append(
+                Deployment(
+                    env_name=env_name,
+                    aws_region=aws_region,
+                    temp_dir=temp_dir,
+                    # the first target builds the images
+                    image_source=self.deployments[0] if self.deployments else None,
+                    # the first region of an environment keeps the ci bucket name of single region deployments
+                    ci_bucket_region_suffix=len(regions) > 0,
+                    trace_export_path=(
+                        f"{trace_export_path}.{env_name}-{aws_region}"
+                        if trace_export_path is not None
+                        else None
+                    ),
+                    **deployment_kwargs,
+                )
+            )
+            regions.append(aws_region)
+
+    async def run(self) -> None:
+        async def run_target(target_name: str, deployment: Deployment) -> None:
+            try:
+                await deployment.run()
+            except Exception:
+                logger.error(f"Deployment of target {target_name} failed")
+                raise
+            logger.info(f"Deployed target {target_name}")
+
+        try:
+            await self.scheduler.run(
+                jobs=[
+                    partial(run_target, target_name, deployment)
+                    for target_name, deployment in zip(
+                        self.target_names, self.deployments
+                    )
+                ],
+                # the other targets wait for the images of the first one
+                priorities=[1] + [0] * (len(self.deployments) - 1),
+            )
+        finally:
+            # outputs of the targets which were deployed, also if others failed
+            self._write_outputs()
+
+    def _write_outputs(self) -> None:
+        outputs_by_target_name = {}
+        for target_name, deployment in zip(self.target_names, self.deployments):
+            if deployment.cf_main_output_path.is_file():
+                with deployment.cf_main_output_path.open("r") as fd:
+                    outputs_by_target_name[target_name] = json.load(fd)
+
+        self.output_path.parent.mkdir(exist_ok=True, parents=True)
+        with self.output_path.open("w") as fd:
+            json.dump(outputs_by_target_name, fd, indent=2, ensure_ascii=False)
+
+        logger.info(f"Outputs of all targets written to {self.output_path}")
+        # only set when running as a GitHub action
+        if os.getenv("GITHUB_OUTPUT"):
+            with open(os.environ["GITHUB_OUTPUT"], "a") as gh_output:
+                gh_output.write(
+                    f"cf-output-by-target-path={self.output_path.resolve()}\n"
+                )
@@ -1,7 +1,13 @@
 import os
 import json
+import argparse
 import asyncio
-from src.deploy import Deployment
+import importlib
+from time import perf_counter
+from src.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
 
 
 def getenv(var_name: str, default=None):
@@ -10,12 +16,58 @@ def getenv(var_name: str, default=None):
     return value if value != "" else default
 
 
-def github_action_handler():
+def import_timed(module_name: str):
+    start_time = perf_counter()
+    module = importlib.import_module(module_name)
+    return module, perf_counter() - start_time
+
+
+def github_action_handler(profile_startup: bool = False):
+    # imported here, so that the import time can be measured
+    deploy, deploy_import_time = import_timed("src.deploy")
+
     cf_stack_prefix = getenv("INPUT_CF_STACK_PREFIX", None)
     env_name = getenv("INPUT_ENV_NAME", None)
     docker_compose_file = getenv("INPUT_DOCKER_COMPOSE_FILE", None)
     ecs_composex_file = getenv("INPUT_ECS_COMPOSEX_FILE", None)
     ecr_keep_last_n_images = getenv("INPUT_ECR_KEEP_LAST_N_IMAGES", None)
+    ecr_pull_through_cache = getenv("INPUT_ECR_PULL_THROUGH_CACHE", "false") == "true"
+    ecr_pull_through_credentials = getenv("INPUT_ECR_PULL_THROUGH_CREDENTIALS", None)
+    build_cache_mode = getenv("INPUT_BUILD_CACHE", "local")
+    build_engine = getenv("INPUT_BUILD_ENGINE", "build")
+    image_compression = getenv("INPUT_IMAGE_COMPRESSION", "gzip")
+    soci_index = getenv("INPUT_SOCI_INDEX", "false") == "true"
+    max_parallel_builds = getenv("INPUT_MAX_PARALLEL_BUILDS", None)
+    buildx_driver = getenv("INPUT_BUILDX_DRIVER", "docker-container")
+    buildx_endpoint = getenv("INPUT_BUILDX_ENDPOINT", None)
+    buildx_driver_opts = getenv("INPUT_BUILDX_DRIVER_OPTS", None)
+    buildx_max_cache_size_mb = getenv("INPUT_BUILDX_MAX_CACHE_SIZE_MB", None)
+    buildx_platform_endpoints = getenv("INPUT_BUILDX_PLATFORM_ENDPOINTS", None)
+    buildx_max_idle_days = getenv(
+        "INPUT_BUILDX_MAX_IDLE_DAYS", str(deploy.DEFAULT_BUILDER_MAX_IDLE_DAYS)
+    )
+    build_fail_fast = getenv("INPUT_BUILD_FAIL_FAST", "true") == "true"
+    cf_fail_fast = getenv("INPUT_CF_FAIL_FAST", "false") == "true"
+    cache_stack_outputs = getenv("INPUT_CACHE_STACK_OUTPUTS", "false") == "true"
+    deployment_manifest = getenv("INPUT_DEPLOYMENT_MANIFEST", "true") == "true"
+    render_cache_mode = getenv("INPUT_RENDER_CACHE", "local")
+    cf_template_format = getenv("INPUT_CF_TEMPLATE_FORMAT", "yaml")
+    cf_compact_templates = getenv("INPUT_CF_COMPACT_TEMPLATES", "false") == "true"
+    cf_hoist_literals = getenv("INPUT_CF_HOIST_LITERALS", "false") == "true"
+    ecs_fast_deploy = getenv("INPUT_ECS_FAST_DEPLOY", "false") == "true"
+    phases = getenv("INPUT_PHASES", None)
+    build_services = getenv("INPUT_BUILD_SERVICES", None)
+    handoff_path = getenv("INPUT_HANDOFF_MANIFEST", None)
+    handoff_inputs = getenv("INPUT_HANDOFF_INPUTS", None)
+    trace_export_path = getenv("INPUT_TRACE_EXPORT_PATH", None)
+    targets = getenv("INPUT_TARGETS", None)
+    max_parallel_targets = getenv("INPUT_MAX_PARALLEL_TARGETS", None)
+    render_cache_max_size_mb = getenv(
+        "INPUT_RENDER_CACHE_MAX_SIZE_MB", str(deploy.DEFAULT_RENDER_CACHE_MAX_SIZE_MB)
+    )
+    build_cache_max_size_mb = getenv(
+        "INPUT_BUILD_CACHE_MAX_SIZE_MB", str(deploy.DEFAULT_BUILD_CACHE_MAX_SIZE_MB)
+    )
 
     aws_region = getenv("AWS_REGION", None) or getenv("AWS_DEFAULT_REGION", None)
 
@@ -27,8 +79,8 @@ def github_action_handler():
 
     # check required env vars
 
-    # check if aws region is set
-    if aws_region is None:
+    # check if aws region is set (targets come with their own region)
+    if aws_region is None and targets is None:
         raise ValueError("AWS_REGION environment variable is not set")
 
     # process params
@@ -44,6 +96,116 @@ def github_action_handler():
                 "Invalid value provided for ECR_KEEP_LAST_N_IMAGES. Must be an integer"
             )
 
+    # convert build_cache_max_size_mb to int
+    if build_cache_max_size_mb == "0":
+        build_cache_max_size_mb = None
+    else:
+        try:
+            build_cache_max_size_mb = int(build_cache_max_size_mb)
+        except ValueError:
+            raise ValueError(
+                "Invalid value provided for BUILD_CACHE_MAX_SIZE_MB. Must be an integer"
+            )
+
+    # convert render_cache_max_size_mb to int
+    if render_cache_max_size_mb == "0":
+        render_cache_max_size_mb = None
+    else:
+        try:
+            render_cache_max_size_mb = int(render_cache_max_size_mb)
+        except ValueError:
+            raise ValueError(
+                "Invalid value provided for RENDER_CACHE_MAX_SIZE_MB. Must be an integer"
+            )
+
+    # convert max_parallel_builds to int (None: derived from available CPUs and memory)
+    if max_parallel_builds == "0":
+        max_parallel_builds = None
+    elif max_parallel_builds is not None:
+        try:
+            max_parallel_builds = int(max_parallel_builds)
+        except ValueError:
+            raise ValueError(
+                "Invalid value provided for MAX_PARALLEL_BUILDS. Must be an integer"
+            )
+
+    # convert max_parallel_targets to int (0: all targets at once)
+    if max_parallel_targets is not None:
+        try:
+            max_parallel_targets = int(max_parallel_targets)
+        except ValueError:
+            raise ValueError(
+                "Invalid value provided for MAX_PARALLEL_TARGETS. Must be an integer"
+            )
+
+    # split comma separated lists
+    (
+        phases,
+        build_services,
+        handoff_inputs,
+        buildx_driver_opts,
+        buildx_platform_endpoints,
+        ecr_pull_through_credentials,
+        targets,
+    ) = [
+        (
+            [item.strip() for item in value.split(",") if item.strip()]
+            if value is not None
+            else None
+        )
+        for value in [
+            phases,
+            build_services,
+            handoff_inputs,
+            buildx_driver_opts,
+            buildx_platform_endpoints,
+            ecr_pull_through_credentials,
+            targets,
+        ]
+    ]
+
+    # convert buildx_platform_endpoints ("<platform>=<endpoint>" items) to a dict
+    if buildx_platform_endpoints is not None:
+        if any("=" not in item for item in buildx_platform_endpoints):
+            raise ValueError(
+                "Invalid value provided for BUILDX_PLATFORM_ENDPOINTS. Must be a comma separated list of <platform>=<endpoint>"
+            )
+        buildx_platform_endpoints = dict(
+            item.split("=", 1) for item in buildx_platform_endpoints
+        )
+
+    # convert ecr_pull_through_credentials ("<upstream registry>=<secret arn>" items) to a dict
+    if ecr_pull_through_credentials is not None:
+        if any("=" not in item for item in ecr_pull_through_credentials):
+            raise ValueError(
+                "Invalid value provided for ECR_PULL_THROUGH_CREDENTIALS. Must be a comma separated list of <upstream registry>=<secret arn>"
+            )
+        ecr_pull_through_credentials = dict(
+            item.split("=", 1) for item in ecr_pull_through_credentials
+        )
+
+    # convert buildx_max_cache_size_mb to int (None: no limit)
+    if buildx_max_cache_size_mb == "0":
+        buildx_max_cache_size_mb = None
+    elif buildx_max_cache_size_mb is not None:
+        try:
+            buildx_max_cache_size_mb = int(buildx_max_cache_size_mb)
+        except ValueError:
+            raise ValueError(
+                "Invalid value provided for BUILDX_MAX_CACHE_SIZE_MB. Must be an integer"
+            )
+
+    # convert buildx_max_idle_days to int (None: builders are never removed)
+    if buildx_max_idle_days == "0":
+        buildx_max_idle_days = None
+    else:
+        try:
+            buildx_max_idle_days = int(buildx_max_idle_days)
+        except ValueError:
+            raise ValueError(
+                "Invalid value provided for BUILDX_MAX_IDLE_DAYS. Must be an integer"
+            )
+
     # get branch name
     git_branch = git_ref.split("/")[-1] if git_ref is not None else None
 
@@ -62,18 +224,81 @@ def github_action_handler():
         os.chdir(github_workspace_dir)
 
     # run the actual deployment
-    dep = Deployment(
+    init_start_time = perf_counter()
+    deployment_kwargs = dict(
         cf_stack_prefix=cf_stack_prefix,
-        env_name=env_name,
         docker_compose_file=docker_compose_file,
         ecs_composex_file=ecs_composex_file,
         ecr_keep_last_n_images=ecr_keep_last_n_images,
+        ecr_pull_through_cache=ecr_pull_through_cache,
+        ecr_pull_through_credentials=ecr_pull_through_credentials,
         git_branch=git_branch,
         git_commit=git_commit,
-        aws_region=aws_region,
+        build_cache_mode=build_cache_mode,
+        build_cache_max_size_mb=build_cache_max_size_mb,
+        build_engine=build_engine,
+        image_compression=image_compression,
+        soci_index=soci_index,
+        buildx_driver=buildx_driver,
+        buildx_endpoint=buildx_endpoint,
+        buildx_driver_opts=buildx_driver_opts,
+        buildx_max_cache_size_mb=buildx_max_cache_size_mb,
+        buildx_max_idle_days=buildx_max_idle_days,
+        buildx_platform_endpoints=buildx_platform_endpoints,
+        max_parallel_builds=max_parallel_builds,
+        build_fail_fast=build_fail_fast,
+        cf_fail_fast=cf_fail_fast,
+        cache_stack_outputs=cache_stack_outputs,
+        deployment_manifest=deployment_manifest,
+        render_cache_mode=render_cache_mode,
+        render_cache_max_size_mb=render_cache_max_size_mb,
+        cf_template_format=cf_template_format,
+        cf_compact_templates=cf_compact_templates,
+        cf_hoist_literals=cf_hoist_literals,
+        ecs_fast_deploy=ecs_fast_deploy,
+        phases=phases,
+        build_services=build_services,
+        handoff_path=handoff_path,
+        handoff_inputs=handoff_inputs,
+        trace_export_path=trace_export_path,
     )
+    if targets is not None:
+        # several environments and/or regions, deployed concurrently
+        deploy_targets = importlib.import_module("src.deploy_targets")
+        dep = deploy_targets.MultiTargetDeployment(
+            targets=deploy_targets.parse_targets(targets),
+            max_parallel_targets=(
+                max_parallel_targets
+                if max_parallel_targets is not None
+                else deploy_targets.DEFAULT_MAX_PARALLEL_TARGETS
+            ),
+            **deployment_kwargs,
+        )
+    else:
+        dep = deploy.Deployment(
+            env_name=env_name, aws_region=aws_region, **deployment_kwargs
+        )
+    init_time = perf_counter() - init_start_time
+
+    if profile_startup:
+        # rendering imports ecs_composex on demand, measure what it adds
+        _, ecs_composex_import_time = import_timed("ecs_composex.ecs_composex")
+        logger.info(
+            f"Startup profile: import src.deploy {deploy_import_time:.3f}s, "
+            f"Deployment init {init_time:.3f}s, "
+            f"import ecs_composex (when rendering) {ecs_composex_import_time:.3f}s"
+        )
+        return
+
     asyncio.run(dep.run())
 
 
 if __name__ == "__main__":
-    github_action_handler()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Log import and initialisation times and exit without deploying",
+    )
+    args = parser.parse_args()
+    github_action_handler(profile_startup=args.profile_startup)
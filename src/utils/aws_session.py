@@ -0,0 +1,47 @@
+import threading
+import boto3
+from botocore.config import Config
+from src.utils.tracing import instrument_client
+
+
+# adaptive retry mode adds client side rate limiting on top of exponential backoff,
+# which keeps concurrent waits and deployments from running into "Throttling" errors
+DEFAULT_BOTO_CONFIG = Config(
+    retries={
+        "mode": "adaptive",
+        "max_attempts": 10,
+    },
+    # clients are shared by thread pools (e.g. parallel S3 uploads)
+    max_pool_connections=32,
+)
+
+
+class AwsSession:
+    # one botocore session shared by all clients of a deployment, so that credentials are resolved
+    # and service models are loaded only once. clients are created on first use and then reused
+    # (each with its own connection pool), code paths which never call a service don't pay for it
+
+    def __init__(self, region_name: str, config: Config = DEFAULT_BOTO_CONFIG):
+        self.region_name = region_name
+        self.config = config
+        self.session = boto3.session.Session(region_name=region_name)
+        self._client_by_service_name = {}
+        self._account_id = None
+        # creating clients from the same session is not thread-safe
+        self._lock = threading.Lock()
+        self._account_id_lock = threading.Lock()
+
+    def client(self, service_name: str):
+        with self._lock:
+            if service_name not in self._client_by_service_name:
+                self._client_by_service_name[service_name] = instrument_client(
+                    self.session.client(service_name, config=self.config)
+                )
+            return self._client_by_service_name[service_name]
+
+    def get_account_id(self) -> str:
+        # looked up once, on first use
+        with self._account_id_lock:
+            if self._account_id is None:
+                self._account_id = self.client("sts").get_caller_identity()["Account"]
+            return self._account_id
@@ -0,0 +1,130 @@
+import os
+import re
+import shutil
+from pathlib import Path
+from src.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+BUILD_CACHE_MODES = ["local", "registry", "none"]
+BUILD_CACHE_TAG = "buildcache"
+BUILD_CACHE_REPO_SUFFIX = "-buildcache"
+
+
+def get_dir_size(dir_path: Path) -> int:
+    total_size = 0
+    for root, _, file_names in os.walk(dir_path):
+        for file_name in file_names:
+            file_path = Path(root) / file_name
+            if not file_path.is_symlink():
+                total_size += file_path.stat().st_size
+    return total_size
+
+
+def is_buildx_step_line(line: str) -> bool:
+    # lines of "--progress=plain" output relevant for parse_buildx_cache_stats
+    return re.match(r"^#\d+ (CACHED|\[)", line) is not None
+
+
+def parse_buildx_cache_stats(
+    build_output: str, target: str | None = None
+) -> tuple[int, int]:
+    # parses "--progress=plain" output and returns (cached steps, total steps)
+    # e.g. "#7 [build 2/5] RUN pip install ..." followed by "#7 CACHED".
+    # only Dockerfile instructions are counted, internal steps (loading context etc.) are ignored.
+    # bake prefixes each step with its target name, e.g. "#7 [api build 2/5] RUN ..."
+    target_prefix = f"{re.escape(target)} " if target is not None else ""
+    step_ids = set(
+        re.findall(
+            rf"^#(\d+) \[{target_prefix}(?:\S+ )?\d+/\d+\]",
+            build_output,
+            flags=re.MULTILINE,
+        )
+    )
+    cached_step_ids = set(
+        re.findall(r"^#(\d+) CACHED", build_output, flags=re.MULTILINE)
+    )
+    return len(cached_step_ids & step_ids), len(step_ids)
+
+
+class BuildxCache:
+    def __init__(
+        self,
+        mode: str = "local",
+        cache_dir: str | Path = "/tmp/.buildx-cache",
+        max_size_mb: int | None = None,
+    ):
+        if mode not in BUILD_CACHE_MODES:
+            raise ValueError(
+                f"Invalid build cache mode '{mode}'. Must be one of: {', '.join(BUILD_CACHE_MODES)}"
+            )
+        self.mode = mode
+        self.cache_dir = Path(cache_dir)
+        self.max_size_bytes = (
+            max_size_mb * 1024 * 1024 if max_size_mb is not None else None
+        )
+
+    def _get_local_dir(self, cache_key: str) -> Path:
+        return self.cache_dir / cache_key
+
+    def _get_local_new_dir(self, cache_key: str) -> Path:
+        return self.cache_dir / f"{cache_key}-new"
+
+    def get_cache_from(self, cache_key: str, cache_image_uri: str | None) -> str | None:
+        if self.mode == "local":
+            return f"type=local,src={self._get_local_dir(cache_key)}"
+        elif self.mode == "registry" and cache_image_uri is not None:
+            return f"type=registry,ref={cache_image_uri}"
+        return None
+
+    def get_cache_to(self, cache_key: str, cache_image_uri: str | None) -> str | None:
+        if self.mode == "local":
+            # the local exporter never prunes old blobs, so always export into a fresh dir
+            # and swap it in after the build (see finalize)
+            return f"type=local,dest={self._get_local_new_dir(cache_key)},mode=max"
+        elif self.mode == "registry" and cache_image_uri is not None:
+            # ECR only accepts cache manifests in the OCI image manifest format
+            return f"type=registry,ref={cache_image_uri},mode=max,image-manifest=true,oci-mediatypes=true"
+        return None
+
+    def prepare(self) -> None:
+        # ensure local cache dir exists. build will fail otherwise when trying to write to the cache
+        if self.mode == "local":
+            self.cache_dir.mkdir(exist_ok=True, parents=True)
+
+    def finalize(self, cache_key: str) -> None:
+        # replace the previous cache with the freshly exported one
+        if self.mode != "local":
+            return
+        new_dir = self._get_local_new_dir(cache_key)
+        if not new_dir.is_dir():
+            return
+        cur_dir = self._get_local_dir(cache_key)
+        if cur_dir.exists():
+            shutil.rmtree(cur_dir)
+        new_dir.rename(cur_dir)
+        # mtime is used as last access time for eviction
+        os.utime(cur_dir)
+
+    def evict(self) -> None:
+        # remove least recently used cache dirs until the cache fits into max size
+        if self.mode != "local" or self.max_size_bytes is None:
+            return
+        if not self.cache_dir.is_dir():
+            return
+        cache_dirs = sorted(
+            [p for p in self.cache_dir.iterdir() if p.is_dir()],
+            key=lambda p: p.stat().st_mtime,
+        )
+        size_by_dir = {p: get_dir_size(p) for p in cache_dirs}
+        total_size = sum(size_by_dir.values())
+        for cache_dir in cache_dirs:
+            if total_size <= self.max_size_bytes:
+                break
+            shutil.rmtree(cache_dir)
+            total_size -= size_by_dir[cache_dir]
+            logger.debug(
+                f"Evicted build cache {cache_dir} ({size_by_dir[cache_dir] // (1024 * 1024)} MB)"
+            )
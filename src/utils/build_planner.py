@@ -0,0 +1,210 @@
+import fnmatch
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+
+
+DEFAULT_PLATFORM = "linux/amd64"
+DEFAULT_DOCKERFILE = "Dockerfile"
+FINGERPRINT_TAG_PREFIX = "build-"
+
+
+@dataclass
+class BuildSpec:
+    service_name: str
+    context: str
+    dockerfile: str = DEFAULT_DOCKERFILE
+    args: dict[str, str] = field(default_factory=dict)
+    target: str | None = None
+    platforms: list[str] = field(default_factory=lambda: [DEFAULT_PLATFORM])
+    cache_from: list[str] = field(default_factory=list)
+
+    @property
+    def is_git_context(self) -> bool:
+        return self.context.startswith("https://") or self.context.startswith("http://")
+
+    @property
+    def dockerfile_path(self) -> str:
+        # in local context, the dockerfile path is relative to the context
+        if self.is_git_context:
+            return self.dockerfile
+        return str(Path(self.context) / self.dockerfile)
+
+
+@dataclass
+class BuildGroup:
+    # one unique build spec shared by one or more services
+    fingerprint: str
+    spec: BuildSpec
+    image_uri_by_service_name: dict[str, str] = field(default_factory=dict)
+    context_size: int = 0
+
+    @property
+    def fingerprint_tag(self) -> str:
+        return f"{FINGERPRINT_TAG_PREFIX}{self.fingerprint[:32]}"
+
+    @property
+    def service_names(self) -> list[str]:
+        return list(self.image_uri_by_service_name.keys())
+
+    @property
+    def is_cacheable(self) -> bool:
+        # remote (git) contexts can change without the build spec changing,
+        # so their fingerprint is not a reliable content address
+        return not self.spec.is_git_context
+
+
+def get_platform_slug(platform: str) -> str:
+    # e.g. "linux/arm64/v8" -> "linux-arm64-v8", usable in tags, file names and cache keys
+    return platform.replace("/", "-")
+
+
+def parse_build_spec(service_name: str, service_params: dict) -> BuildSpec:
+    build_props = service_params["build"]
+
+    # ensure build_props is a valid dict
+    if isinstance(build_props, str):
+        build_props = {"context": build_props}
+    elif "context" not in build_props:
+        raise ValueError(
+            f"Invalid build params for service '{service_name}': missing 'context' field."
+        )
+
+    # build args can be given as a mapping or as a list of "KEY=VALUE" strings
+    build_args = build_props.get("args", {}) or {}
+    if isinstance(build_args, list):
+        build_args = dict(
+            arg.split("=", 1) if "=" in arg else (arg, os.environ.get(arg, ""))
+            for arg in build_args
+        )
+
+    # a multi-platform image (build.platforms) or a single platform (service level "platform")
+    platforms = build_props.get("platforms") or [
+        service_params.get("platform", DEFAULT_PLATFORM)
+    ]
+
+    # cache_from can be a single string or a list of cache sources
+    cache_from = build_props.get("cache_from", []) or []
+    if isinstance(cache_from, str):
+        cache_from = [cache_from]
+
+    # todo: add support for build.dockerfile_inline
+    # todo add support for more params: https://docs.docker.com/compose/compose-file/build/
+    return BuildSpec(
+        service_name=service_name,
+        context=build_props["context"],
+        dockerfile=build_props.get("dockerfile", DEFAULT_DOCKERFILE),
+        args={str(k): str(v) for k, v in build_args.items()},
+        target=build_props.get("target", None),
+        platforms=platforms,
+        cache_from=cache_from,
+    )
+
+
+def _load_dockerignore_patterns(context_dir: Path) -> list[str]:
+    dockerignore_path = context_dir / ".dockerignore"
+    if not dockerignore_path.is_file():
+        return []
+    patterns = []
+    for line in dockerignore_path.read_text().splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            patterns.append(line.lstrip("/"))
+    return patterns
+
+
+def _is_ignored(rel_path: str, patterns: list[str]) -> bool:
+    # last matching pattern wins, "!" negates (same semantics as .dockerignore)
+    parts = rel_path.split("/")
+    candidates = ["/".join(parts[: i + 1]) for i in range(len(parts))]
+    ignored = False
+    for pattern in patterns:
+        negate = pattern.startswith("!")
+        pattern = pattern[1:] if negate else pattern
+        pattern = pattern.rstrip("/")
+        if any(fnmatch.fnmatch(candidate, pattern) for candidate in candidates):
+            ignored = not negate
+    return ignored
+
+
+def _iter_context_files(context_dir: Path):
+    # yields (relative posix path, path) of all files sent to the docker daemon, in a stable order
+    patterns = _load_dockerignore_patterns(context_dir)
+    for root, dir_names, file_names in os.walk(context_dir):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            file_path = Path(root) / file_name
+            rel_path = file_path.relative_to(context_dir).as_posix()
+            if not _is_ignored(rel_path, patterns):
+                yield rel_path, file_path
+
+
+def _hash_context_dir(context_dir: Path, hasher) -> None:
+    for rel_path, file_path in _iter_context_files(context_dir):
+        hasher.update(rel_path.encode())
+        # the executable bit ends up in the image, so it is part of the content
+        hasher.update(b"x" if os.access(file_path, os.X_OK) else b"-")
+        with file_path.open("rb") as fd:
+            for chunk in iter(lambda: fd.read(1024 * 1024), b""):
+                hasher.update(chunk)
+
+
+def get_context_size(spec: BuildSpec) -> int:
+    # size of the local build context in bytes, used as an estimate of the build cost.
+    # remote contexts are unknown until cloned
+    if spec.is_git_context:
+        return 0
+    return sum(
+        file_path.stat().st_size
+        for _, file_path in _iter_context_files(Path(spec.context))
+    )
+
+
+def compute_build_fingerprint(
+    spec: BuildSpec, output_options: dict[str, str] | None = None
+) -> str:
+    hasher = hashlib.sha256()
+    # cache_from is intentionally left out: it does not change the resulting image
+    inputs = {
+        "context": spec.context if spec.is_git_context else None,
+        "dockerfile": spec.dockerfile,
+        "args": spec.args,
+        "target": spec.target,
+        "platform": ",".join(spec.platforms),
+    }
+    # output options like the layer compression do (default outputs keep earlier fingerprints)
+    if output_options:
+        inputs["output"] = output_options
+    hasher.update(json.dumps(inputs, sort_keys=True).encode())
+    if not spec.is_git_context:
+        context_dir = Path(spec.context)
+        _hash_context_dir(context_dir, hasher)
+        # the dockerfile may live outside the context dir
+        dockerfile_path = Path(spec.dockerfile_path)
+        if dockerfile_path.is_file():
+            hasher.update(dockerfile_path.read_bytes())
+    return hasher.hexdigest()
+
+
+def plan_builds(
+    build_spec_by_service_name: dict[str, BuildSpec],
+    image_uri_by_service_name: dict[str, str],
+    output_options: dict[str, str] | None = None,
+) -> list[BuildGroup]:
+    # group services with identical build specs so that each unique image is built once
+    group_by_fingerprint: dict[str, BuildGroup] = {}
+    for service_name, spec in build_spec_by_service_name.items():
+        fingerprint = compute_build_fingerprint(spec, output_options)
+        if fingerprint not in group_by_fingerprint:
+            group_by_fingerprint[fingerprint] = BuildGroup(
+                fingerprint=fingerprint,
+                spec=spec,
+                context_size=get_context_size(spec),
+            )
+        group = group_by_fingerprint[fingerprint]
+        group.image_uri_by_service_name[service_name] = image_uri_by_service_name[
+            service_name
+        ]
+    return list(group_by_fingerprint.values())
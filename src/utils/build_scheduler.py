@@ -0,0 +1,91 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, TypeVar
+from src.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+T = TypeVar("T")
+
+# rough memory footprint of a single BuildKit build (compilers, package managers etc.)
+MEMORY_PER_BUILD_BYTES = 2 * 1024 * 1024 * 1024
+
+
+def _get_total_memory_bytes() -> int | None:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def get_default_max_parallel_builds() -> int:
+    # one build per CPU, but no more builds than fit into memory
+    max_parallel = os.cpu_count() or 1
+    total_memory = _get_total_memory_bytes()
+    if total_memory is not None:
+        max_parallel = min(max_parallel, total_memory // MEMORY_PER_BUILD_BYTES)
+    return max(1, max_parallel)
+
+
+class BuildScheduler:
+    def __init__(self, max_parallel: int | None = None, fail_fast: bool = True):
+        self.max_parallel = max_parallel or get_default_max_parallel_builds()
+        self.fail_fast = fail_fast
+
+    async def run(
+        self,
+        jobs: list[Callable[[], Awaitable[T]]],
+        priorities: list[float] | None = None,
+    ) -> list[T]:
+        # runs jobs with at most max_parallel jobs at a time, highest priority first.
+        # returns the results in the order of the given jobs
+        if len(jobs) == 0:
+            return []
+        priorities = priorities or [0] * len(jobs)
+        order = sorted(range(len(jobs)), key=lambda i: priorities[i], reverse=True)
+        semaphore = asyncio.Semaphore(self.max_parallel)
+        logger.debug(
+            f"Running {len(jobs)} job(s) with max parallelism of {self.max_parallel}"
+        )
+
+        async def run_job(job: Callable[[], Awaitable[T]]) -> T:
+            async with semaphore:
+                return await job()
+
+        # tasks are created in priority order. the semaphore wakes up waiters in FIFO order,
+        # so higher priority jobs start first
+        task_by_index = {i: asyncio.create_task(run_job(jobs[i])) for i in order}
+        tasks = list(task_by_index.values())
+
+        try:
+            if self.fail_fast:
+                done, pending = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_EXCEPTION
+                )
+                failed = [t for t in done if t.exception() is not None]
+                if failed:
+                    for task in pending:
+                        task.cancel()
+                    await asyncio.gather(*pending, return_exceptions=True)
+                    if pending:
+                        logger.warning(
+                            f"Cancelled {len(pending)} remaining job(s) after a failure"
+                        )
+                    raise failed[0].exception()
+            else:
+                await asyncio.gather(*tasks, return_exceptions=True)
+                for task in tasks:
+                    if task.exception() is not None:
+                        raise task.exception()
+        except asyncio.CancelledError:
+            # e.g. a sibling task of the task graph failed: the jobs (and their subprocesses)
+            # must not outlive the run
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            raise
+
+        return [task_by_index[i].result() for i in range(len(jobs))]
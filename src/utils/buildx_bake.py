@@ -0,0 +1,44 @@
+import re
+from src.utils.build_planner import BuildSpec
+
+
+BUILD_ENGINES = ["build", "bake"]
+
+
+def get_bake_target_name(name: str) -> str:
+    # bake target names may only contain letters, digits, "_" and "-"
+    return re.sub(r"[^a-zA-Z0-9_-]", "-", name)
+
+
+def get_bake_target(
+    spec: BuildSpec,
+    tags: list[str],
+    cache_from: list[str],
+    cache_to: str | None,
+    output: str = "type=registry",
+) -> dict:
+    # translates a compose build spec into a bake target
+    # https://docs.docker.com/build/bake/reference/#target
+    target = {
+        "context": spec.context,
+        # unlike "docker buildx build --file", bake resolves the dockerfile relative to the context
+        "dockerfile": spec.dockerfile,
+        "args": spec.args,
+        # with a builder node per architecture, BuildKit builds each platform natively
+        "platforms": spec.platforms,
+        "tags": tags,
+        "cache-from": cache_from,
+        "output": [output],
+    }
+    if spec.target:
+        target["target"] = spec.target
+    if cache_to:
+        target["cache-to"] = [cache_to]
+    return target
+
+
+def get_bake_definition(target_by_name: dict[str, dict]) -> dict:
+    return {
+        "group": {"default": {"targets": list(target_by_name.keys())}},
+        "target": target_by_name,
+    }
@@ -0,0 +1,223 @@
+import hashlib
+import re
+import shlex
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from src.utils.logger import get_logger
+from src.utils.run_cmd import run_cmd_async
+
+
+logger = get_logger(__name__)
+
+
+BUILDER_DRIVERS = ["docker-container", "remote"]
+BUILDER_NAME_PREFIX = "deploy-compose"
+DEFAULT_BUILDER_MAX_IDLE_DAYS = 7
+
+
+def parse_buildx_inspect(output: str) -> dict:
+    # relevant fields of "docker buildx inspect": driver, node statuses and last activity
+    driver_match = re.search(r"^Driver:\s+(\S+)", output, flags=re.MULTILINE)
+    activity_match = re.search(r"^Last Activity:\s+(.+)$", output, flags=re.MULTILINE)
+    last_activity = None
+    if activity_match is not None:
+        # e.g. "2024-05-01 10:00:00 +0000 UTC"
+        try:
+            last_activity = datetime.strptime(
+                " ".join(activity_match.group(1).split()[:3]), "%Y-%m-%d %H:%M:%S %z"
+            )
+        except ValueError:
+            pass
+    return {
+        "driver": driver_match.group(1) if driver_match is not None else None,
+        "statuses": re.findall(r"^Status:\s+(\S+)", output, flags=re.MULTILINE),
+        "last_activity": last_activity,
+    }
+
+
+def parse_buildx_ls(output: str) -> list[str]:
+    # builder names of "docker buildx ls", node lines are indented
+    names = []
+    for line in output.splitlines()[1:]:
+        if line and not line[0].isspace():
+            names.append(line.split()[0].rstrip("*"))
+    return names
+
+
+class BuildxBuilder:
+    # a named BuildKit builder which is reused across deployments, so that its layer cache stays warm
+    # (e.g. on self-hosted runners). the name is derived from the stack prefix and the builder
+    # configuration: a changed configuration creates a new builder and the old one is removed
+
+    def __init__(
+        self,
+        cf_stack_prefix: str,
+        driver: str = "docker-container",
+        endpoint: str | None = None,
+        driver_opts: list[str] | None = None,
+        max_cache_size_mb: int | None = None,
+        max_idle_days: int | None = DEFAULT_BUILDER_MAX_IDLE_DAYS,
+        platform_endpoints: dict[str, str] | None = None,
+        config_dir: str | Path = "/tmp/.buildx-builder",
+    ):
+        if driver not in BUILDER_DRIVERS:
+            raise ValueError(
+                f"Invalid builder driver '{driver}'. Must be one of: {', '.join(BUILDER_DRIVERS)}"
+            )
+        if endpoint is not None and platform_endpoints:
+            raise ValueError(
+                "A builder endpoint and platform endpoints can't be used together"
+            )
+        if driver == "remote" and endpoint is None and not platform_endpoints:
+            raise ValueError("The remote builder driver requires an endpoint")
+        self.driver = driver
+        self.endpoint = endpoint
+        # one builder node per platform (e.g. {"linux/arm64": "tcp://arm-builder:1234"}), so that
+        # every platform is built natively. BuildKit schedules each platform on its matching node
+        self.platform_endpoints = platform_endpoints or {}
+        self.driver_opts = driver_opts or []
+        self.max_cache_size_mb = max_cache_size_mb
+        self.max_idle_days = max_idle_days
+        self.name_prefix = f"{BUILDER_NAME_PREFIX}-{cf_stack_prefix}-"
+        config_hash = hashlib.sha256(
+            repr(
+                [
+                    driver,
+                    endpoint,
+                    sorted(self.driver_opts),
+                    max_cache_size_mb,
+                    sorted(self.platform_endpoints.items()),
+                ]
+            ).encode()
+        ).hexdigest()[:8]
+        self.name = f"{self.name_prefix}{config_hash}"
+        self.config_path = Path(config_dir) / f"{self.name}.toml"
+
+    async def _inspect(self, name: str, bootstrap: bool = False) -> dict | None:
+        # returns None if the builder doesn't exist or can't be started
+        bootstrap_str = "--bootstrap " if bootstrap else ""
+        try:
+            output = await run_cmd_async(
+                f"docker buildx inspect {bootstrap_str}{shlex.quote(name)}"
+            )
+        except ValueError:
+            return None
+        return parse_buildx_inspect(output)
+
+    async def _remove(self, name: str) -> None:
+        try:
+            await run_cmd_async(f"docker buildx rm {shlex.quote(name)}")
+        except ValueError as e:
+            # e.g. removed concurrently by another job
+            logger.warning(f"Could not remove buildx builder {name}: {e}")
+
+    def _write_buildkitd_config(self) -> None:
+        # garbage collection of the builder's own cache, applied by BuildKit in the background
+        self.config_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.config_path.open("w") as fd:
+            fd.write(
+                "[worker.oci]\n"
+                "  gc = true\n"
+                f"  gckeepstorage = {self.max_cache_size_mb * 1024 * 1024}\n"
+            )
+
+    def _get_create_cmd(
+        self, endpoint: str | None, platform: str | None = None, node_index: int = 0
+    ) -> str:
+        args = [
+            "docker buildx create",
+            f"--name {shlex.quote(self.name)}",
+            f"--driver {self.driver}",
+        ]
+        if platform is not None:
+            # all nodes after the first are appended to the same builder
+            if node_index > 0:
+                args.append("--append")
+            args.append(f"--node {shlex.quote(f'{self.name}-{node_index}')}")
+            args.append(f"--platform {shlex.quote(platform)}")
+        args += [f"--driver-opt {shlex.quote(opt)}" for opt in self.driver_opts]
+        if self.driver == "docker-container" and self.max_cache_size_mb is not None:
+            args.append(f"--buildkitd-config {self.config_path}")
+        if endpoint is not None:
+            args.append(shlex.quote(endpoint))
+        return " ".join(args)
+
+    async def _create(self) -> None:
+        if self.driver == "docker-container" and self.max_cache_size_mb is not None:
+            self._write_buildkitd_config()
+        if self.platform_endpoints:
+            for node_index, (platform, endpoint) in enumerate(
+                self.platform_endpoints.items()
+            ):
+                await run_cmd_async(
+                    self._get_create_cmd(endpoint, platform, node_index)
+                )
+        else:
+            await run_cmd_async(self._get_create_cmd(self.endpoint))
+        await run_cmd_async(
+            f"docker buildx inspect --bootstrap {shlex.quote(self.name)}"
+        )
+
+    def warn_emulated_platforms(self, platforms: list[str]) -> None:
+        # platforms without a builder node of their own are built with QEMU emulation (if set up)
+        if not self.platform_endpoints:
+            return
+        emulated_platforms = sorted(set(platforms) - set(self.platform_endpoints))
+        if len(emulated_platforms) > 0:
+            logger.warning(
+                f"No native builder node for platform(s) {', '.join(emulated_platforms)}. "
+                "They are built with emulation, which is much slower"
+            )
+
+    async def setup(self) -> None:
+        await self.collect_garbage()
+        builder = await self._inspect(self.name, bootstrap=True)
+        if (
+            builder is not None
+            and builder["driver"] == self.driver
+            and len(builder["statuses"]) > 0
+            and all(status == "running" for status in builder["statuses"])
+        ):
+            logger.info(f"Reusing buildx builder {self.name}")
+            return
+        if builder is not None:
+            logger.info(f"Buildx builder {self.name} is unhealthy. Recreating it ...")
+            await self._remove(self.name)
+        logger.info(f"Creating buildx builder {self.name} ...")
+        await self._create()
+
+    async def collect_garbage(self) -> None:
+        # removes builders of this stack prefix with an outdated configuration
+        # and builders of other stack prefixes which were not used for max_idle_days
+        output = await run_cmd_async("docker buildx ls")
+        now = datetime.now(timezone.utc)
+        for name in parse_buildx_ls(output):
+            if name == self.name or not name.startswith(f"{BUILDER_NAME_PREFIX}-"):
+                continue
+            if re.fullmatch(rf"{re.escape(self.name_prefix)}[0-9a-f]{{8}}", name):
+                logger.info(
+                    f"Removing buildx builder {name} with an outdated configuration"
+                )
+                await self._remove(name)
+                continue
+            if self.max_idle_days is None:
+                continue
+            builder = await self._inspect(name)
+            if (
+                builder is not None
+                and builder["last_activity"] is not None
+                and now - builder["last_activity"] > timedelta(days=self.max_idle_days)
+            ):
+                logger.info(
+                    f"Removing buildx builder {name}, idle since {builder['last_activity']}"
+                )
+                await self._remove(name)
+
+    async def prune(self) -> None:
+        # limits the builder's cache to max_cache_size_mb, also for remote builders
+        if self.max_cache_size_mb is None:
+            return
+        await run_cmd_async(
+            f"docker buildx prune --builder {shlex.quote(self.name)} --force "
+            f"--keep-storage {self.max_cache_size_mb}mb"
+        )
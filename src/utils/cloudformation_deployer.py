@@ -1,11 +1,23 @@
-from time import sleep
-import boto3
+import json
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from src.utils.aws_session import AwsSession
 from src.utils.logger import get_logger
+from src.utils.stack_event_waiter import (
+    SUCCESS_STATUSES,
+    StackEventWaiter,
+    StackOperationFailedError,
+)
+from src.utils.stack_status_poller import StackStatusPoller
 
 
 logger = get_logger(__name__)
 
 
+DEFAULT_MAX_WORKERS = 8
+
+
 class CloudFormationDeployer:
     _default_capabilities = [
         "CAPABILITY_IAM",
@@ -13,13 +25,25 @@ class CloudFormationDeployer:
         "CAPABILITY_AUTO_EXPAND",
     ]
 
-    def __init__(self, region_name: str):
-        self.cf_client = boto3.client("cloudformation", region_name=region_name)
-        self.sts_client = boto3.client("sts")
+    def __init__(
+        self,
+        region_name: str,
+        fail_fast: bool = False,
+        aws_session: AwsSession | None = None,
+    ):
+        self.aws_session = aws_session or AwsSession(region_name=region_name)
+        self.cf_client = self.aws_session.client("cloudformation")
+        # status polling is shared with all other waits in the same region
+        self.stack_event_waiter = StackEventWaiter(
+            self.cf_client,
+            fail_fast=fail_fast,
+            status_poller=StackStatusPoller.get_shared(
+                self.cf_client, self.get_account_id()
+            ),
+        )
 
     def get_account_id(self) -> str:
-        identity = self.sts_client.get_caller_identity()
-        return identity["Account"]
+        return self.aws_session.get_account_id()
 
     def stack_exists(self, stack_name) -> bool:
         try:
@@ -30,6 +54,16 @@ class CloudFormationDeployer:
                 return False
             raise  # Re-raise the exception if it's not a "does not exist" error
 
+    def is_stack_deployed(self, stack_name: str) -> bool:
+        # True if the stack exists and its last operation succeeded
+        try:
+            stack = self._get_cloudformation_stack_by_name(stack_name)
+        except self.cf_client.exceptions.ClientError as e:
+            if "does not exist" in str(e):
+                return False
+            raise
+        return stack["StackStatus"] in SUCCESS_STATUSES
+
     def _get_cloudformation_stack_by_name(self, stack_name: str):
         response = self.cf_client.describe_stacks(StackName=stack_name)
         for stack in response["Stacks"]:
@@ -41,29 +75,24 @@ class CloudFormationDeployer:
         self,
         stack_name: str,
         timeout=2 * 60 * 60,  # in seconds
-        sleep_time=10,
+        after_event_id: str | None = None,
     ) -> None:
-        elapsed_time = 2  # initial delay
-        sleep(elapsed_time)  # wait before checking the stack status for the first time
-        stack_status = None
-        while elapsed_time < timeout:
+        if after_event_id is None:
+            # no cursor from the caller: return right away if there is no operation in progress,
+            # otherwise follow the operation from its latest event on
             stack_status = self._get_cloudformation_stack_by_name(stack_name)[
                 "StackStatus"
             ]
-            if stack_status.endswith("_IN_PROGRESS"):
-                logger.debug(f"Current stack status: {stack_status}")
-                sleep(sleep_time)
-                elapsed_time += sleep_time
-            elif stack_status.endswith("_COMPLETE") and not stack_status.endswith(
-                "_ROLLBACK_COMPLETE"
-            ):
-                logger.debug(f"Stack operation finished with status: {stack_status}")
-                return
-            else:
-                raise Exception(f"Stack operation failed with status: {stack_status}")
-
-        raise TimeoutError(
-            f"Timed out waiting for stack operation to complete. Last known status: {stack_status}"
+            if not stack_status.endswith("_IN_PROGRESS"):
+                if stack_status in SUCCESS_STATUSES:
+                    logger.debug(
+                        f"Stack operation finished with status: {stack_status}"
+                    )
+                    return
+                raise StackOperationFailedError(stack_name, stack_status, [])
+            after_event_id = self.stack_event_waiter.get_latest_event_id(stack_name)
+        self.stack_event_waiter.wait(
+            stack_name, after_event_id=after_event_id, timeout=timeout
         )
 
     def create_or_update_stack(
@@ -73,17 +102,22 @@ class CloudFormationDeployer:
         template_url: str | None = None,
         parameters: dict[str, str] = {},
         capabilities: list[str] | None = None,
+        wait_if_in_progress: bool = False,
     ) -> bool:
         """
-        return True if the stack was created or updated, False if no changes were needed
+        return True if the stack was created or updated, False if no changes were needed.
+        with wait_if_in_progress, an operation started concurrently by another job is awaited first
         """
         # check if template_body or template_url is provided
         if not any([template_body, template_url]):
             raise ValueError("Either template_body or template_url must be provided")
 
+        # remember the latest event before the operation starts,
+        # so that waiting only considers events of this operation
+        after_event_id = self.stack_event_waiter.get_latest_event_id(stack_name)
         cf_method = (
             self.cf_client.update_stack
-            if self.stack_exists(stack_name)
+            if after_event_id is not None
             else self.cf_client.create_stack
         )
         try:
@@ -102,42 +136,155 @@ class CloudFormationDeployer:
                 params["TemplateURL"] = template_url
             cf_method(**params)
             logger.debug(f"Stack create/update initiated for stack: {stack_name}")
-            self.wait_for_stack_completion(stack_name)
-            return True
         except Exception as err:
             if "no updates are to be performed" in str(err).lower():
                 logger.debug(f'Stack "{stack_name}" is up to date. No changes needed.')
                 return False
+            elif wait_if_in_progress and (
+                "_IN_PROGRESS state" in str(err) or "already exists" in str(err)
+            ):
+                logger.info(
+                    f'Stack "{stack_name}" is being deployed by another job. Waiting ...'
+                )
+                self.wait_for_stack_completion(stack_name)
+                return self.create_or_update_stack(
+                    stack_name=stack_name,
+                    template_body=template_body,
+                    template_url=template_url,
+                    parameters=parameters,
+                    capabilities=capabilities,
+                )
             else:
                 raise err
+        self.stack_event_waiter.wait(stack_name, after_event_id=after_event_id)
+        return True
 
     def get_stack_outputs(self, stack_name: str) -> list[dict[str, str]]:
         response = self.cf_client.describe_stacks(StackName=stack_name)
         outputs = response["Stacks"][0].get("Outputs", [])
         return outputs
 
-    def get_nested_stacks(self, stack_name: str) -> list[str]:
-        response = self.cf_client.describe_stack_resources(StackName=stack_name)
-        nested_stacks = [
-            resource["PhysicalResourceId"]
-            for resource in response["StackResources"]
-            if resource["ResourceType"] == "AWS::CloudFormation::Stack"
-        ]
+    def get_nested_stacks(self, stack_name: str) -> list[dict[str, str]]:
+        # returns id and last update time of all nested stacks.
+        # list_stack_resources is paginated, unlike describe_stack_resources which is capped
+        nested_stacks = []
+        paginator = self.cf_client.get_paginator("list_stack_resources")
+        for page in paginator.paginate(StackName=stack_name):
+            for resource in page["StackResourceSummaries"]:
+                if (
+                    resource["ResourceType"] == "AWS::CloudFormation::Stack"
+                    and resource.get("PhysicalResourceId")
+                    and resource["ResourceStatus"] != "DELETE_COMPLETE"
+                ):
+                    nested_stacks.append(
+                        {
+                            "stack_id": resource["PhysicalResourceId"],
+                            "last_updated": resource[
+                                "LastUpdatedTimestamp"
+                            ].isoformat(),
+                        }
+                    )
         return nested_stacks
 
-    def get_nested_stack_outputs(self, stack_name: str):
-        all_outputs = []
+    def get_resource_ids(self, stack_name: str, resource_type: str) -> list[str]:
+        # physical ids of all resources of a type in a stack and its nested stacks
+        resource_ids = []
+        stack_ids = [stack_name]
+        while stack_ids:
+            paginator = self.cf_client.get_paginator("list_stack_resources")
+            for page in paginator.paginate(StackName=stack_ids.pop()):
+                for resource in page["StackResourceSummaries"]:
+                    if (
+                        not resource.get("PhysicalResourceId")
+                        or resource["ResourceStatus"] == "DELETE_COMPLETE"
+                    ):
+                        continue
+                    if resource["ResourceType"] == "AWS::CloudFormation::Stack":
+                        stack_ids.append(resource["PhysicalResourceId"])
+                    elif resource["ResourceType"] == resource_type:
+                        resource_ids.append(resource["PhysicalResourceId"])
+        return resource_ids
 
-        # Get outputs of the current stack
-        stack_outputs = self.get_stack_outputs(stack_name)
-        all_outputs.extend(stack_outputs)
+    def _get_stack_outputs_and_nested_stacks(
+        self, stack_name: str
+    ) -> tuple[list[dict[str, str]], list[dict[str, str]]]:
+        response = self.cf_client.describe_stacks(StackName=stack_name)
+        stack = response["Stacks"][0]
+        # tag outputs with their source stack
+        outputs = [
+            {**output, "StackName": stack["StackName"]}
+            for output in stack.get("Outputs", [])
+        ]
+        return outputs, self.get_nested_stacks(stack_name)
+
+    def get_nested_stack_outputs(
+        self,
+        stack_name: str,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        cache_path: Path | None = None,
+    ) -> list[dict[str, str]]:
+        # collects the outputs of a stack and all of its nested stacks (depth-first order).
+        # sibling stacks are fetched in parallel. with a cache_path, nested stacks whose
+        # last update time did not change since the previous call are not queried again
+        cache = {}
+        if cache_path is not None and cache_path.is_file():
+            with cache_path.open("r") as fd:
+                cache = json.load(fd)
+
+        entry_by_stack_id = {}
+        queried_count = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # walk the tree level by level, the root stack is always queried
+            level = [{"stack_id": stack_name, "last_updated": None}]
+            while level:
+                future_by_stack_id = {}
+                for nested_stack in level:
+                    stack_id = nested_stack["stack_id"]
+                    cached_entry = cache.get(stack_id)
+                    if (
+                        nested_stack["last_updated"] is not None
+                        and cached_entry is not None
+                        and cached_entry["last_updated"] == nested_stack["last_updated"]
+                    ):
+                        entry_by_stack_id[stack_id] = cached_entry
+                    else:
+                        # run in the caller's context, so that API calls are traced as part of it
+                        future_by_stack_id[stack_id] = executor.submit(
+                            copy_context().run,
+                            self._get_stack_outputs_and_nested_stacks,
+                            stack_id,
+                        )
+                for nested_stack in level:
+                    stack_id = nested_stack["stack_id"]
+                    if stack_id in future_by_stack_id:
+                        outputs, children = future_by_stack_id[stack_id].result()
+                        entry_by_stack_id[stack_id] = {
+                            "last_updated": nested_stack["last_updated"],
+                            "outputs": outputs,
+                            "children": children,
+                        }
+                queried_count += len(future_by_stack_id)
+                level = [
+                    child
+                    for nested_stack in level
+                    for child in entry_by_stack_id[nested_stack["stack_id"]]["children"]
+                ]
+        logger.debug(
+            f"Collected outputs of {len(entry_by_stack_id)} stack(s), {queried_count} queried"
+        )
 
-        # Get nested stacks
-        nested_stacks = self.get_nested_stacks(stack_name)
+        if cache_path is not None:
+            with cache_path.open("w") as fd:
+                json.dump(
+                    {k: v for k, v in entry_by_stack_id.items() if k != stack_name},
+                    fd,
+                    default=str,
+                )
 
-        # Recursively get outputs of nested stacks
-        for nested_stack in nested_stacks:
-            nested_outputs = self.get_nested_stack_outputs(nested_stack)
-            all_outputs.extend(nested_outputs)
+        def collect(stack_id: str) -> list[dict[str, str]]:
+            all_outputs = list(entry_by_stack_id[stack_id]["outputs"])
+            for child in entry_by_stack_id[stack_id]["children"]:
+                all_outputs.extend(collect(child["stack_id"]))
+            return all_outputs
 
-        return all_outputs
+        return collect(stack_name)
@@ -0,0 +1,92 @@
+import hashlib
+import json
+from datetime import datetime, timezone
+from src.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+MANIFEST_VERSION = 1
+
+
+def get_fingerprint(value) -> str:
+    # stable hash of any JSON serializable value
+    return hashlib.sha256(
+        json.dumps(value, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class DeploymentManifest:
+    # records the input fingerprints and the outputs of the last successful deployment in the ci bucket.
+    # a later run compares its own input fingerprints against it to skip phases whose inputs did not change.
+    # the manifest is only written after a successful deployment, so a failed run never hides changes
+
+    def __init__(self, s3_client, bucket_name: str, s3_key: str):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.s3_key = s3_key
+        self.previous: dict | None = None
+        self.inputs: dict[str, str | None] = {}
+        # services updated outside of CloudFormation (image-only deployments) since the last stack update
+        self.drifted_services: list[str] = []
+
+    def load(self) -> dict | None:
+        try:
+            response = self.s3_client.get_object(
+                Bucket=self.bucket_name, Key=self.s3_key
+            )
+        except self.s3_client.exceptions.ClientError as e:
+            # the ci bucket doesn't exist yet on the first deployment
+            if e.response.get("Error", {}).get("Code") in [
+                "404",
+                "NoSuchKey",
+                "NoSuchBucket",
+            ]:
+                logger.debug("No deployment manifest found")
+                return None
+            raise
+        manifest = json.loads(response["Body"].read())
+        if manifest.get("version") != MANIFEST_VERSION:
+            logger.debug(
+                f"Ignoring deployment manifest of version {manifest.get('version')}"
+            )
+            return None
+        self.previous = manifest
+        self.drifted_services = manifest.get("drifted_services", [])
+        logger.debug(f"Loaded deployment manifest from {manifest.get('updated_at')}")
+        return manifest
+
+    def set_input(self, name: str, value) -> None:
+        # None marks an input which can't be fingerprinted and therefore never counts as unchanged
+        self.inputs[name] = get_fingerprint(value) if value is not None else None
+
+    def is_unchanged(self, *names: str) -> bool:
+        if self.previous is None:
+            return False
+        return all(
+            self.inputs.get(name) is not None
+            and self.previous["inputs"].get(name) == self.inputs[name]
+            for name in names
+        )
+
+    @property
+    def previous_outputs(self) -> list[dict] | None:
+        return self.previous["outputs"] if self.previous is not None else None
+
+    def save(self, outputs: list[dict]) -> None:
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "inputs": self.inputs,
+            "outputs": outputs,
+            "drifted_services": self.drifted_services,
+        }
+        self.s3_client.put_object(
+            Bucket=self.bucket_name,
+            Key=self.s3_key,
+            Body=json.dumps(manifest, indent=2, ensure_ascii=False).encode(),
+            ContentType="application/json",
+        )
+        self.previous = manifest
+        logger.debug(f'Saved deployment manifest to "{self.s3_key}"')
@@ -0,0 +1,173 @@
+import json
+from src.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+IMAGE_MANIFEST_MEDIA_TYPES = [
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.oci.image.index.v1+json",
+]
+
+
+def split_image_uri(image_uri: str) -> tuple[str, str]:
+    # "<registry>/<repo>:<tag>" -> ("<registry>/<repo>", "<tag>")
+    repo_uri, sep, tag = image_uri.rpartition(":")
+    if not sep or "/" in tag:
+        return image_uri, "latest"
+    return repo_uri, tag
+
+
+def ecr_image_tag_exists(ecr_client, repository_name: str, image_tag: str) -> bool:
+    try:
+        response = ecr_client.describe_images(
+            repositoryName=repository_name,
+            imageIds=[{"imageTag": image_tag}],
+        )
+    except ecr_client.exceptions.ImageNotFoundException:
+        return False
+    except ecr_client.exceptions.RepositoryNotFoundException:
+        return False
+    return len(response.get("imageDetails", [])) > 0
+
+
+def ecr_get_image_digest(
+    ecr_client, repository_name: str, image_tag: str
+) -> str | None:
+    try:
+        response = ecr_client.describe_images(
+            repositoryName=repository_name,
+            imageIds=[{"imageTag": image_tag}],
+        )
+    except ecr_client.exceptions.ImageNotFoundException:
+        return None
+    image_details = response.get("imageDetails", [])
+    return image_details[0]["imageDigest"] if image_details else None
+
+
+def ecr_list_repository_names(ecr_client, repository_name_prefix: str) -> list[str]:
+    # all repositories below a prefix (e.g. all environments of the same stack)
+    repository_names = []
+    paginator = ecr_client.get_paginator("describe_repositories")
+    for page in paginator.paginate():
+        for repo in page["repositories"]:
+            if repo["repositoryName"].startswith(repository_name_prefix):
+                repository_names.append(repo["repositoryName"])
+    return repository_names
+
+
+def _ecr_list_image_tags(ecr_client, repository_name: str) -> set[str]:
+    image_tags = set()
+    paginator = ecr_client.get_paginator("list_images")
+    for page in paginator.paginate(
+        repositoryName=repository_name, filter={"tagStatus": "TAGGED"}
+    ):
+        image_tags.update(
+            image_id["imageTag"]
+            for image_id in page["imageIds"]
+            if "imageTag" in image_id
+        )
+    return image_tags
+
+
+def ecr_find_image_tags(
+    ecr_client, repository_name: str, image_tags: list[str]
+) -> set[str]:
+    # returns the given tags which exist in the repository, with one describe_images call per 100 tags
+    found_tags = set()
+    all_image_tags = None
+    for i in range(0, len(image_tags), 100):
+        chunk = image_tags[i : i + 100]
+        try:
+            response = ecr_client.describe_images(
+                repositoryName=repository_name,
+                imageIds=[{"imageTag": image_tag} for image_tag in chunk],
+            )
+        except ecr_client.exceptions.RepositoryNotFoundException:
+            return set()
+        except ecr_client.exceptions.ImageNotFoundException:
+            # raised as soon as one of the tags is missing, the tags of the repository tell which
+            if len(chunk) > 1:
+                if all_image_tags is None:
+                    all_image_tags = _ecr_list_image_tags(ecr_client, repository_name)
+                found_tags.update(set(chunk) & all_image_tags)
+            continue
+        for image_detail in response.get("imageDetails", []):
+            found_tags.update(set(image_detail.get("imageTags", [])) & set(chunk))
+    return found_tags
+
+
+def ecr_retag_image(
+    ecr_client, repository_name: str, source_tag: str, target_tag: str
+) -> None:
+    # add a tag to an existing image without pulling or pushing any layers
+    response = ecr_client.batch_get_image(
+        repositoryName=repository_name,
+        imageIds=[{"imageTag": source_tag}],
+        # multi-platform images are manifest lists / image indexes
+        acceptedMediaTypes=IMAGE_MANIFEST_MEDIA_TYPES,
+    )
+    if not response.get("images"):
+        raise FileNotFoundError(
+            f"Image not found in ECR: {repository_name}:{source_tag}"
+        )
+    image = response["images"][0]
+    put_params = {
+        "repositoryName": repository_name,
+        "imageManifest": image["imageManifest"],
+        "imageTag": target_tag,
+    }
+    if "imageManifestMediaType" in image:
+        put_params["imageManifestMediaType"] = image["imageManifestMediaType"]
+    try:
+        ecr_client.put_image(**put_params)
+    except ecr_client.exceptions.ImageAlreadyExistsException:
+        # tag already points to this exact image
+        pass
+    logger.debug(f"Tagged {repository_name}:{source_tag} as {target_tag}")
+
+
+def _ecr_get_image_manifest(ecr_client, repository_name: str, image_id: dict) -> dict:
+    response = ecr_client.batch_get_image(
+        repositoryName=repository_name,
+        imageIds=[image_id],
+        acceptedMediaTypes=IMAGE_MANIFEST_MEDIA_TYPES,
+    )
+    if not response.get("images"):
+        raise FileNotFoundError(f"Image not found in ECR: {repository_name} {image_id}")
+    return json.loads(response["images"][0]["imageManifest"])
+
+
+def ecr_get_image_layer_stats(
+    ecr_client, repository_name: str, image_tag: str
+) -> dict[str | None, tuple[int, int]]:
+    # (compressed size in bytes, number of layers) by platform of an image.
+    # the platform of a single platform image is not part of its manifest (None)
+    manifest = _ecr_get_image_manifest(
+        ecr_client, repository_name, {"imageTag": image_tag}
+    )
+    if "manifests" not in manifest:
+        layers = manifest.get("layers", [])
+        return {None: (sum(layer["size"] for layer in layers), len(layers))}
+    layer_stats_by_platform = {}
+    for child in manifest["manifests"]:
+        platform = child.get("platform", {})
+        # attestation manifests have an "unknown/unknown" platform
+        if platform.get("os", "unknown") == "unknown":
+            continue
+        platform_str = "/".join(
+            [platform["os"], platform["architecture"]]
+            + ([platform["variant"]] if "variant" in platform else [])
+        )
+        child_manifest = _ecr_get_image_manifest(
+            ecr_client, repository_name, {"imageDigest": child["digest"]}
+        )
+        layers = child_manifest.get("layers", [])
+        layer_stats_by_platform[platform_str] = (
+            sum(layer["size"] for layer in layers),
+            len(layers),
+        )
+    return layer_stats_by_platform
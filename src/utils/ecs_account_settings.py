@@ -0,0 +1,126 @@
+import json
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from src.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# account settings rarely change outside of deployments, so a confirmed state is trusted for a day
+DEFAULT_CACHE_TTL = 24 * 60 * 60
+
+
+class EcsAccountSettings:
+    # makes sure the ECS account setting defaults have the desired values.
+    # the effective values are read once and only differing settings are written. the confirmed
+    # state is cached per account and region (in a local file and/or the ci bucket), so that
+    # deployments within the TTL make no API calls at all
+
+    _lock_by_key: dict[str, threading.Lock] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(
+        self,
+        ecs_client,
+        account_id: str,
+        region_name: str,
+        cache_path: Path | None = None,
+        s3_client=None,
+        bucket_name: str | None = None,
+        s3_prefix: str = "ecs-account-settings",
+        ttl: float = DEFAULT_CACHE_TTL,
+    ):
+        self.ecs_client = ecs_client
+        self.key = f"{account_id}-{region_name}"
+        self.cache_path = cache_path
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.s3_key = f"{s3_prefix}/{self.key}.json"
+        self.ttl = ttl
+
+    def _get_lock(self) -> threading.Lock:
+        # concurrent deployments to the same account and region reconcile one after another
+        with self._registry_lock:
+            return self._lock_by_key.setdefault(self.key, threading.Lock())
+
+    def _read_cache(self) -> dict | None:
+        if self.cache_path is not None and self.cache_path.is_file():
+            with self.cache_path.open("r") as fd:
+                return json.load(fd)
+        if self.s3_client is not None:
+            try:
+                response = self.s3_client.get_object(
+                    Bucket=self.bucket_name, Key=self.s3_key
+                )
+            except self.s3_client.exceptions.ClientError as e:
+                if e.response.get("Error", {}).get("Code") in [
+                    "404",
+                    "NoSuchKey",
+                    "NoSuchBucket",
+                ]:
+                    return None
+                raise
+            return json.loads(response["Body"].read())
+        return None
+
+    def _get_cached_settings(self) -> dict[str, str] | None:
+        cache = self._read_cache()
+        if cache is None:
+            return None
+        confirmed_at = datetime.fromisoformat(cache["confirmed_at"])
+        age = (datetime.now(timezone.utc) - confirmed_at).total_seconds()
+        if age > self.ttl:
+            logger.debug(f"Cached ECS account settings expired ({age / 3600:.1f}h old)")
+            return None
+        return cache["settings"]
+
+    def _write_cache(self, settings: dict[str, str]) -> None:
+        body = json.dumps(
+            {
+                "confirmed_at": datetime.now(timezone.utc).isoformat(),
+                "settings": settings,
+            },
+            indent=2,
+        )
+        if self.cache_path is not None:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with self.cache_path.open("w") as fd:
+                fd.write(body)
+        if self.s3_client is not None:
+            self.s3_client.put_object(
+                Bucket=self.bucket_name, Key=self.s3_key, Body=body.encode()
+            )
+
+    def get_effective_settings(self) -> dict[str, str]:
+        settings = {}
+        paginator = self.ecs_client.get_paginator("list_account_settings")
+        for page in paginator.paginate(effectiveSettings=True):
+            for setting in page["settings"]:
+                settings[setting["name"]] = setting["value"]
+        return settings
+
+    def reconcile(self, desired_settings: dict[str, str]) -> list[str]:
+        # returns the names of the settings which were changed
+        with self._get_lock():
+            cached_settings = self._get_cached_settings()
+            if cached_settings is not None and all(
+                cached_settings.get(name) == value
+                for name, value in desired_settings.items()
+            ):
+                logger.debug("ECS account settings confirmed by cache")
+                return []
+
+            settings = self.get_effective_settings()
+            changed_names = []
+            for name, value in desired_settings.items():
+                if settings.get(name) == value:
+                    continue
+                self.ecs_client.put_account_setting_default(name=name, value=value)
+                logger.info(f"ECS Setting {name} set to '{value}'")
+                settings[name] = value
+                changed_names.append(name)
+
+            self._write_cache(settings)
+            return changed_names
@@ -0,0 +1,214 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from src.utils.ecr_helper import split_image_uri
+from src.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# fields of describe_task_definition which register_task_definition doesn't accept
+TASK_DEFINITION_READ_ONLY_FIELDS = [
+    "taskDefinitionArn",
+    "revision",
+    "status",
+    "requiresAttributes",
+    "compatibilities",
+    "registeredAt",
+    "registeredBy",
+    "deregisteredAt",
+]
+# describe_services (and therefore the services_stable waiter) accepts at most 10 services
+DESCRIBE_SERVICES_MAX_SERVICES = 10
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_STABILITY_TIMEOUT = 30 * 60  # in seconds
+STABILITY_POLL_INTERVAL = 15  # in seconds
+
+
+def get_cluster_name(service_arn: str) -> str:
+    # "arn:aws:ecs:<region>:<account>:service/<cluster>/<service>" (long ARN format)
+    parts = service_arn.split(":")[-1].split("/")
+    if len(parts) != 3:
+        raise ValueError(f"Service ARN without cluster name: {service_arn}")
+    return parts[1]
+
+
+def get_task_definition_family(task_definition_arn: str) -> str:
+    # "arn:aws:ecs:<region>:<account>:task-definition/<family>:<revision>"
+    return task_definition_arn.split("/")[-1].rpartition(":")[0]
+
+
+class EcsServiceUpdateError(Exception):
+    pass
+
+
+class EcsFastDeployer:
+    # rolls out new container images without a CloudFormation stack update: the current task
+    # definition of every affected service is registered again with the new images and the service
+    # is pointed to the new revision. until the next full deployment the stack still references the
+    # previous revisions, reconcile() moves such drifted services back to the stack's task definitions
+
+    def __init__(
+        self,
+        ecs_client,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        stability_timeout: int = DEFAULT_STABILITY_TIMEOUT,
+    ):
+        self.ecs_client = ecs_client
+        self.max_workers = max_workers
+        self.stability_timeout = stability_timeout
+
+    def _get_service_batches(
+        self, service_arns: list[str]
+    ) -> list[tuple[str, list[str]]]:
+        # (cluster, services) batches for describe_services and the services_stable waiter
+        service_arns_by_cluster = {}
+        for service_arn in service_arns:
+            service_arns_by_cluster.setdefault(
+                get_cluster_name(service_arn), []
+            ).append(service_arn)
+        return [
+            (cluster, cluster_service_arns[i : i + DESCRIBE_SERVICES_MAX_SERVICES])
+            for cluster, cluster_service_arns in service_arns_by_cluster.items()
+            for i in range(0, len(cluster_service_arns), DESCRIBE_SERVICES_MAX_SERVICES)
+        ]
+
+    def _describe_services(self, service_arns: list[str]) -> list[dict]:
+        services = []
+        for cluster, batch in self._get_service_batches(service_arns):
+            response = self.ecs_client.describe_services(
+                cluster=cluster, services=batch
+            )
+            services.extend(s for s in response["services"] if s["status"] == "ACTIVE")
+        return services
+
+    def _register_with_images(
+        self, task_definition_arn: str, image_uri_by_repository: dict[str, str]
+    ) -> str | None:
+        # returns the ARN of the new revision, None if no container uses one of the images
+        response = self.ecs_client.describe_task_definition(
+            taskDefinition=task_definition_arn, include=["TAGS"]
+        )
+        task_definition = response["taskDefinition"]
+        is_changed = False
+        for container in task_definition["containerDefinitions"]:
+            repository_uri, _ = split_image_uri(container["image"])
+            image_uri = image_uri_by_repository.get(repository_uri)
+            if image_uri is not None and image_uri != container["image"]:
+                container["image"] = image_uri
+                is_changed = True
+        if not is_changed:
+            return None
+
+        params = {
+            key: value
+            for key, value in task_definition.items()
+            if key not in TASK_DEFINITION_READ_ONLY_FIELDS
+        }
+        if response.get("tags"):
+            params["tags"] = response["tags"]
+        response = self.ecs_client.register_task_definition(**params)
+        return response["taskDefinition"]["taskDefinitionArn"]
+
+    def _wait_until_stable(self, cluster: str, service_arns: list[str]) -> None:
+        waiter = self.ecs_client.get_waiter("services_stable")
+        waiter.wait(
+            cluster=cluster,
+            services=service_arns,
+            WaiterConfig={
+                "Delay": STABILITY_POLL_INTERVAL,
+                "MaxAttempts": self.stability_timeout // STABILITY_POLL_INTERVAL,
+            },
+        )
+
+    def _update_services(
+        self, task_definition_arn_by_service_arn: dict[str, str]
+    ) -> None:
+        service_arns = list(task_definition_arn_by_service_arn.keys())
+        # run in the caller's context, so that API calls are traced as part of it
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                executor.submit(
+                    copy_context().run,
+                    self.ecs_client.update_service,
+                    cluster=get_cluster_name(service_arn),
+                    service=service_arn,
+                    taskDefinition=task_definition_arn,
+                )
+                for service_arn, task_definition_arn in task_definition_arn_by_service_arn.items()
+            ]
+            for future in futures:
+                future.result()
+            logger.info(
+                f"Waiting for {len(service_arns)} ECS service(s) to become stable ..."
+            )
+            futures = [
+                executor.submit(
+                    copy_context().run, self._wait_until_stable, cluster, batch
+                )
+                for cluster, batch in self._get_service_batches(service_arns)
+            ]
+            for future in futures:
+                future.result()
+
+        # a service is also stable after the deployment circuit breaker rolled it back
+        rolled_back_service_names = [
+            service["serviceName"]
+            for service in self._describe_services(service_arns)
+            if service["taskDefinition"]
+            != task_definition_arn_by_service_arn[service["serviceArn"]]
+        ]
+        if rolled_back_service_names:
+            raise EcsServiceUpdateError(
+                f"ECS service(s) rolled back: {', '.join(rolled_back_service_names)}"
+            )
+
+    def deploy_images(
+        self, service_arns: list[str], image_uri_by_repository: dict[str, str]
+    ) -> list[str]:
+        # points all services which use one of the image repositories to the new images.
+        # returns the ARNs of the updated services
+        services = self._describe_services(service_arns)
+        task_definition_arns = sorted({s["taskDefinition"] for s in services})
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                executor.submit(
+                    copy_context().run,
+                    self._register_with_images,
+                    task_definition_arn,
+                    image_uri_by_repository,
+                )
+                for task_definition_arn in task_definition_arns
+            ]
+            new_arn_by_arn = {
+                arn: future.result()
+                for arn, future in zip(task_definition_arns, futures)
+            }
+
+        task_definition_arn_by_service_arn = {
+            service["serviceArn"]: new_arn_by_arn[service["taskDefinition"]]
+            for service in services
+            if new_arn_by_arn[service["taskDefinition"]] is not None
+        }
+        if task_definition_arn_by_service_arn:
+            self._update_services(task_definition_arn_by_service_arn)
+        return list(task_definition_arn_by_service_arn.keys())
+
+    def reconcile(
+        self, service_arns: list[str], stack_task_definition_arns: list[str]
+    ) -> list[str]:
+        # points services back to the task definition of the same family which the stack manages.
+        # returns the ARNs of the updated services
+        stack_arn_by_family = {
+            get_task_definition_family(arn): arn for arn in stack_task_definition_arns
+        }
+        task_definition_arn_by_service_arn = {}
+        for service in self._describe_services(service_arns):
+            stack_arn = stack_arn_by_family.get(
+                get_task_definition_family(service["taskDefinition"])
+            )
+            if stack_arn is not None and stack_arn != service["taskDefinition"]:
+                task_definition_arn_by_service_arn[service["serviceArn"]] = stack_arn
+        if task_definition_arn_by_service_arn:
+            self._update_services(task_definition_arn_by_service_arn)
+        return list(task_definition_arn_by_service_arn.keys())
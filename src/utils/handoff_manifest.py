@@ -0,0 +1,89 @@
+import glob
+import json
+from pathlib import Path
+from src.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+HANDOFF_MANIFEST_VERSION = 1
+PIPELINE_PHASES = ["build", "render", "deploy", "outputs"]
+
+
+class HandoffManifest:
+    # state passed between pipeline phases which run in separate jobs, e.g. a build matrix,
+    # a render job and a final deploy job. manifests of parallel jobs are merged when loaded
+
+    def __init__(self, stack_name: str, git_commit: str):
+        self.stack_name = stack_name
+        self.git_commit = git_commit
+        # phases which contributed to this manifest
+        self.phases: list[str] = []
+        # service name -> {"uri": ..., "digest": ...} of pushed images
+        self.images: dict[str, dict[str, str]] = {}
+        # S3 keys of the uploaded templates by file name
+        self.template_key_by_filename: dict[str, str] | None = None
+        # deployment manifest input fingerprints (e.g. of the rendered templates)
+        self.inputs: dict[str, str | None] = {}
+        # result of the deploy phase: {"stack_updated": ..., "drifted_services": [...]}
+        self.deploy_result: dict | None = None
+
+    def merge(self, manifest: dict, source: str) -> None:
+        if manifest.get("version") != HANDOFF_MANIFEST_VERSION:
+            raise ValueError(
+                f"Unsupported hand-off manifest version {manifest.get('version')} in {source}"
+            )
+        if (
+            manifest["stack_name"] != self.stack_name
+            or manifest["git_commit"] != self.git_commit
+        ):
+            raise ValueError(
+                f"Hand-off manifest {source} belongs to {manifest['stack_name']}@{manifest['git_commit']}, "
+                f"not to {self.stack_name}@{self.git_commit}"
+            )
+        for service_name, image in manifest["images"].items():
+            if service_name in self.images and self.images[service_name] != image:
+                raise ValueError(
+                    f"Conflicting images for service {service_name} in {source}"
+                )
+            self.images[service_name] = image
+        self.phases = [
+            phase
+            for phase in PIPELINE_PHASES
+            if phase in self.phases or phase in manifest["phases"]
+        ]
+        if manifest["template_key_by_filename"] is not None:
+            self.template_key_by_filename = manifest["template_key_by_filename"]
+        self.inputs.update(manifest["inputs"])
+        if manifest["deploy_result"] is not None:
+            self.deploy_result = manifest["deploy_result"]
+
+    def load(self, path_patterns: list[str]) -> None:
+        for path_pattern in path_patterns:
+            paths = sorted(glob.glob(path_pattern))
+            if len(paths) == 0:
+                raise FileNotFoundError(f"No hand-off manifest found at {path_pattern}")
+            for path in paths:
+                with open(path, "r") as fd:
+                    self.merge(json.load(fd), source=path)
+                logger.debug(f"Loaded hand-off manifest {path}")
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("w") as fd:
+            json.dump(
+                {
+                    "version": HANDOFF_MANIFEST_VERSION,
+                    "stack_name": self.stack_name,
+                    "git_commit": self.git_commit,
+                    "phases": self.phases,
+                    "images": self.images,
+                    "template_key_by_filename": self.template_key_by_filename,
+                    "inputs": self.inputs,
+                    "deploy_result": self.deploy_result,
+                },
+                fd,
+                indent=2,
+            )
+        logger.debug(f'Saved hand-off manifest to "{path}"')
@@ -0,0 +1,29 @@
+IMAGE_COMPRESSIONS = ["gzip", "zstd"]
+
+
+def get_image_output_options(compression: str = "gzip") -> dict[str, str]:
+    # options which change the pushed image (not only how it is pushed).
+    # force-compression also recompresses the (gzip) layers of the base image.
+    # zstd layers are only valid in OCI manifests
+    if compression == "gzip":
+        return {}
+    return {
+        "compression": compression,
+        "force-compression": "true",
+        "oci-mediatypes": "true",
+    }
+
+
+def get_image_output(
+    compression: str = "gzip", name: str | None = None, push_by_digest: bool = False
+) -> str:
+    # buildx output which pushes the image to the registry (same as "--push" without options)
+    # https://docs.docker.com/build/exporters/image-registry/
+    attrs = ["type=image"]
+    if name is not None:
+        attrs.append(f"name={name}")
+    if push_by_digest:
+        attrs += ["push-by-digest=true", "name-canonical=true"]
+    attrs.append("push=true")
+    attrs += [f"{k}={v}" for k, v in get_image_output_options(compression).items()]
+    return ",".join(attrs)
@@ -0,0 +1,132 @@
+import base64
+import hashlib
+import urllib.error
+import urllib.request
+from dataclasses import dataclass
+from src.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class UpstreamRegistry:
+    # short name, part of the ECR repository prefix of the cache
+    name: str
+    url: str
+    # "UpstreamRegistry" of the pull through cache rule
+    upstream_registry: str
+    # requires the ARN of a Secrets Manager secret (prefixed with "ecr-pullthroughcache/")
+    requires_credentials: bool = False
+
+
+# upstream registries supported by ECR pull through cache rules, by the registry host of image references
+# https://docs.aws.amazon.com/AmazonECR/latest/userguide/pull-through-cache.html
+UPSTREAM_REGISTRY_BY_HOST = {
+    "public.ecr.aws": UpstreamRegistry("ecr-public", "public.ecr.aws", "ecr-public"),
+    "quay.io": UpstreamRegistry("quay", "quay.io", "quay"),
+    "registry.k8s.io": UpstreamRegistry("k8s", "registry.k8s.io", "k8s"),
+    "docker.io": UpstreamRegistry(
+        "docker-hub", "registry-1.docker.io", "docker-hub", requires_credentials=True
+    ),
+    "ghcr.io": UpstreamRegistry(
+        "ghcr", "ghcr.io", "github-container-registry", requires_credentials=True
+    ),
+    "registry.gitlab.com": UpstreamRegistry(
+        "gitlab",
+        "registry.gitlab.com",
+        "gitlab-container-registry",
+        requires_credentials=True,
+    ),
+}
+DOCKER_HUB_HOST_ALIASES = ["index.docker.io", "registry-1.docker.io"]
+
+MANIFEST_ACCEPT_HEADER = ", ".join(
+    [
+        "application/vnd.oci.image.index.v1+json",
+        "application/vnd.oci.image.manifest.v1+json",
+        "application/vnd.docker.distribution.manifest.list.v2+json",
+        "application/vnd.docker.distribution.manifest.v2+json",
+    ]
+)
+
+
+def parse_image_reference(image: str) -> tuple[str, str, str]:
+    # (registry host, repository, tag and/or digest) with the same defaults as docker,
+    # e.g. "python:3.8" -> ("docker.io", "library/python", ":3.8")
+    name, at, digest = image.partition("@")
+    reference = f"@{digest}" if at else ""
+    if ":" in name.rsplit("/", 1)[-1]:
+        name, _, tag = name.rpartition(":")
+        reference = f":{tag}{reference}"
+    elif not at:
+        reference = ":latest"
+
+    first, _, rest = name.partition("/")
+    if rest and ("." in first or ":" in first or first == "localhost"):
+        host, repository = first, rest
+    else:
+        host, repository = "docker.io", name
+    if host in DOCKER_HUB_HOST_ALIASES:
+        host = "docker.io"
+    if host == "docker.io" and "/" not in repository:
+        repository = f"library/{repository}"
+    return host, repository, reference
+
+
+def get_upstream_registry(image: str) -> UpstreamRegistry | None:
+    host, _, _ = parse_image_reference(image)
+    return UPSTREAM_REGISTRY_BY_HOST.get(host)
+
+
+def get_repository_prefix(upstream: UpstreamRegistry, scope: str) -> str:
+    # rules are per account and region, so the prefix must be unique per stack.
+    # ECR allows at most 30 characters
+    return f"{upstream.name}-{hashlib.sha256(scope.encode()).hexdigest()[:8]}"
+
+
+def get_cached_image_uri(image: str, registry: str, scope: str) -> str:
+    # e.g. "<account>.dkr.ecr.<region>.amazonaws.com/ecr-public-1a2b3c4d/docker/library/python:3.8-slim"
+    host, repository, reference = parse_image_reference(image)
+    prefix = get_repository_prefix(UPSTREAM_REGISTRY_BY_HOST[host], scope)
+    return f"{registry}/{prefix}/{repository}{reference}"
+
+
+def get_pull_through_cache_rule(
+    upstream: UpstreamRegistry, scope: str, credential_arn: str | None = None
+) -> dict:
+    # CloudFormation resource of a pull through cache rule
+    properties = {
+        "EcrRepositoryPrefix": get_repository_prefix(upstream, scope),
+        "UpstreamRegistry": upstream.upstream_registry,
+        "UpstreamRegistryUrl": upstream.url,
+    }
+    if credential_arn is not None:
+        properties["CredentialArn"] = credential_arn
+    return {"Type": "AWS::ECR::PullThroughCacheRule", "Properties": properties}
+
+
+def pull_cached_image_manifest(image_uri: str, username: str, password: str) -> None:
+    # the first pull through the cache creates the repository and imports the image.
+    # ECS task execution roles usually lack the permissions for that (ecr:CreateRepository,
+    # ecr:BatchImportUpstreamImage), so the manifest is pulled once with the deployment's credentials
+    registry, _, name = image_uri.partition("/")
+    _, repository, reference = parse_image_reference(f"{registry}/{name}")
+    # a digest is more specific than a tag
+    reference = reference.rsplit("@", 1)[-1] if "@" in reference else reference[1:]
+    auth_token = base64.b64encode(f"{username}:{password}".encode()).decode()
+    request = urllib.request.Request(
+        f"https://{registry}/v2/{repository}/manifests/{reference}",
+        headers={
+            "Authorization": f"Basic {auth_token}",
+            "Accept": MANIFEST_ACCEPT_HEADER,
+        },
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=60):
+            pass
+    except urllib.error.HTTPError as e:
+        raise ValueError(
+            f"Could not pull {image_uri} through the ECR pull through cache: HTTP {e.code} {e.reason}"
+        )
+    logger.debug(f"Pulled {image_uri} through the ECR pull through cache")
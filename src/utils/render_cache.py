@@ -0,0 +1,165 @@
+import io
+import os
+import shutil
+import tarfile
+from pathlib import Path
+from src.utils.build_cache import get_dir_size
+from src.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+RENDER_CACHE_MODES = ["local", "s3", "none"]
+
+
+def replace_all(text: str, replacements: dict[str, str]) -> str:
+    # replacements are applied in order
+    for old, new in replacements.items():
+        text = text.replace(old, new)
+    return text
+
+
+def copy_dir(
+    source_dir: Path, target_dir: Path, replacements: dict[str, str] | None = None
+) -> None:
+    shutil.copytree(source_dir, target_dir, dirs_exist_ok=True)
+    if not replacements:
+        return
+    # only the copied files, target_dir may contain others
+    for source_path in source_dir.rglob("*"):
+        if source_path.is_file():
+            target_path = target_dir / source_path.relative_to(source_dir)
+            target_path.write_text(replace_all(target_path.read_text(), replacements))
+
+
+class RenderCache:
+    # caches rendered template directories keyed by a hash of all render inputs.
+    # "local" keeps them in cache_dir (which can be persisted with the Actions cache),
+    # "s3" additionally shares them through the ci bucket, e.g. between runners
+
+    def __init__(
+        self,
+        mode: str = "local",
+        cache_dir: str | Path = "/tmp/.render-cache",
+        max_size_mb: int | None = None,
+        s3_client=None,
+        bucket_name: str | None = None,
+        s3_prefix: str | None = None,
+    ):
+        if mode not in RENDER_CACHE_MODES:
+            raise ValueError(
+                f"Invalid render cache mode '{mode}'. Must be one of: {', '.join(RENDER_CACHE_MODES)}"
+            )
+        self.mode = mode
+        self.cache_dir = Path(cache_dir)
+        self.max_size_bytes = (
+            max_size_mb * 1024 * 1024 if max_size_mb is not None else None
+        )
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.s3_prefix = s3_prefix
+
+    def _get_local_dir(self, cache_key: str) -> Path:
+        return self.cache_dir / cache_key
+
+    def _get_s3_key(self, cache_key: str) -> str:
+        return f"{self.s3_prefix}/{cache_key}.tar.gz"
+
+    def _download(self, cache_key: str) -> bool:
+        try:
+            response = self.s3_client.get_object(
+                Bucket=self.bucket_name, Key=self._get_s3_key(cache_key)
+            )
+        except self.s3_client.exceptions.ClientError as e:
+            # the ci bucket doesn't exist yet on the first deployment
+            if e.response.get("Error", {}).get("Code") in [
+                "404",
+                "NoSuchKey",
+                "NoSuchBucket",
+            ]:
+                return False
+            raise
+        tmp_dir = self.cache_dir / f"{cache_key}-tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        with tarfile.open(
+            fileobj=io.BytesIO(response["Body"].read()), mode="r:gz"
+        ) as tar:
+            tar.extractall(tmp_dir, filter="data")
+        os.replace(tmp_dir, self._get_local_dir(cache_key))
+        return True
+
+    def _upload(self, cache_key: str) -> None:
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+            tar.add(self._get_local_dir(cache_key), arcname=".")
+        self.s3_client.put_object(
+            Bucket=self.bucket_name,
+            Key=self._get_s3_key(cache_key),
+            Body=buffer.getvalue(),
+        )
+
+    def restore(
+        self,
+        cache_key: str,
+        target_dir: Path,
+        replacements: dict[str, str] | None = None,
+    ) -> bool:
+        # copies cached templates into target_dir, returns False on a cache miss.
+        # replacements reverse the ones applied by store()
+        if self.mode == "none":
+            return False
+        local_dir = self._get_local_dir(cache_key)
+        if not local_dir.is_dir():
+            if self.mode != "s3" or not self._download(cache_key):
+                logger.debug(f"Render cache miss for {cache_key}")
+                return False
+        copy_dir(local_dir, target_dir, replacements)
+        # mark as recently used for eviction
+        os.utime(local_dir)
+        logger.info(f"Restored rendered templates from render cache ({cache_key[:12]})")
+        return True
+
+    def store(
+        self,
+        cache_key: str,
+        source_dir: Path,
+        replacements: dict[str, str] | None = None,
+    ) -> None:
+        # replacements remove values from the cached templates which are not part of the cache key
+        if self.mode == "none":
+            return
+        local_dir = self._get_local_dir(cache_key)
+        tmp_dir = self.cache_dir / f"{cache_key}-tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        copy_dir(source_dir, tmp_dir, replacements)
+        # entries are written atomically, so that a crashed run never leaves a partial entry
+        shutil.rmtree(local_dir, ignore_errors=True)
+        os.replace(tmp_dir, local_dir)
+        self.evict()
+
+    def upload(self, cache_key: str) -> None:
+        # separate from store() since the ci bucket may not exist yet while rendering
+        if self.mode != "s3" or not self._get_local_dir(cache_key).is_dir():
+            return
+        self._upload(cache_key)
+        logger.debug(f"Uploaded render cache {cache_key[:12]} to S3")
+
+    def evict(self) -> None:
+        # remove least recently used entries until the cache fits into max size
+        if self.max_size_bytes is None or not self.cache_dir.is_dir():
+            return
+        cache_dirs = sorted(
+            [p for p in self.cache_dir.iterdir() if p.is_dir()],
+            key=lambda p: p.stat().st_mtime,
+        )
+        size_by_dir = {p: get_dir_size(p) for p in cache_dirs}
+        total_size = sum(size_by_dir.values())
+        for cache_dir in cache_dirs:
+            if total_size <= self.max_size_bytes:
+                break
+            shutil.rmtree(cache_dir)
+            total_size -= size_by_dir[cache_dir]
+            logger.debug(
+                f"Evicted render cache {cache_dir} ({size_by_dir[cache_dir] // 1024} KB)"
+            )
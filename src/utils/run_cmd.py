@@ -1,17 +1,96 @@
 import asyncio
+import os
+import signal
+from collections import deque
+from typing import Callable
+from src.utils.logger import get_logger
+from src.utils.tracing import tracer
 
 
-async def run_cmd_async(cmd: str, input: bytes | None = None) -> str:
+logger = get_logger(__name__)
+
+
+# max length of a single output line. buildx progress output can contain very long lines
+STREAM_LIMIT = 1024 * 1024
+# number of output lines kept in memory for error reports when streaming
+DEFAULT_TAIL_LINES = 200
+
+
+async def _read_lines(
+    stream: asyncio.StreamReader,
+    buffer: deque,
+    log_prefix: str | None,
+    line_callback: Callable[[str], None] | None,
+) -> None:
+    while True:
+        line_bytes = await stream.readline()
+        if not line_bytes:
+            break
+        line = line_bytes.decode(errors="replace").rstrip("\n")
+        buffer.append(line)
+        if log_prefix is not None:
+            logger.debug(f"{log_prefix}{line}")
+        if line_callback is not None:
+            line_callback(line)
+
+
+async def run_cmd_async(
+    cmd: str,
+    input: bytes | None = None,
+    merge_stderr: bool = False,
+    log_prefix: str | None = None,
+    line_callback: Callable[[str], None] | None = None,
+) -> str:
+    # only the program and subcommand are traced, arguments may contain secrets
+    with tracer.span(" ".join(cmd.split()[:3]), kind="cmd", commands=1):
+        return await _run_cmd_async(cmd, input, merge_stderr, log_prefix, line_callback)
+
+
+async def _run_cmd_async(
+    cmd: str,
+    input: bytes | None,
+    merge_stderr: bool,
+    log_prefix: str | None,
+    line_callback: Callable[[str], None] | None,
+) -> str:
+    # output is read line by line while the process is running.
+    # with a log_prefix, every line is logged immediately and only the last lines are kept in memory
+    # (and returned), otherwise the full stdout is returned.
+    max_lines = DEFAULT_TAIL_LINES if log_prefix is not None else None
+    stdout_lines = deque(maxlen=max_lines)
+    stderr_lines = deque(maxlen=max_lines or DEFAULT_TAIL_LINES)
+
     process = await asyncio.create_subprocess_shell(
         cmd,
         stdin=asyncio.subprocess.PIPE if input else None,
         stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
+        # some tools (e.g. buildx progress output) write everything useful to stderr
+        stderr=asyncio.subprocess.STDOUT if merge_stderr else asyncio.subprocess.PIPE,
+        limit=STREAM_LIMIT,
+        # own process group, so that the shell and all of its children can be killed at once
+        start_new_session=True,
     )
-    if input is not None:
-        stdout, stderr = await process.communicate(input=input)
-    else:
-        stdout, stderr = await process.communicate()
+    try:
+        if input is not None:
+            process.stdin.write(input)
+            await process.stdin.drain()
+            process.stdin.close()
+        readers = [_read_lines(process.stdout, stdout_lines, log_prefix, line_callback)]
+        if not merge_stderr:
+            readers.append(_read_lines(process.stderr, stderr_lines, log_prefix, None))
+        await asyncio.gather(*readers)
+        await process.wait()
+    except asyncio.CancelledError:
+        # e.g. another build failed: don't leave orphaned processes behind
+        if process.returncode is None:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await process.wait()
+        raise
+
     if process.returncode != 0:
-        raise ValueError(f"Command failed: {cmd}\n{stderr.decode()}")
-    return stdout.decode()
+        error_lines = stdout_lines if merge_stderr else stderr_lines
+        raise ValueError(f"Command failed: {cmd}\n" + "\n".join(error_lines))
+    return "\n".join(stdout_lines)
@@ -0,0 +1,126 @@
+import base64
+import hashlib
+import json
+import threading
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from time import monotonic
+from src.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+DEFAULT_MAX_WORKERS = 16
+
+
+@dataclass
+class UploadStats:
+    files_uploaded: int = 0
+    files_skipped: int = 0
+    bytes_uploaded: int = 0
+    bytes_skipped: int = 0
+    elapsed_time: float = 0
+
+    def __str__(self) -> str:
+        return (
+            f"uploaded {self.files_uploaded} file(s) ({self.bytes_uploaded / 1024:.1f} KB), "
+            f"skipped {self.files_skipped} unchanged file(s) ({self.bytes_skipped / 1024:.1f} KB) "
+            f"in {self.elapsed_time:.2f}s"
+        )
+
+
+class S3Uploader:
+    # uploads files concurrently and skips objects whose content already exists in S3.
+    # existing objects are detected by their SHA256 checksum (or MD5 ETag for objects uploaded
+    # without checksum) and, optionally, by a local manifest of previous uploads (no API call at all).
+    # the s3 client is shared by all threads and should allow max_workers pooled connections.
+
+    def __init__(
+        self,
+        s3_client,
+        bucket_name: str,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        manifest_path: Path | None = None,
+    ):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.max_workers = max_workers
+        self.manifest_path = manifest_path
+        self._manifest_lock = threading.Lock()
+        self._manifest = {}
+        if manifest_path is not None and manifest_path.is_file():
+            with manifest_path.open("r") as fd:
+                self._manifest = json.load(fd)
+
+    def _get_remote_checksums(self, s3_key: str) -> tuple[str | None, str | None]:
+        # returns (sha256 as base64, etag) of an existing object or (None, None)
+        try:
+            response = self.s3_client.head_object(
+                Bucket=self.bucket_name, Key=s3_key, ChecksumMode="ENABLED"
+            )
+        except self.s3_client.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ["404", "NoSuchKey"]:
+                return None, None
+            raise
+        return response.get("ChecksumSHA256"), response.get("ETag", "").strip('"')
+
+    def _upload_file(self, s3_key: str, file_path: Path) -> bool:
+        # returns True if the file was uploaded, False if it was skipped
+        body = file_path.read_bytes()
+        sha256 = base64.b64encode(hashlib.sha256(body).digest()).decode()
+        md5 = hashlib.md5(body).hexdigest()
+
+        with self._manifest_lock:
+            if self._manifest.get(s3_key) == sha256:
+                return False
+
+        remote_sha256, remote_etag = self._get_remote_checksums(s3_key)
+        if remote_sha256 == sha256 or (remote_sha256 is None and remote_etag == md5):
+            is_uploaded = False
+        else:
+            self.s3_client.put_object(
+                Bucket=self.bucket_name,
+                Key=s3_key,
+                Body=body,
+                ChecksumAlgorithm="SHA256",
+                ChecksumSHA256=sha256,
+            )
+            is_uploaded = True
+            logger.debug(f'Uploaded "{s3_key}" to S3 bucket "{self.bucket_name}"')
+
+        with self._manifest_lock:
+            self._manifest[s3_key] = sha256
+        return is_uploaded
+
+    def upload_files(self, file_path_by_s3_key: dict[str, Path]) -> UploadStats:
+        start_time = monotonic()
+        stats = UploadStats()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            future_by_s3_key = {
+                s3_key: executor.submit(
+                    copy_context().run, self._upload_file, s3_key, file_path
+                )
+                for s3_key, file_path in file_path_by_s3_key.items()
+            }
+            for s3_key, future in future_by_s3_key.items():
+                file_size = file_path_by_s3_key[s3_key].stat().st_size
+                if future.result():
+                    stats.files_uploaded += 1
+                    stats.bytes_uploaded += file_size
+                else:
+                    stats.files_skipped += 1
+                    stats.bytes_skipped += file_size
+
+        if self.manifest_path is not None:
+            with self.manifest_path.open("w") as fd:
+                json.dump(self._manifest, fd)
+
+        stats.elapsed_time = monotonic() - start_time
+        logger.info(f"S3 upload to bucket {self.bucket_name}: {stats}")
+        return stats
+
+    def upload_file(self, s3_key: str, file_path: Path) -> UploadStats:
+        return self.upload_files({s3_key: file_path})
@@ -0,0 +1,60 @@
+import base64
+import shlex
+import tempfile
+from pathlib import Path
+from src.utils.logger import get_logger
+from src.utils.run_cmd import run_cmd_async
+
+
+logger = get_logger(__name__)
+
+
+class SociIndexer:
+    # creates a SOCI (Seekable OCI) index for pushed images and pushes it to the image's repository,
+    # so that Fargate can start tasks before the whole image is pulled (lazy loading).
+    # requires the soci CLI and containerd (ctr) on the runner.
+    # the registry credentials are passed in a hosts.toml file (readable by its owner only) as header,
+    # so that they don't show up in logs or in the arguments of the process list
+    # https://github.com/awslabs/soci-snapshotter
+    # https://github.com/containerd/containerd/blob/main/docs/hosts.md
+
+    def __init__(self, registry_password: str, registry_username: str = "AWS"):
+        self.registry_username = registry_username
+        self.registry_password = registry_password
+
+    def _write_hosts_dir(self, hosts_dir: Path, registry: str) -> None:
+        auth_token = base64.b64encode(
+            f"{self.registry_username}:{self.registry_password}".encode()
+        ).decode()
+        registry_dir = hosts_dir / registry
+        registry_dir.mkdir(mode=0o700)
+        hosts_path = registry_dir / "hosts.toml"
+        hosts_path.touch(mode=0o600)
+        hosts_path.write_text(
+            f'server = "https://{registry}"\n\n'
+            f'[host."https://{registry}"]\n'
+            f'  capabilities = ["pull", "resolve", "push"]\n'
+            f'  [host."https://{registry}".header]\n'
+            f'    Authorization = "Basic {auth_token}"\n'
+        )
+
+    async def create_and_push(
+        self, image_uri: str, all_platforms: bool = False
+    ) -> None:
+        image_str = shlex.quote(image_uri)
+        platforms_str = "--all-platforms " if all_platforms else ""
+        logger.debug(f"Creating SOCI index for {image_uri} ...")
+        with tempfile.TemporaryDirectory(prefix="soci-hosts-") as hosts_dir:
+            self._write_hosts_dir(Path(hosts_dir), image_uri.split("/")[0])
+            hosts_str = f"--hosts-dir {shlex.quote(hosts_dir)}"
+            # soci indexes images of containerd's content store
+            await run_cmd_async(
+                f"sudo ctr image pull {platforms_str}{hosts_str} {image_str}"
+            )
+            await run_cmd_async(f"sudo soci create {platforms_str}{image_str}")
+            await run_cmd_async(
+                f"sudo soci push {platforms_str}{hosts_str} {image_str}"
+            )
+        # the image is only needed while indexing
+        await run_cmd_async(f"sudo ctr image rm {image_str}")
+        logger.info(f"Pushed SOCI index for {image_uri}")
@@ -0,0 +1,276 @@
+from contextlib import contextmanager
+from time import monotonic, sleep
+from src.utils.logger import get_logger
+from src.utils.stack_status_poller import StackStatusPoller
+
+
+logger = get_logger(__name__)
+
+
+SUCCESS_STATUSES = ["CREATE_COMPLETE", "UPDATE_COMPLETE", "IMPORT_COMPLETE"]
+FAILURE_STATUSES = [
+    "CREATE_FAILED",
+    "ROLLBACK_COMPLETE",
+    "ROLLBACK_FAILED",
+    "UPDATE_FAILED",
+    "UPDATE_ROLLBACK_COMPLETE",
+    "UPDATE_ROLLBACK_FAILED",
+    "DELETE_COMPLETE",
+    "DELETE_FAILED",
+    "IMPORT_ROLLBACK_COMPLETE",
+    "IMPORT_ROLLBACK_FAILED",
+]
+
+
+class StackOperationFailedError(Exception):
+    def __init__(self, stack_name: str, status: str, reasons: list[str]):
+        self.stack_name = stack_name
+        self.status = status
+        self.reasons = reasons
+        message = f"Stack operation failed with status: {status}"
+        if reasons:
+            message += "\n  " + "\n  ".join(reasons)
+        super().__init__(message)
+
+
+def _is_stack_event(event: dict) -> bool:
+    # events of the stack itself (as opposed to events of its resources)
+    return (
+        event["ResourceType"] == "AWS::CloudFormation::Stack"
+        and event.get("PhysicalResourceId") == event["StackId"]
+    )
+
+
+def _is_cancelled_event(event: dict) -> bool:
+    # resources that failed only because a sibling failed first
+    reason = event.get("ResourceStatusReason", "") or ""
+    return "cancelled" in reason.lower()
+
+
+def _is_failing_status(status: str) -> bool:
+    return status.endswith("ROLLBACK_IN_PROGRESS") or status.endswith("_FAILED")
+
+
+def _format_event(event: dict) -> str:
+    reason = event.get("ResourceStatusReason")
+    return (
+        f"{event['StackName']} | {event['LogicalResourceId']} ({event['ResourceType']}) "
+        f"{event['ResourceStatus']}" + (f": {reason}" if reason else "")
+    )
+
+
+class _StackEventTail:
+    # cursors of the root stack and of all nested stacks that changed during the operation
+    def __init__(self, stack_name: str, after_event_id: str | None):
+        self.stack_name = stack_name
+        self.cursor_by_stack_id = {stack_name: after_event_id}
+        self.since_by_stack_id = {}
+        self.finished_stack_ids = set()
+        self.failure_reasons = []
+        self.last_status = None
+        # id and timestamp of the first event of the root stack in this operation
+        self.stack_id = None
+        self.started_at = None
+
+
+class StackEventWaiter:
+    # waits for a stack operation by tailing its events instead of polling its status.
+    # only events newer than the cursor (the last event seen before the operation started)
+    # are processed, the operation is finished as soon as the terminal event of the root stack appears.
+    # with a shared StackStatusPoller, the terminal status is taken from the poller and
+    # events are only tailed (with backoff) to stream progress and collect failure reasons.
+
+    def __init__(
+        self,
+        cf_client,
+        min_poll_interval: float = 1,
+        max_poll_interval: float = 15,
+        backoff_factor: float = 1.5,
+        fail_fast: bool = False,
+        stream_nested_stacks: bool = True,
+        status_poller: StackStatusPoller | None = None,
+    ):
+        self.cf_client = cf_client
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff_factor = backoff_factor
+        self.fail_fast = fail_fast
+        self.stream_nested_stacks = stream_nested_stacks
+        self.status_poller = status_poller
+
+    def get_latest_event_id(self, stack_name: str) -> str | None:
+        try:
+            response = self.cf_client.describe_stack_events(StackName=stack_name)
+        except self.cf_client.exceptions.ClientError as e:
+            if "does not exist" in str(e):
+                return None
+            raise
+        events = response.get("StackEvents", [])
+        return events[0]["EventId"] if events else None
+
+    def _get_new_events(
+        self, stack_id: str, after_event_id: str | None, since=None
+    ) -> list[dict]:
+        # returns all events newer than after_event_id in chronological order.
+        # without a cursor, only the newest page is read and filtered by timestamp
+        new_events = []
+        params = {"StackName": stack_id}
+        while True:
+            response = self.cf_client.describe_stack_events(**params)
+            for event in response.get("StackEvents", []):
+                # events are returned newest first
+                if event["EventId"] == after_event_id:
+                    return list(reversed(new_events))
+                if since is not None and event["Timestamp"] < since:
+                    return list(reversed(new_events))
+                new_events.append(event)
+            if "NextToken" not in response or after_event_id is None:
+                return list(reversed(new_events))
+            params["NextToken"] = response["NextToken"]
+
+    def _poll_events(self, tail: _StackEventTail) -> tuple[bool, str | None]:
+        # reads new events of all tracked stacks.
+        # returns (whether there were new events, terminal status of the root stack if reached)
+        has_new_events = False
+        for stack_id in list(tail.cursor_by_stack_id.keys()):
+            events = self._get_new_events(
+                stack_id,
+                tail.cursor_by_stack_id[stack_id],
+                since=tail.since_by_stack_id.get(stack_id),
+            )
+            if stack_id in tail.finished_stack_ids:
+                # nested stack finished in the previous poll, this was its last read
+                tail.cursor_by_stack_id.pop(stack_id)
+            if not events:
+                continue
+            has_new_events = True
+            if stack_id in tail.cursor_by_stack_id:
+                tail.cursor_by_stack_id[stack_id] = events[-1]["EventId"]
+
+            for event in events:
+                logger.debug(_format_event(event))
+                status = event["ResourceStatus"]
+                if status.endswith("_FAILED") and not _is_cancelled_event(event):
+                    tail.failure_reasons.append(_format_event(event))
+                    if self.fail_fast:
+                        raise StackOperationFailedError(
+                            tail.stack_name, status, tail.failure_reasons
+                        )
+
+                if _is_stack_event(event):
+                    if stack_id != tail.stack_name:
+                        continue
+                    if tail.started_at is None:
+                        tail.stack_id = event["StackId"]
+                        tail.started_at = event["Timestamp"]
+                    # terminal event of the root stack
+                    tail.last_status = status
+                    if status in SUCCESS_STATUSES or status in FAILURE_STATUSES:
+                        return has_new_events, status
+                elif (
+                    self.stream_nested_stacks
+                    and event["ResourceType"] == "AWS::CloudFormation::Stack"
+                    and event.get("PhysicalResourceId")
+                ):
+                    nested_stack_id = event["PhysicalResourceId"]
+                    if status.endswith("_IN_PROGRESS"):
+                        if nested_stack_id not in tail.cursor_by_stack_id:
+                            # start tailing the nested stack from this point in time
+                            tail.cursor_by_stack_id[nested_stack_id] = None
+                            tail.since_by_stack_id[nested_stack_id] = event["Timestamp"]
+                            tail.finished_stack_ids.discard(nested_stack_id)
+                    elif nested_stack_id in tail.cursor_by_stack_id:
+                        tail.finished_stack_ids.add(nested_stack_id)
+        return has_new_events, None
+
+    def _get_polled_status(self, tail: _StackEventTail) -> str | None:
+        # returns the terminal status of the root stack as seen by the shared status poller.
+        # with fail_fast, a failing nested stack counts as terminal failure of the root stack
+        # (the poller does not list stacks which are still in progress)
+        summary = self.status_poller.get_stack_summary(tail.stack_name)
+        if summary is not None:
+            status = summary["StackStatus"]
+            tail.last_status = status
+            if status in SUCCESS_STATUSES or status in FAILURE_STATUSES:
+                return status
+            if self.fail_fast and _is_failing_status(status):
+                return status
+        if self.fail_fast and tail.started_at is not None:
+            # nested stacks keep the status of earlier failed operations,
+            # only the ones changed by this operation count
+            for s in self.status_poller.get_nested_stack_summaries(tail.stack_id):
+                changed_at = s.get("LastUpdatedTime") or s["CreationTime"]
+                if (
+                    _is_failing_status(s["StackStatus"])
+                    and changed_at >= tail.started_at
+                ):
+                    return s["StackStatus"]
+        return None
+
+    @contextmanager
+    def _status_subscription(self):
+        # yields the last tick of the status poller which is older than the operation
+        if self.status_poller is None:
+            yield None
+        else:
+            with self.status_poller.subscription() as start_tick:
+                yield start_tick
+
+    def wait(
+        self,
+        stack_name: str,
+        after_event_id: str | None,
+        timeout: float = 2 * 60 * 60,  # in seconds
+    ) -> str:
+        # returns the final stack status or raises StackOperationFailedError
+        start_time = monotonic()
+        tail = _StackEventTail(stack_name, after_event_id)
+        poll_interval = self.min_poll_interval
+        next_event_poll_time = start_time
+
+        with self._status_subscription() as tick:
+            while monotonic() - start_time < timeout:
+                final_status = None
+                if self.status_poller is not None:
+                    polled_tick = self.status_poller.wait_for_tick(
+                        tick, timeout=self.max_poll_interval
+                    )
+                    # without a poll newer than the start of the operation, the statuses may be
+                    # the ones of the previous operation: only the events are checked then
+                    if polled_tick is not None:
+                        tick = polled_tick
+                        final_status = self._get_polled_status(tail)
+
+                if final_status is not None or monotonic() >= next_event_poll_time:
+                    # the final event poll also collects the failure reasons
+                    has_new_events, event_status = self._poll_events(tail)
+                    final_status = final_status or event_status
+                    # poll quickly while things are happening, back off during long waits
+                    # (e.g. ECS service stabilisation)
+                    if has_new_events:
+                        poll_interval = self.min_poll_interval
+                    else:
+                        poll_interval = min(
+                            self.max_poll_interval, poll_interval * self.backoff_factor
+                        )
+                    next_event_poll_time = monotonic() + poll_interval
+
+                if final_status in SUCCESS_STATUSES:
+                    logger.debug(
+                        f"Stack operation finished with status: {final_status}"
+                    )
+                    return final_status
+                if final_status is not None:
+                    if tail.finished_stack_ids & tail.cursor_by_stack_id.keys():
+                        # read the last events of nested stacks that just failed
+                        self._poll_events(tail)
+                    raise StackOperationFailedError(
+                        stack_name, final_status, tail.failure_reasons
+                    )
+
+                if self.status_poller is None:
+                    sleep(poll_interval)
+
+        raise TimeoutError(
+            f"Timed out waiting for stack operation to complete. Last known status: {tail.last_status}"
+        )
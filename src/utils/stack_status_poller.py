@@ -0,0 +1,148 @@
+import threading
+from contextlib import contextmanager
+from contextvars import copy_context
+from time import sleep
+from src.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# the statuses checked by StackEventWaiter: terminal statuses of root stacks and failures in progress.
+# stacks in other statuses (e.g. in progress or deleted) are not listed, which keeps the pages per tick low
+LIST_STACKS_STATUS_FILTER = [
+    "CREATE_COMPLETE",
+    "UPDATE_COMPLETE",
+    "IMPORT_COMPLETE",
+    "CREATE_FAILED",
+    "ROLLBACK_IN_PROGRESS",
+    "ROLLBACK_FAILED",
+    "ROLLBACK_COMPLETE",
+    "DELETE_FAILED",
+    "UPDATE_FAILED",
+    "UPDATE_ROLLBACK_IN_PROGRESS",
+    "UPDATE_ROLLBACK_FAILED",
+    "UPDATE_ROLLBACK_COMPLETE",
+    "IMPORT_ROLLBACK_IN_PROGRESS",
+    "IMPORT_ROLLBACK_FAILED",
+    "IMPORT_ROLLBACK_COMPLETE",
+]
+
+
+class StackStatusPoller:
+    # polls the status of all stacks of a region with one paginated list_stacks call per tick
+    # and shares the result with all waiters, so that the number of API calls per tick
+    # does not grow with the number of stacks being waited on.
+    # the polling thread only runs while there is at least one subscriber.
+    # its API calls are traced as part of the oldest subscriber's span
+
+    _poller_by_key: dict[tuple[str, str], "StackStatusPoller"] = {}
+    _registry_lock = threading.Lock()
+
+    @classmethod
+    def get_shared(cls, cf_client, account_id: str) -> "StackStatusPoller":
+        # one poller per account and region: a poller lists the stacks with the credentials
+        # of the client which created it
+        key = (account_id, cf_client.meta.region_name)
+        with cls._registry_lock:
+            if key not in cls._poller_by_key:
+                cls._poller_by_key[key] = cls(cf_client)
+            return cls._poller_by_key[key]
+
+    def __init__(self, cf_client, interval: float = 3):
+        self.cf_client = cf_client
+        self.interval = interval
+        self._condition = threading.Condition()
+        self._summary_by_name = {}
+        self._summary_by_id = {}
+        self._tick = 0
+        # a poll is running, its result will be the next tick
+        self._is_polling = False
+        self._error = None
+        # context of every subscriber, oldest first
+        self._subscriber_contexts = []
+        self._thread = None
+
+    @contextmanager
+    def subscription(self):
+        # yields the last tick which may hold statuses from before subscribing.
+        # a poll which is already running started before the caller's operation, so it is skipped, too
+        context = copy_context()
+        with self._condition:
+            start_tick = self._tick + 1 if self._is_polling else self._tick
+            self._subscriber_contexts.append(context)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        try:
+            yield start_tick
+        finally:
+            with self._condition:
+                # contexts with the same variables compare equal
+                self._subscriber_contexts = [
+                    c for c in self._subscriber_contexts if c is not context
+                ]
+
+    def _list_stacks(self) -> list[dict]:
+        summaries = []
+        paginator = self.cf_client.get_paginator("list_stacks")
+        for page in paginator.paginate(StackStatusFilter=LIST_STACKS_STATUS_FILTER):
+            summaries.extend(page["StackSummaries"])
+        return summaries
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if len(self._subscriber_contexts) == 0:
+                    # the statuses would be stale by the next subscription
+                    self._thread = None
+                    self._summary_by_name = {}
+                    self._summary_by_id = {}
+                    self._error = None
+                    return
+                self._is_polling = True
+                context = self._subscriber_contexts[0]
+            try:
+                summaries = context.run(self._list_stacks)
+                error = None
+            except Exception as e:
+                summaries = None
+                error = e
+                logger.warning(f"Failed to poll stack statuses: {e}")
+            with self._condition:
+                if summaries is not None:
+                    self._summary_by_name = {s["StackName"]: s for s in summaries}
+                    self._summary_by_id = {s["StackId"]: s for s in summaries}
+                self._error = error
+                self._is_polling = False
+                self._tick += 1
+                self._condition.notify_all()
+            sleep(self.interval)
+
+    def wait_for_tick(
+        self, after_tick: int, timeout: float | None = None
+    ) -> int | None:
+        # blocks until a poll newer than after_tick finished and returns its tick number.
+        # returns None if there was none within the timeout (e.g. slow pagination)
+        with self._condition:
+            if not self._condition.wait_for(
+                lambda: self._tick > after_tick, timeout=timeout
+            ):
+                return None
+            if self._error is not None:
+                raise self._error
+            return self._tick
+
+    def get_stack_summary(self, stack_name_or_id: str) -> dict | None:
+        with self._condition:
+            return self._summary_by_id.get(
+                stack_name_or_id
+            ) or self._summary_by_name.get(stack_name_or_id)
+
+    def get_nested_stack_summaries(self, root_stack_id: str) -> list[dict]:
+        with self._condition:
+            return [
+                s
+                for s in self._summary_by_id.values()
+                if s.get("RootId") == root_stack_id
+            ]
@@ -0,0 +1,114 @@
+import asyncio
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import Any, Awaitable, Callable
+from src.utils.logger import get_logger
+from src.utils.tracing import tracer
+
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class Task:
+    name: str
+    func: Callable[[], Awaitable[Any]]
+    depends_on: list[str] = field(default_factory=list)
+    start_time: float | None = None
+    end_time: float | None = None
+
+    @property
+    def duration(self) -> float:
+        if self.start_time is None or self.end_time is None:
+            return 0
+        return self.end_time - self.start_time
+
+
+def run_if(
+    condition: Callable[[], bool], func: Callable[[], Awaitable[Any]]
+) -> Callable[[], Awaitable[Any]]:
+    # wraps a task function so that it is skipped (returning None) unless the condition,
+    # evaluated once the task's dependencies finished, is true
+    async def run_task():
+        if not condition():
+            return None
+        return await func()
+
+    return run_task
+
+
+class TaskGraph:
+    # runs async tasks concurrently, each one as soon as all of its dependencies finished.
+    # blocking functions should be wrapped with asyncio.to_thread so that they can overlap.
+
+    def __init__(self):
+        self.tasks: dict[str, Task] = {}
+        self.results: dict[str, Any] = {}
+        self.start_time: float | None = None
+        self.end_time: float | None = None
+
+    def add_task(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[Any]],
+        depends_on: list[str] | None = None,
+    ) -> None:
+        if name in self.tasks:
+            raise ValueError(f"Task '{name}' already exists")
+        for dependency in depends_on or []:
+            if dependency not in self.tasks:
+                # tasks must be added after their dependencies, which also rules out cycles
+                raise ValueError(f"Unknown dependency '{dependency}' of task '{name}'")
+        self.tasks[name] = Task(name=name, func=func, depends_on=depends_on or [])
+
+    async def _run_task(self, task: Task, future_by_name: dict[str, asyncio.Future]):
+        await asyncio.gather(*[future_by_name[d] for d in task.depends_on])
+        task.start_time = monotonic()
+        logger.debug(f"Task '{task.name}' started")
+        with tracer.span(task.name, kind="phase"):
+            self.results[task.name] = await task.func()
+        task.end_time = monotonic()
+        logger.debug(f"Task '{task.name}' finished in {task.duration:.1f}s")
+
+    async def run(self) -> dict[str, Any]:
+        self.start_time = monotonic()
+        future_by_name = {}
+        # tasks are stored in dependency order, so all dependency futures exist already
+        for task in self.tasks.values():
+            future_by_name[task.name] = asyncio.ensure_future(
+                self._run_task(task, future_by_name)
+            )
+        try:
+            await asyncio.gather(*future_by_name.values())
+        except BaseException:
+            for future in future_by_name.values():
+                future.cancel()
+            await asyncio.gather(*future_by_name.values(), return_exceptions=True)
+            raise
+        self.end_time = monotonic()
+        self.log_critical_path()
+        return self.results
+
+    def get_critical_path(self) -> list[Task]:
+        # the chain of tasks that determined the total run time: starting at the task that
+        # finished last, follow the dependency that finished last
+        finished_tasks = [t for t in self.tasks.values() if t.end_time is not None]
+        if not finished_tasks:
+            return []
+        task = max(finished_tasks, key=lambda t: t.end_time)
+        path = [task]
+        while task.depends_on:
+            task = max(
+                [self.tasks[d] for d in task.depends_on], key=lambda t: t.end_time
+            )
+            path.append(task)
+        return list(reversed(path))
+
+    def log_critical_path(self) -> None:
+        total_time = (self.end_time or monotonic()) - self.start_time
+        critical_path = self.get_critical_path()
+        critical_time = sum(t.duration for t in critical_path)
+        logger.info(
+            f"Finished in {total_time:.1f}s. Critical path ({critical_time:.1f}s): "
+            + " -> ".join(f"{t.name} ({t.duration:.1f}s)" for t in critical_path)
+        )
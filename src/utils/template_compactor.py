@@ -0,0 +1,116 @@
+from collections import Counter
+
+
+HOISTED_MAPPING_NAME = "CompactedLiterals"
+HOISTED_MAPPING_KEY = "Values"
+# a Fn::FindInMap reference takes ~70 bytes, shorter literals are not worth hoisting
+HOIST_MIN_LENGTH = 128
+# CloudFormation allows at most 200 attributes per mapping
+HOIST_MAX_LITERALS = 200
+
+
+def _is_intrinsic_function(value) -> bool:
+    # intrinsic functions are objects with a single key, e.g. {"Ref": "Name"}
+    if not isinstance(value, dict) or len(value) != 1:
+        return False
+    key = next(iter(value))
+    return key in ["Ref", "Condition"] or key.startswith("Fn::")
+
+
+def strip_null_properties(value):
+    # removes properties with a null value, which CloudFormation treats like absent ones.
+    # empty lists and maps are kept: on update, e.g. "Tags: []" clears the tags, while an absent
+    # property leaves them unchanged.
+    # arguments of intrinsic functions are left untouched, e.g. {"Fn::If": [..., {}, ...]}
+    if _is_intrinsic_function(value):
+        return value
+    if isinstance(value, dict):
+        stripped = {}
+        for key, item in value.items():
+            item = strip_null_properties(item)
+            if item is not None:
+                stripped[key] = item
+        return stripped
+    if isinstance(value, list):
+        return [strip_null_properties(item) for item in value]
+    return value
+
+
+def _iter_hoistable_literals(value):
+    # literal strings which may be replaced by Fn::FindInMap. intrinsic functions are skipped since
+    # most of their arguments (e.g. the string of Fn::Sub or the name of a Ref) must be literals
+    if _is_intrinsic_function(value):
+        return
+    if isinstance(value, dict):
+        for item in value.values():
+            yield from _iter_hoistable_literals(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _iter_hoistable_literals(item)
+    elif isinstance(value, str) and len(value) >= HOIST_MIN_LENGTH:
+        yield value
+
+
+def _replace_literals(value, ref_by_literal: dict[str, dict]):
+    if _is_intrinsic_function(value):
+        return value
+    if isinstance(value, dict):
+        return {k: _replace_literals(v, ref_by_literal) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_replace_literals(v, ref_by_literal) for v in value]
+    if isinstance(value, str) and value in ref_by_literal:
+        return ref_by_literal[value]
+    return value
+
+
+def hoist_repeated_literals(cf_template: dict) -> dict:
+    # moves long strings which occur more than once in the resource properties of a template
+    # (e.g. policy documents or log configurations rendered as JSON strings) into a mapping.
+    # mappings can only hold strings, so repeated objects can't be hoisted
+    if HOISTED_MAPPING_NAME in cf_template.get("Mappings", {}):
+        return cf_template
+    resources = cf_template.get("Resources", {})
+    literal_counts = Counter(
+        literal
+        for resource in resources.values()
+        for literal in _iter_hoistable_literals(resource.get("Properties", {}))
+    )
+    # hoist the literals with the largest savings first
+    repeated_literals = sorted(
+        [literal for literal, count in literal_counts.items() if count > 1],
+        key=lambda literal: len(literal) * literal_counts[literal],
+        reverse=True,
+    )[:HOIST_MAX_LITERALS]
+    if len(repeated_literals) == 0:
+        return cf_template
+
+    ref_by_literal = {}
+    values = {}
+    for i, literal in enumerate(repeated_literals):
+        attribute_name = f"L{i}"
+        values[attribute_name] = literal
+        ref_by_literal[literal] = {
+            "Fn::FindInMap": [HOISTED_MAPPING_NAME, HOISTED_MAPPING_KEY, attribute_name]
+        }
+    for resource in resources.values():
+        if "Properties" in resource:
+            resource["Properties"] = _replace_literals(
+                resource["Properties"], ref_by_literal
+            )
+    cf_template.setdefault("Mappings", {})[HOISTED_MAPPING_NAME] = {
+        HOISTED_MAPPING_KEY: values
+    }
+    return cf_template
+
+
+def compact_templates(
+    cf_template_by_filename: dict[str, dict], hoist_literals: bool = False
+) -> dict[str, dict]:
+    # template_modifier for Deployment._cf_update
+    for filename, cf_template in cf_template_by_filename.items():
+        for resource in cf_template.get("Resources", {}).values():
+            if "Properties" in resource:
+                resource["Properties"] = strip_null_properties(resource["Properties"])
+        if hoist_literals:
+            cf_template_by_filename[filename] = hoist_repeated_literals(cf_template)
+    return cf_template_by_filename
@@ -0,0 +1,270 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from time import time
+from urllib.parse import urlencode
+
+
+SERVICE_NAME = "deploy-compose-to-aws"
+# counters aggregated over all descendants of a span in reports
+SPAN_COUNTERS = ["api_calls", "retries", "bytes_sent", "bytes_received", "commands"]
+
+
+@dataclass
+class Span:
+    name: str
+    kind: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    start_time: float
+    end_time: float | None = None
+    attributes: dict = field(default_factory=dict)
+    error: str | None = None
+
+    @property
+    def duration(self) -> float:
+        if self.end_time is None:
+            return 0
+        return self.end_time - self.start_time
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    # records spans of deployment phases, subprocesses and AWS API calls.
+    # the current span is a context variable, so it follows asyncio tasks and asyncio.to_thread.
+    # plain threads (e.g. thread pools) have to run in a copy of the caller's context to be attributed
+
+    def __init__(self):
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+
+    def start_span(self, name: str, kind: str = "internal", **attributes) -> Span:
+        parent = _current_span.get()
+        span = Span(
+            name=name,
+            kind=kind,
+            trace_id=parent.trace_id if parent is not None else os.urandom(16).hex(),
+            span_id=os.urandom(8).hex(),
+            parent_id=parent.span_id if parent is not None else None,
+            start_time=time(),
+            attributes=attributes,
+        )
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def end_span(self, span: Span, error: BaseException | None = None) -> None:
+        span.end_time = time()
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+
+    @contextmanager
+    def span(self, name: str, kind: str = "internal", **attributes):
+        span = self.start_span(name, kind, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            self.end_span(span, error=e)
+            raise
+        else:
+            self.end_span(span)
+        finally:
+            _current_span.reset(token)
+
+    def get_descendants(self, root: Span) -> list[Span]:
+        with self._lock:
+            spans = list(self.spans)
+        children_by_parent_id = {}
+        for span in spans:
+            children_by_parent_id.setdefault(span.parent_id, []).append(span)
+        descendants = []
+        stack = [root]
+        while stack:
+            span = stack.pop()
+            children = children_by_parent_id.get(span.span_id, [])
+            descendants.extend(children)
+            stack.extend(children)
+        return descendants
+
+    def get_counters(self, root: Span) -> dict[str, int]:
+        counters = {name: 0 for name in SPAN_COUNTERS}
+        for span in [root] + self.get_descendants(root):
+            for name in SPAN_COUNTERS:
+                counters[name] += span.attributes.get(name, 0)
+        return counters
+
+
+tracer = Tracer()
+
+
+def _get_body_size(body) -> int:
+    # size of a request body before serialization: bytes, query parameters or a seekable stream
+    if isinstance(body, (bytes, str)):
+        return len(body)
+    if isinstance(body, dict):
+        return len(urlencode(body, doseq=True))
+    if hasattr(body, "seek") and hasattr(body, "tell"):
+        position = body.tell()
+        size = body.seek(0, os.SEEK_END) - position
+        body.seek(position)
+        return size
+    return 0
+
+
+def instrument_client(client):
+    # records a span for every API call of a boto3 client
+    service_name = client.meta.service_model.service_name
+
+    def before_call(model, params, context, **kwargs):
+        context["trace_span"] = tracer.start_span(
+            f"{service_name}.{model.name}",
+            kind="aws",
+            api_calls=1,
+            bytes_sent=_get_body_size(params.get("body")),
+        )
+
+    def after_call(http_response, parsed, context, **kwargs):
+        span = context.get("trace_span")
+        if span is None:
+            return
+        metadata = parsed.get("ResponseMetadata", {})
+        span.attributes["retries"] = metadata.get("RetryAttempts", 0)
+        span.attributes["bytes_received"] = int(
+            http_response.headers.get("Content-Length", 0)
+        )
+        tracer.end_span(span)
+
+    def after_call_error(exception, context, **kwargs):
+        span = context.get("trace_span")
+        if span is not None:
+            tracer.end_span(span, error=exception)
+
+    client.meta.events.register("before-call.*.*", before_call)
+    client.meta.events.register("after-call.*.*", after_call)
+    client.meta.events.register("after-call-error.*.*", after_call_error)
+    return client
+
+
+def write_timings_json(root: Span, path: Path) -> None:
+    with path.open("w") as fd:
+        json.dump(
+            {
+                **root.to_dict(),
+                "counters": tracer.get_counters(root),
+                "spans": [s.to_dict() for s in tracer.get_descendants(root)],
+            },
+            fd,
+            indent=2,
+        )
+
+
+def _format_bytes(size: int) -> str:
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f} MB"
+    return f"{size / 1024:.1f} KB"
+
+
+def get_summary_markdown(root: Span) -> str:
+    phases = sorted(
+        [s for s in tracer.get_descendants(root) if s.kind == "phase"],
+        key=lambda s: s.start_time,
+    )
+    lines = [
+        f"### Deployment timings: {root.attributes.get('stack_name', root.name)}",
+        "",
+        "| Phase | Start | Duration | AWS API calls | Retries | Sent | Received | Commands |",
+        "| --- | ---: | ---: | ---: | ---: | ---: | ---: | ---: |",
+    ]
+    for span in phases + [root]:
+        counters = tracer.get_counters(span)
+        name = "**total**" if span is root else span.name
+        if span.error is not None:
+            name += " (failed)"
+        lines.append(
+            f"| {name} | {span.start_time - root.start_time:.1f}s | {span.duration:.1f}s "
+            f"| {counters['api_calls']} | {counters['retries']} "
+            f"| {_format_bytes(counters['bytes_sent'])} | {_format_bytes(counters['bytes_received'])} "
+            f"| {counters['commands']} |"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def _to_otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def write_otlp_json(root: Span, path: Path) -> None:
+    # OTLP/JSON trace export (as accepted by the OpenTelemetry collector's file receiver)
+    otlp_spans = []
+    for span in [root] + tracer.get_descendants(root):
+        otlp_span = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            # SPAN_KIND_CLIENT for API calls and commands, SPAN_KIND_INTERNAL otherwise
+            "kind": 3 if span.kind in ["aws", "cmd"] else 1,
+            "startTimeUnixNano": str(int(span.start_time * 1e9)),
+            "endTimeUnixNano": str(int((span.end_time or span.start_time) * 1e9)),
+            "attributes": [
+                {"key": key, "value": _to_otlp_value(value)}
+                for key, value in {"span.kind": span.kind, **span.attributes}.items()
+            ],
+            # STATUS_CODE_ERROR / STATUS_CODE_OK
+            "status": (
+                {"code": 2, "message": span.error}
+                if span.error is not None
+                else {"code": 1}
+            ),
+        }
+        if span.parent_id is not None:
+            otlp_span["parentSpanId"] = span.parent_id
+        otlp_spans.append(otlp_span)
+
+    with path.open("w") as fd:
+        json.dump(
+            {
+                "resourceSpans": [
+                    {
+                        "resource": {
+                            "attributes": [
+                                {
+                                    "key": "service.name",
+                                    "value": {"stringValue": SERVICE_NAME},
+                                }
+                            ]
+                        },
+                        "scopeSpans": [
+                            {"scope": {"name": __name__}, "spans": otlp_spans}
+                        ],
+                    }
+                ]
+            },
+            fd,
+        )
@@ -0,0 +1,26 @@
+import json
+import yaml
+
+# the libyaml based C loader and dumper are several times faster than the pure python ones
+try:
+    from yaml import CSafeDumper as SafeDumper, CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
+
+
+TEMPLATE_FORMATS = ["yaml", "json"]
+
+
+def yaml_load(stream):
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def yaml_dump(data, stream=None):
+    return yaml.dump(data, stream, Dumper=SafeDumper)
+
+
+def dump_template(cf_template: dict, template_format: str = "yaml") -> str:
+    # CloudFormation detects the format by content, so JSON templates can keep their .yaml filename
+    if template_format == "json":
+        return json.dumps(cf_template, separators=(",", ":"), ensure_ascii=False)
+    return yaml_dump(cf_template)